@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AgentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm_system.agents'
+
+    def ready(self):
+        from crm_system.agents import signals  # noqa: F401
@@ -0,0 +1,67 @@
+from django.core.cache import cache
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Value, Window
+from django.db.models.functions import Cast, Coalesce, NullIf, Rank
+from django.utils.functional import cached_property
+
+from crm_system.agents.models import Agent
+from crm_system.agents.tenancy import get_organisation_version
+from crm_system.leads.models import FollowUp
+
+LEADERBOARD_TIMEOUT = 3600
+
+
+def leaderboard_queryset(organisation_id):
+    """
+    The organisation's agents with their lead figures, best converters first,
+    in a single grouped query: open, converted and total leads, conversion
+    rate, date of the last follow-up on their leads and ``rank``.
+    """
+    converted = Q(lead__category__is_converted=True)
+    last_followup = FollowUp.objects.filter(lead__agent=OuterRef('pk')).order_by('-date_added').values('date_added')
+    return (
+        Agent.objects.filter(organisation_id=organisation_id)
+        .select_related('user')
+        .annotate(
+            total_leads=Count('lead'),
+            converted_leads=Count('lead', filter=converted),
+            open_leads=Count('lead', filter=~converted),
+            conversion_rate=Coalesce(
+                Cast('converted_leads', FloatField()) / NullIf(F('total_leads'), 0), Value(0.0)
+            ),
+            last_followup=Subquery(last_followup[:1]),
+        )
+        .annotate(rank=Window(Rank(), order_by=[F('conversion_rate').desc(), F('converted_leads').desc()]))
+        .order_by('rank', 'user__username')
+    )
+
+
+class AgentLeaderboard:
+    """
+    The ranked agents of an organisation, cached under its data version so
+    any change to its leads, follow-ups or agents recomputes it. Like a
+    queryset, nothing is fetched until it is iterated.
+    """
+
+    def __init__(self, organisation_id):
+        self.organisation_id = organisation_id
+
+    @cached_property
+    def _rows(self):
+        key = f'leaderboard:{self.organisation_id}:{get_organisation_version(self.organisation_id)}'
+        rows = cache.get(key)
+        if rows is None:
+            rows = list(leaderboard_queryset(self.organisation_id))
+            cache.set(key, rows, LEADERBOARD_TIMEOUT)
+        return rows
+
+    def get(self, agent_id):
+        return next((agent for agent in self._rows if agent.pk == agent_id), None)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __bool__(self):
+        return bool(self._rows)
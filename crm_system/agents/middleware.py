@@ -0,0 +1,11 @@
+from django.utils.deprecation import MiddlewareMixin
+
+from crm_system.agents.tenancy import get_session_tenant
+
+
+class TenantMiddleware(MiddlewareMixin):
+    """Resolve the organisation and role of the logged in user once per session."""
+
+    def process_request(self, request):
+        if request.user.is_authenticated:
+            request.user.tenant = get_session_tenant(request.session, request.user)
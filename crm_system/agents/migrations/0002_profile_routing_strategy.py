@@ -0,0 +1,18 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='routing_strategy',
+            field=models.CharField(blank=True, choices=[('', 'Assign manually'), ('round_robin', 'Round robin'), ('least_open', 'Fewest open leads'), ('category_affinity', 'Category affinity')], default='', max_length=20),
+        ),
+    ]
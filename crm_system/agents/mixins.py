@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import redirect
 
@@ -8,3 +9,29 @@ class OrganizerLoginRequiredMixin(LoginRequiredMixin):
         if not request.user.is_authenticated or not request.user.is_organizer:
             return redirect('leads:lead-list')
         return super().dispatch(request, *args, **kwargs)
+
+
+class OrganisationQuerysetMixin:
+    """Limit the view's queryset to the objects the current user may see in their organisation."""
+    def get_queryset(self):
+        return self.model.objects.for_user(self.request.user)
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """LoginRequiredMixin for views whose handlers are coroutines."""
+    async def dispatch(self, request, *args, **kwargs):
+        # request.user is lazy and may still need the session and user queries.
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return self.handle_no_permission()
+        if not self.has_access(request.user):
+            return redirect('leads:lead-list')
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+    def has_access(self, user):
+        return True
+
+
+class AsyncOrganizerLoginRequiredMixin(AsyncLoginRequiredMixin):
+    """Verify that the current user is authenticated and is an organizer."""
+    def has_access(self, user):
+        return user.is_organizer
@@ -9,7 +9,19 @@ class User(AbstractUser):
 
 
 class Profile(models.Model):
+    ROUTING_MANUAL = ''
+    ROUTING_ROUND_ROBIN = 'round_robin'
+    ROUTING_LEAST_OPEN = 'least_open'
+    ROUTING_CATEGORY_AFFINITY = 'category_affinity'
+    ROUTING_CHOICES = (
+        (ROUTING_MANUAL, 'Assign manually'),
+        (ROUTING_ROUND_ROBIN, 'Round robin'),
+        (ROUTING_LEAST_OPEN, 'Fewest open leads'),
+        (ROUTING_CATEGORY_AFFINITY, 'Category affinity'),
+    )
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    routing_strategy = models.CharField(max_length=20, choices=ROUTING_CHOICES, blank=True, default=ROUTING_MANUAL)
 
     def __str__(self):
         return self.user.username
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_save, post_delete
+
+from crm_system.agents.models import User, Agent
+from crm_system.agents.tenancy import bump_organisation_version, invalidate_tenant
+
+
+def user_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_tenant(instance.pk)
+        # Agent names and emails are shown in the organisation's cached lists.
+        for organisation_id in Agent.objects.filter(user=instance).values_list('organisation_id', flat=True):
+            bump_organisation_version(organisation_id)
+
+
+def agent_changed(sender, instance, **kwargs):
+    invalidate_tenant(instance.user_id)
+    bump_organisation_version(instance.organisation_id)
+
+
+post_save.connect(user_saved, sender=User)
+post_save.connect(agent_changed, sender=Agent)
+post_delete.connect(agent_changed, sender=Agent)
@@ -0,0 +1,100 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+SESSION_KEY = '_tenant'
+
+
+class Tenant:
+    """The organisation a user works in and, for agents, their agent id."""
+
+    def __init__(self, organisation_id, agent_id=None, is_organizer=True):
+        self.organisation_id = organisation_id
+        self.agent_id = agent_id
+        self.is_organizer = is_organizer
+
+    def __repr__(self):
+        return f'Tenant(organisation_id={self.organisation_id}, agent_id={self.agent_id})'
+
+
+def _version_key(user_id):
+    return f'tenant-version:{user_id}'
+
+
+def get_tenant_version(user_id):
+    return cache.get(_version_key(user_id), 0)
+
+
+def invalidate_tenant(user_id):
+    key = _version_key(user_id)
+    cache.add(key, 0, None)
+    cache.incr(key)
+
+
+def _organisation_version_key(organisation_id):
+    return f'organisation-version:{organisation_id}'
+
+
+def get_organisation_version(organisation_id):
+    """
+    Return the version of an organisation's data, used to key cached fragments.
+
+    Versions start from the current time rather than 0, so a version that was
+    evicted from the cache never comes back as one that was already used.
+    Versions of different organisations can coincide, so fragment keys
+    carry the organisation id as well.
+    """
+    key = _organisation_version_key(organisation_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_organisation_version(organisation_id):
+    key = _organisation_version_key(organisation_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def resolve_tenant(user):
+    from crm_system.agents.models import User
+
+    row = User.objects.filter(pk=user.pk).values('profile__id', 'agent__id', 'agent__organisation_id').get()
+    if user.is_organizer:
+        return Tenant(row['profile__id'], is_organizer=True)
+    return Tenant(row['agent__organisation_id'], row['agent__id'], is_organizer=False)
+
+
+def get_tenant(user):
+    """
+    Return the tenant of ``user``, as set by ``TenantMiddleware`` or resolved
+    (and remembered on the user object) with a single query.
+    """
+    tenant = getattr(user, 'tenant', None)
+    if tenant is None:
+        tenant = resolve_tenant(user)
+        user.tenant = tenant
+    return tenant
+
+
+async def aget_tenant(user):
+    tenant = getattr(user, 'tenant', None)
+    if tenant is None:
+        tenant = await sync_to_async(resolve_tenant)(user)
+        user.tenant = tenant
+    return tenant
+
+
+def get_session_tenant(session, user):
+    version = get_tenant_version(user.pk)
+    stored = session.get(SESSION_KEY)
+    if stored and stored[0] == user.pk and stored[1] == version and stored[2] == user.is_organizer:
+        return Tenant(stored[3], stored[4], is_organizer=user.is_organizer)
+    tenant = resolve_tenant(user)
+    session[SESSION_KEY] = [user.pk, version, user.is_organizer, tenant.organisation_id, tenant.agent_id]
+    return tenant
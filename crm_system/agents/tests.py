@@ -1,3 +1,107 @@
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from crm_system.agents.leaderboard import AgentLeaderboard
+from crm_system.agents.models import Agent, User
+from crm_system.agents.tenancy import get_session_tenant, get_tenant
+from crm_system.leads.models import Category, FollowUp, Lead
+
+
+class OrganisationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = User.objects.create_user('org', 'org@example.com', 'pw')
+        self.organisation = self.organizer.profile
+        self.agent = self.create_agent('agent', self.organisation)
+        self.other_agent = self.create_agent('other-agent', self.organisation)
+        self.other_organizer = User.objects.create_user('rival', 'rival@example.com', 'pw')
+        self.other_organisation = self.other_organizer.profile
+
+    def create_agent(self, username, organisation):
+        user = User.objects.create_user(username, f'{username}@example.com', 'pw', is_organizer=False, is_agent=True)
+        return Agent.objects.create(user=user, organisation=organisation)
+
+    def create_lead(self, organisation=None, **fields):
+        return Lead.objects.create(
+            organisation=organisation or self.organisation, first_name='Ada', last_name='Lovelace',
+            description='Interested', phone_number='020 7946 0000', email='ada@example.com', **fields
+        )
+
+
+class TenantTests(OrganisationTestCase):
+    def test_organizer_and_agent_tenants(self):
+        tenant = get_tenant(User.objects.get(pk=self.organizer.pk))
+        self.assertEqual((tenant.organisation_id, tenant.agent_id, tenant.is_organizer),
+                         (self.organisation.pk, None, True))
+        tenant = get_tenant(User.objects.get(pk=self.agent.user.pk))
+        self.assertEqual((tenant.organisation_id, tenant.agent_id, tenant.is_organizer),
+                         (self.organisation.pk, self.agent.pk, False))
+
+    def test_session_tenant_is_resolved_once(self):
+        session = SessionStore()
+        get_session_tenant(session, self.agent.user)
+        with self.assertNumQueries(0):
+            tenant = get_session_tenant(session, self.agent.user)
+        self.assertEqual(tenant.agent_id, self.agent.pk)
+
+    def test_moving_an_agent_invalidates_the_session_tenant(self):
+        session = SessionStore()
+        get_session_tenant(session, self.agent.user)
+        self.agent.organisation = self.other_organisation
+        self.agent.save()
+        self.assertEqual(get_session_tenant(session, self.agent.user).organisation_id, self.other_organisation.pk)
+
+    def test_agents_only_see_their_own_leads(self):
+        own = self.create_lead(agent=self.agent)
+        theirs = self.create_lead(agent=self.other_agent)
+        self.create_lead(self.other_organisation)
+        self.assertEqual(list(Lead.objects.for_user(self.agent.user)), [own])
+        self.assertCountEqual(Lead.objects.for_user(self.organizer), [own, theirs])
+
+    def test_leads_of_other_tenants_are_not_found(self):
+        theirs = self.create_lead(agent=self.other_agent)
+        rival = self.create_lead(self.other_organisation)
+        self.client.force_login(self.agent.user)
+        self.assertEqual(self.client.get(reverse('leads:lead-detail', args=[theirs.pk])).status_code, 404)
+        self.client.force_login(self.organizer)
+        self.assertEqual(self.client.get(reverse('leads:lead-detail', args=[theirs.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('leads:lead-detail', args=[rival.pk])).status_code, 404)
+
+
+class LeaderboardTests(OrganisationTestCase):
+    def setUp(self):
+        super(LeaderboardTests, self).setUp()
+        self.converted = Category.objects.create(name='Converted', organisation=self.organisation, is_converted=True)
+        self.create_lead(agent=self.agent, category=self.converted)
+        self.create_lead(agent=self.agent)
+        self.followup = FollowUp.objects.create(lead=self.create_lead(agent=self.other_agent, category=self.converted))
+
+    def test_agents_are_ranked_by_conversion_rate(self):
+        rows = [(agent.pk, agent.rank, agent.total_leads, agent.converted_leads, agent.open_leads,
+                 agent.conversion_rate) for agent in AgentLeaderboard(self.organisation.pk)]
+        self.assertEqual(rows, [
+            (self.other_agent.pk, 1, 1, 1, 0, 1.0),
+            (self.agent.pk, 2, 2, 1, 1, 0.5),
+        ])
+        self.assertEqual(AgentLeaderboard(self.organisation.pk).get(self.other_agent.pk).last_followup,
+                         self.followup.date_added)
+        self.assertIsNone(AgentLeaderboard(self.organisation.pk).get(self.agent.pk).last_followup)
+
+    def test_cached_until_the_organisation_changes(self):
+        list(AgentLeaderboard(self.organisation.pk))
+        with self.assertNumQueries(0):
+            list(AgentLeaderboard(self.organisation.pk))
+        self.create_lead(agent=self.other_agent)
+        other = AgentLeaderboard(self.organisation.pk).get(self.other_agent.pk)
+        self.assertEqual((other.total_leads, other.conversion_rate), (2, 0.5))
+
+    def test_views_are_scoped_to_the_organisation(self):
+        rival_agent = self.create_agent('rival-agent', self.other_organisation)
+        self.client.force_login(self.organizer)
+        response = self.client.get(reverse('agents:agent-list'))
+        self.assertEqual([agent.pk for agent in response.context['object_list']], [self.other_agent.pk, self.agent.pk])
+        response = self.client.get(reverse('agents:agent-detail', args=[self.agent.pk]))
+        self.assertEqual(response.context['agent'].rank, 2)
+        self.assertEqual(self.client.get(reverse('agents:agent-detail', args=[rival_agent.pk])).status_code, 404)
@@ -1,20 +1,28 @@
 import random
 
-from django.core.mail import send_mail
+from django.http import Http404
 from django.views import generic
 from django.shortcuts import reverse
 
 from crm_system.agents.models import Agent
 from crm_system.agents.forms import AgentModelForm
+from crm_system.agents.leaderboard import AgentLeaderboard
 from crm_system.agents.mixins import OrganizerLoginRequiredMixin
+from crm_system.agents.tenancy import get_organisation_version, get_tenant
+from crm_system.main.tasks import queue_mail
 
 
 class AgentListView(OrganizerLoginRequiredMixin, generic.ListView):
     template_name = 'agents/agent_list.html'
 
     def get_queryset(self):
-        organisation = self.request.user.profile
-        return Agent.objects.filter(organisation=organisation)
+        return AgentLeaderboard(get_tenant(self.request.user).organisation_id)
+
+    def get_context_data(self, **kwargs):
+        context = super(AgentListView, self).get_context_data(**kwargs)
+        organisation_id = get_tenant(self.request.user).organisation_id
+        context['cache_scope'] = f'{organisation_id}:{get_organisation_version(organisation_id)}'
+        return context
 
 
 class AgentCreateView(OrganizerLoginRequiredMixin, generic.CreateView):
@@ -32,9 +40,9 @@ class AgentCreateView(OrganizerLoginRequiredMixin, generic.CreateView):
         user.save()
         Agent.objects.create(
             user=user,
-            organisation=self.request.user.profile
+            organisation_id=get_tenant(self.request.user).organisation_id
         )
-        send_mail(
+        queue_mail(
             subject="You are invited to be an agent",
             message="You were added as an agent on CRM. Please come login to start working.",
             from_email="admin@test.com",
@@ -47,9 +55,11 @@ class AgentDetailView(OrganizerLoginRequiredMixin, generic.DetailView):
     template_name = 'agents/agent_detail.html'
     context_object_name = 'agent'
 
-    def get_queryset(self):
-        organisation = self.request.user.profile
-        return Agent.objects.filter(organisation=organisation)
+    def get_object(self, queryset=None):
+        agent = AgentLeaderboard(get_tenant(self.request.user).organisation_id).get(self.kwargs['pk'])
+        if agent is None:
+            raise Http404('No agent found matching the query')
+        return agent
 
 
 class AgentUpdateView(OrganizerLoginRequiredMixin, generic.UpdateView):
@@ -60,8 +70,8 @@ class AgentUpdateView(OrganizerLoginRequiredMixin, generic.UpdateView):
         return reverse('agents:agent-list')
 
     def get_queryset(self):
-        organisation = self.request.user.profile
-        return Agent.objects.filter(organisation=organisation)
+        organisation_id = get_tenant(self.request.user).organisation_id
+        return Agent.objects.filter(organisation_id=organisation_id)
 
 
 class AgentDeleteView(OrganizerLoginRequiredMixin, generic.DeleteView):
@@ -72,5 +82,5 @@ class AgentDeleteView(OrganizerLoginRequiredMixin, generic.DeleteView):
         return reverse('agents:agent-list')
 
     def get_queryset(self):
-        organisation = self.request.user.profile
-        return Agent.objects.filter(organisation=organisation)
+        organisation_id = get_tenant(self.request.user).organisation_id
+        return Agent.objects.filter(organisation_id=organisation_id)
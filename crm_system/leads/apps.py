@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LeadsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm_system.leads'
+
+    def ready(self):
+        from crm_system.leads import signals  # noqa: F401
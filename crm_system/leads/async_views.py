@@ -0,0 +1,94 @@
+"""
+Async variants of the busiest lead views, used when ``ASYNC_VIEWS`` is on
+(i.e. when the site is served through ``crm_system.asgi``).
+
+They fetch everything with the async ORM before rendering, including the
+choices of the forms on the page, so templates render without querying.
+Validating the lead filter is the one query left on a worker thread. The
+templates are shared with the synchronous views.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse
+from django.template.response import TemplateResponse
+from django.views import generic
+
+from crm_system.agents.mixins import AsyncLoginRequiredMixin, AsyncOrganizerLoginRequiredMixin
+from crm_system.agents.tenancy import aget_tenant, get_organisation_version
+from .counters import aget_dashboard_counters
+from .forms import LeadBulkActionForm, LeadFilterForm, aload_choices
+from .models import FollowUp, Lead
+from .pagination import KeysetPage, get_page_size
+from .views import LeadJsonView
+
+
+class AsyncDashboardView(AsyncOrganizerLoginRequiredMixin, generic.View):
+    template_name = 'dashboard.html'
+
+    async def get(self, request, *args, **kwargs):
+        tenant = await aget_tenant(request.user)
+        context = await aget_dashboard_counters(tenant.organisation_id)
+        return TemplateResponse(request, self.template_name, context)
+
+
+class AsyncLeadListView(AsyncLoginRequiredMixin, generic.View):
+    template_name = 'leads/lead_list.html'
+
+    async def get(self, request, *args, **kwargs):
+        user = request.user
+        tenant = await aget_tenant(user)
+        filter_form = LeadFilterForm(request.GET or None, organisation=tenant.organisation_id)
+        # Validating model choices queries the database.
+        await sync_to_async(filter_form.is_valid)()
+        await aload_choices(filter_form)
+        page_size = get_page_size(request)
+        filter_query = request.GET.copy()
+        for param in ('cursor', 'unassigned_cursor', 'page_size'):
+            filter_query.pop(param, None)
+
+        version = await sync_to_async(get_organisation_version)(tenant.organisation_id)
+        queryset = Lead.objects.for_user(user).filter(agent__isnull=False).select_related('category', 'agent__user')
+        context = {
+            'leads': await KeysetPage(filter_form.filter_queryset(queryset), request.GET.get('cursor'), page_size).aload(),
+            'page_size': page_size,
+            'filter_form': filter_form,
+            'filter_query': filter_query.urlencode(),
+            'cache_scope': f'{tenant.organisation_id}:{version}:{tenant.agent_id}',
+        }
+        if user.is_organizer:
+            queryset = Lead.objects.for_user(user).filter(agent__isnull=True).select_related('category')
+            unassigned = KeysetPage(filter_form.filter_queryset(queryset), request.GET.get('unassigned_cursor'), page_size)
+            bulk_form = LeadBulkActionForm(organisation=tenant.organisation_id)
+            await aload_choices(bulk_form)
+            context.update({'unassigned_leads': await unassigned.aload(), 'bulk_form': bulk_form})
+        return TemplateResponse(request, self.template_name, context)
+
+
+class AsyncLeadDetailView(AsyncLoginRequiredMixin, generic.View):
+    template_name = 'leads/lead_detail.html'
+
+    async def get(self, request, *args, **kwargs):
+        await aget_tenant(request.user)
+        try:
+            lead = await Lead.objects.for_user(request.user).aget(pk=kwargs['pk'])
+        except Lead.DoesNotExist:
+            raise Http404
+        followups = [followup async for followup in FollowUp.objects.filter(lead=lead).order_by('date_added')]
+        return TemplateResponse(request, self.template_name, {'lead': lead, 'object': lead, 'followups': followups})
+
+
+class AsyncLeadJsonView(AsyncLoginRequiredMixin, LeadJsonView):
+    """
+    LeadJsonView on the async ORM. Django 4.1 cannot stream from an async
+    iterator, so the (``max_limit`` bounded) body is built before returning.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        params = self.get_params(request)
+        if isinstance(params, JsonResponse):
+            return params
+        fields, cursor, limit = params
+        await aget_tenant(request.user)
+        rows = [row async for row in self.get_rows(fields, cursor, limit).aiterator(chunk_size=self.chunk_size)]
+        if request.GET.get('format') == 'ndjson':
+            return HttpResponse(''.join(self.stream_ndjson(rows)), content_type='application/x-ndjson')
+        return HttpResponse(''.join(self.stream_json(rows, limit)), content_type='application/json')
@@ -0,0 +1,222 @@
+"""
+Content-addressed storage for follow-up attachments.
+
+Every attachment is stored once, under the SHA-256 of its bytes, as
+``blobs/<aa>/<bb>/<digest><ext>``, and a ``Blob`` row counts the follow-ups
+that point at it. Uploads are hashed while they are streamed to a temporary
+file next to the blobs, so storing one is a rename rather than a copy.
+Blobs nobody references any more are removed by ``gc_blobs`` once they have
+been unreferenced for a grace period.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.utils import timezone
+
+BLOB_DIR = 'blobs'
+BLOB_TMP_DIR = 'tmp'
+HASH_CHUNK_SIZE = 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def blob_tmp_dir():
+    path = os.path.join(settings.MEDIA_ROOT, BLOB_DIR, BLOB_TMP_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def blob_name(digest, filename=''):
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{BLOB_DIR}/')
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """An upload written to the blob temporary directory, with the SHA-256 of its content."""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        File.__init__(self, tempfile.NamedTemporaryFile(suffix='.upload', dir=blob_tmp_dir()), name)
+        self.content_type = content_type
+        self.size = size
+        self.charset = charset
+        self.content_type_extra = content_type_extra
+        self.hasher = hashlib.sha256()
+        self.sha256 = None
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploads too large for memory to disk beside the blobs, hashing each chunk on the way."""
+
+    def new_file(self, *args, **kwargs):
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.sha256 = self.file.hasher.hexdigest()
+        return super(HashingFileUploadHandler, self).file_complete(file_size)
+
+
+class BlobStorage(FileSystemStorage):
+    """
+    Saves every file under the hash of its content, whatever name it is
+    given, and records it as a ``Blob``. Saving content that is already
+    stored only refreshes the existing blob.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        digest = getattr(content, 'sha256', None)
+        path = content.temporary_file_path() if hasattr(content, 'temporary_file_path') else None
+        if digest is None or path is None:
+            digest, path = self._spool(content)
+        name = blob_name(digest, name)
+        full_path = self.path(name)
+        with transaction.atomic():
+            # The lock keeps gc_blobs from deleting the stored file after it is chosen over the new copy.
+            blob = Blob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and os.path.exists(full_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(path, full_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+            if blob is None:
+                Blob.objects.get_or_create(name=name, defaults={'size': content.size})
+            else:
+                # Keeps the blob out of garbage collection until the new reference is saved.
+                Blob.objects.filter(pk=blob.pk).update(updated_at=timezone.now())
+        return name
+
+    def _spool(self, content):
+        digest = hashlib.sha256()
+        descriptor, path = tempfile.mkstemp(suffix='.upload', dir=blob_tmp_dir())
+        with os.fdopen(descriptor, 'wb') as file:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+                file.write(chunk)
+        return digest.hexdigest(), path
+
+
+blob_storage = BlobStorage()
+
+
+def get_blob_storage():
+    return blob_storage
+
+
+def retain_blob(name, count=1):
+    from .models import Blob
+
+    if is_blob(name):
+        Blob.objects.filter(name=name).update(ref_count=F('ref_count') + count, updated_at=timezone.now())
+
+
+def release_blob(name, count=1):
+    from .models import Blob
+
+    if is_blob(name):
+        Blob.objects.filter(name=name).update(ref_count=F('ref_count') - count, updated_at=timezone.now())
+
+
+def release_blobs(followups):
+    """Drop the references of every follow-up in ``followups`` in one query, before they are raw deleted."""
+    from .models import Blob
+
+    attachments = followups.filter(file__startswith=f'{BLOB_DIR}/')
+    counts = attachments.filter(file=OuterRef('name')).values('file').annotate(count=Count('id')).values('count')
+    Blob.objects.filter(name__in=attachments.values('file')).update(
+        ref_count=F('ref_count') - Subquery(counts), updated_at=timezone.now(),
+    )
+
+
+def upload_part_path(upload):
+    return os.path.join(blob_tmp_dir(), f'{upload.pk}.part')
+
+
+def append_chunk(upload, stream, offset):
+    """
+    Write the chunk read from ``stream`` at ``offset`` of the upload, which
+    must be where the last chunk ended, and return the new offset. Bytes a
+    previous, interrupted request left past ``offset`` are discarded.
+    """
+    if offset != upload.offset:
+        raise ValueError(f'The upload is at offset {upload.offset}')
+    remaining = upload.size - offset
+    with open(upload_part_path(upload), 'ab') as file:
+        file.truncate(offset)
+        for chunk in iter(lambda: stream.read(min(UPLOAD_CHUNK_SIZE, remaining) or 1), b''):
+            if len(chunk) > remaining:
+                raise ValueError('The chunk runs past the declared size')
+            file.write(chunk)
+            remaining -= len(chunk)
+    upload.offset = upload.size - remaining
+    upload.save(update_fields=['offset', 'updated_at'])
+    return upload.offset
+
+
+def complete_upload(upload):
+    """
+    Store a fully received upload as a follow-up of its lead and forget the
+    upload. Returns None if another request completed it first.
+
+    The file is hashed and moved into the blobs before any transaction or
+    lock is taken, so the blob row is committed together with the move. If
+    the follow-up is then not saved, the unreferenced blob is left to
+    ``gc_blobs``.
+    """
+    from .models import AttachmentUpload, FollowUp
+
+    path = upload_part_path(upload)
+    try:
+        with open(path, 'rb') as handle:
+            content = File(handle, name=upload.file_name)
+            content.sha256 = hash_file(path)
+            content.temporary_file_path = lambda: path
+            name = blob_storage.save(upload.file_name, content)
+    except FileNotFoundError:
+        return None
+    with transaction.atomic():
+        if not AttachmentUpload.objects.select_for_update().filter(pk=upload.pk).exists():
+            return None
+        followup = FollowUp.objects.create(lead_id=upload.lead_id, notes=upload.notes, file=name)
+        upload.delete()
+    return followup
+
+
+def discard_upload(upload):
+    try:
+        os.remove(upload_part_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
@@ -0,0 +1,69 @@
+"""
+Set-based actions over a selection of leads.
+
+Every action is one ``UPDATE`` or ``DELETE`` whose ``WHERE`` clause comes
+from the (organisation scoped) queryset, so the selection is never loaded
+into Python. ``update()`` and raw deletes skip the model signals, so the
+search index, dashboard counters, agent loads and the organisation's
+cache version are maintained here instead, and the ``LeadEvent`` rows are
+inserted from the same selection before it is updated.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from crm_system.agents.tenancy import bump_organisation_version
+from .counters import invalidate_dashboard_counters
+from .blobs import discard_upload, release_blobs
+from .events import record_queryset_events
+from .models import AttachmentUpload, FollowUp, Lead, LeadEvent
+from .registry import get_category_registry
+from .routing import invalidate_agent_loads
+from .search import reassign_in_search_index, remove_leads_from_search_index
+
+
+@transaction.atomic
+def assign_leads(queryset, organisation_id, agent):
+    reassign_in_search_index(queryset, agent.pk)
+    record_queryset_events(queryset.exclude(agent_id=agent.pk), LeadEvent.ASSIGNED, agent_id=agent.pk)
+    count = queryset.update(agent=agent)
+    transaction.on_commit(lambda: _invalidate(organisation_id))
+    return count
+
+
+@transaction.atomic
+def categorise_leads(queryset, organisation_id, category):
+    now = timezone.now()
+    fields = {'category': category}
+    moved = queryset.exclude(category_id=category.pk)
+    record_queryset_events(moved, LeadEvent.CATEGORY_CHANGED, now, category_id=category.pk)
+    if get_category_registry(organisation_id).is_converted(category.pk):
+        # Same rule as LeadCategoryUpdateView: stamp leads that were not already in the converted category.
+        fields['converted_date'] = Case(
+            When(category_id=category.pk, then=F('converted_date')),
+            default=Value(now),
+        )
+        record_queryset_events(moved, LeadEvent.CONVERTED, now, category_id=category.pk)
+    count = queryset.update(**fields)
+    transaction.on_commit(lambda: _invalidate(organisation_id))
+    return count
+
+
+@transaction.atomic
+def delete_leads(queryset, organisation_id):
+    followups = FollowUp.objects.filter(lead__in=queryset.values('id'))
+    release_blobs(followups)
+    followups._raw_delete(queryset.db)
+    for upload in AttachmentUpload.objects.filter(lead__in=queryset.values('id')):
+        discard_upload(upload)
+    Lead.objects.filter(duplicate_of__in=queryset.values('id')).update(duplicate_of=None)
+    remove_leads_from_search_index(queryset)
+    count = queryset._raw_delete(queryset.db)
+    transaction.on_commit(lambda: _invalidate(organisation_id))
+    return count
+
+
+def _invalidate(organisation_id):
+    invalidate_dashboard_counters(organisation_id)
+    invalidate_agent_loads(organisation_id)
+    bump_organisation_version(organisation_id)
@@ -0,0 +1,39 @@
+"""
+Normalised forms of a lead's email and phone number, stored next to the
+free-form fields so a caller can be found with one index seek.
+"""
+from django.conf import settings
+
+MIN_E164_DIGITS = 8
+MAX_E164_DIGITS = 15
+
+
+def normalise_email(email):
+    return (email or '').strip().lower()
+
+
+def normalise_phone(phone_number, country_code=None):
+    """
+    Return the number in E.164 form (``+`` and digits), or '' if it cannot be one.
+
+    Numbers written with ``+`` or ``00`` carry their own country code; any
+    other number is taken as national to ``PHONE_DEFAULT_COUNTRY_CODE``,
+    dropping a leading trunk ``0``.
+    """
+    country_code = country_code or settings.PHONE_DEFAULT_COUNTRY_CODE
+    number = (phone_number or '').strip()
+    digits = ''.join(char for char in number if char.isdigit())
+    if number.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    else:
+        digits = country_code + digits.removeprefix('0')
+    if not MIN_E164_DIGITS <= len(digits) <= MAX_E164_DIGITS:
+        return ''
+    return f'+{digits}'
+
+
+def set_contact_fields(lead):
+    lead.email_normalised = normalise_email(lead.email)
+    lead.phone_e164 = normalise_phone(lead.phone_number)
@@ -0,0 +1,96 @@
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .registry import get_category_registry
+
+COUNTER_NAMES = ('total_lead_count', 'total_in_past30', 'converted_in_past30')
+COUNTER_TIMEOUT = 300
+WINDOW = datetime.timedelta(days=30)
+
+
+def _key(organisation_id, name):
+    return f'dashboard:{organisation_id}:{name}'
+
+
+def _counter_aggregates(converted_id):
+    since = timezone.now() - WINDOW
+    return {
+        'total_lead_count': Count('id'),
+        'total_in_past30': Count('id', filter=Q(date_added__gte=since)),
+        'converted_in_past30': Count('id', filter=Q(category_id=converted_id, converted_date__gte=since)),
+    }
+
+
+def compute_dashboard_counters(organisation_id):
+    from .models import Lead
+
+    converted_id = get_category_registry(organisation_id).converted_id
+    return Lead.objects.filter(organisation_id=organisation_id).aggregate(**_counter_aggregates(converted_id))
+
+
+def get_dashboard_counters(organisation_id):
+    """
+    Return the dashboard figures for an organisation from the counter cache,
+    recomputing them with a single aggregate query when any of them is missing.
+    """
+    keys = {name: _key(organisation_id, name) for name in COUNTER_NAMES}
+    cached = cache.get_many(keys.values())
+    if len(cached) == len(keys):
+        return {name: cached[key] for name, key in keys.items()}
+    counters = compute_dashboard_counters(organisation_id)
+    cache.set_many({keys[name]: value for name, value in counters.items()}, COUNTER_TIMEOUT)
+    return counters
+
+
+async def aget_dashboard_counters(organisation_id):
+    from .models import Lead
+
+    keys = {name: _key(organisation_id, name) for name in COUNTER_NAMES}
+    cached = await cache.aget_many(keys.values())
+    if len(cached) == len(keys):
+        return {name: cached[key] for name, key in keys.items()}
+    registry = await sync_to_async(get_category_registry)(organisation_id)
+    counters = await Lead.objects.filter(organisation_id=organisation_id).aaggregate(
+        **_counter_aggregates(registry.converted_id)
+    )
+    await cache.aset_many({keys[name]: value for name, value in counters.items()}, COUNTER_TIMEOUT)
+    return counters
+
+
+def adjust_dashboard_counters(organisation_id, **deltas):
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(_key(organisation_id, name), delta)
+        except ValueError:
+            # Not cached yet (or expired): the next read recomputes it.
+            invalidate_dashboard_counters(organisation_id)
+            return
+
+
+def invalidate_dashboard_counters(organisation_id):
+    cache.delete_many([_key(organisation_id, name) for name in COUNTER_NAMES])
+
+
+def lead_contributions(values, converted_category_id):
+    """Return how much a lead with the given field values adds to each counter."""
+    if not values:
+        return {name: 0 for name in COUNTER_NAMES}
+    since = timezone.now() - WINDOW
+    date_added = values.get('date_added')
+    converted_date = values.get('converted_date')
+    return {
+        'total_lead_count': 1,
+        'total_in_past30': int(date_added is not None and date_added >= since),
+        'converted_in_past30': int(
+            converted_category_id is not None
+            and values.get('category_id') == converted_category_id
+            and converted_date is not None
+            and converted_date >= since
+        ),
+    }
@@ -0,0 +1,202 @@
+"""
+Duplicate lead detection.
+
+Every lead stores three blocking keys: its normalised email, the last digits
+of its phone number and the soundex codes of its names. Leads sharing an
+email or phone key are duplicates; leads sharing a name key are compared
+by name similarity, and only within blocks small enough for that to stay
+cheap. Scanning an organisation therefore reads each lead once per key in
+index order instead of comparing every pair.
+"""
+import itertools
+import unicodedata
+from difflib import SequenceMatcher
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .bulk import delete_leads
+from .models import Lead, FollowUp
+from .search import refresh_search_index
+
+GMAIL_DOMAINS = ('gmail.com', 'googlemail.com')
+PHONE_KEY_DIGITS = 9
+MIN_PHONE_DIGITS = 7
+MAX_NAME_BLOCK = 50
+NAME_SIMILARITY = 0.85
+SOUNDEX_CODES = dict(
+    [(letter, '1') for letter in 'bfpv'] + [(letter, '2') for letter in 'cgjkqsxz']
+    + [(letter, '3') for letter in 'dt'] + [('l', '4')] + [(letter, '5') for letter in 'mn'] + [('r', '6')]
+)
+
+
+def _ascii(value):
+    return unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode().lower()
+
+
+def email_key(email):
+    """The address with case, ``+tags`` and, for Gmail, dots in the local part removed."""
+    local, _, domain = (email or '').strip().lower().rpartition('@')
+    if not local:
+        return ''
+    local = local.split('+', 1)[0]
+    if domain in GMAIL_DOMAINS:
+        local, domain = local.replace('.', ''), GMAIL_DOMAINS[0]
+    return f'{local}@{domain}'
+
+
+def phone_key(phone_number):
+    """The last digits of the number, so national and international forms match."""
+    digits = ''.join(char for char in phone_number or '' if char.isdigit())
+    if len(digits) < MIN_PHONE_DIGITS:
+        return ''
+    return digits[-PHONE_KEY_DIGITS:]
+
+
+def soundex(name):
+    letters = [char for char in _ascii(name) if char.isalpha()]
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0])
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit and digit != previous:
+            code += digit
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def name_key(first_name, last_name):
+    last, first = soundex(last_name), soundex(first_name)
+    return f'{last}{first}' if last and first else ''
+
+
+def set_blocking_keys(lead):
+    lead.email_key = email_key(lead.email)
+    lead.phone_key = phone_key(lead.phone_number)
+    lead.name_key = name_key(lead.first_name, lead.last_name)
+
+
+def flag_duplicates(leads):
+    """
+    Point ``duplicate_of`` of each new lead at the oldest lead of its
+    organisation with the same email or phone key, with one indexed query.
+    """
+    leads = [lead for lead in leads if lead.email_key or lead.phone_key]
+    if not leads:
+        return
+    organisation_id = leads[0].organisation_id
+    email_keys = {lead.email_key for lead in leads if lead.email_key}
+    phone_keys = {lead.phone_key for lead in leads if lead.phone_key}
+    matches = {}
+    rows = (
+        Lead.objects.filter(organisation_id=organisation_id)
+        .filter(Q(email_key__in=email_keys) | Q(phone_key__in=phone_keys))
+        .order_by('-id')
+        .values_list('id', 'email_key', 'phone_key')
+    )
+    for pk, email, phone in rows:
+        if email:
+            matches[('email', email)] = pk
+        if phone:
+            matches[('phone', phone)] = pk
+    for lead in leads:
+        lead.duplicate_of_id = matches.get(('email', lead.email_key)) or matches.get(('phone', lead.phone_key))
+
+
+def flag_batch_duplicates(leads):
+    """
+    Point ``duplicate_of`` of each saved lead that ``flag_duplicates`` left
+    unflagged at the first lead before it in ``leads`` (or what that lead
+    duplicates) with the same email or phone key. Returns the leads flagged.
+    """
+    first, flagged = {}, []
+    for lead in leads:
+        keys = [key for key in (('email', lead.email_key), ('phone', lead.phone_key)) if key[1]]
+        if lead.duplicate_of_id is None:
+            lead.duplicate_of_id = next((first[key] for key in keys if key in first), None)
+            if lead.duplicate_of_id is not None:
+                flagged.append(lead)
+        for key in keys:
+            first.setdefault(key, lead.duplicate_of_id or lead.pk)
+    return flagged
+
+
+class _Clusters:
+    """Union-find over lead ids."""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, pk):
+        root = self.parent.setdefault(pk, pk)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while pk != root:
+            self.parent[pk], pk = root, self.parent[pk]
+        return root
+
+    def union(self, pks):
+        roots = sorted({self.find(pk) for pk in pks})
+        for root in roots[1:]:
+            self.parent[root] = roots[0]
+
+    def groups(self):
+        groups = {}
+        for pk in self.parent:
+            groups.setdefault(self.find(pk), []).append(pk)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+def _blocks(queryset, key, fields=(), max_size=None):
+    """Stream the groups of rows sharing a non-empty ``key``, as lists of ``(id, *fields)``."""
+    shared = queryset.exclude(**{key: ''}).values(key).annotate(size=Count('id')).filter(size__gt=1)
+    if max_size is not None:
+        shared = shared.filter(size__lte=max_size)
+    rows = (
+        queryset.filter(**{f'{key}__in': shared.values(key)})
+        .order_by(key, 'id')
+        .values_list(key, 'id', *fields)
+        .iterator(chunk_size=5000)
+    )
+    for _, block in itertools.groupby(rows, key=itemgetter(0)):
+        yield [row[1:] for row in block]
+
+
+def _similar_names(a, b):
+    return SequenceMatcher(None, a, b).ratio() >= NAME_SIMILARITY
+
+
+def find_duplicate_clusters(organisation_id, max_name_block=MAX_NAME_BLOCK):
+    """Return the organisation's groups of duplicate lead ids, each sorted oldest first."""
+    queryset = Lead.objects.filter(organisation_id=organisation_id)
+    clusters = _Clusters()
+    for key in ('email_key', 'phone_key'):
+        for block in _blocks(queryset, key):
+            clusters.union([pk for pk, in block])
+    for block in _blocks(queryset, 'name_key', ('first_name', 'last_name'), max_name_block):
+        names = [(pk, _ascii(f'{first} {last}')) for pk, first, last in block]
+        for (pk, name), (other_pk, other_name) in itertools.combinations(names, 2):
+            if _similar_names(name, other_name):
+                clusters.union([pk, other_pk])
+    return clusters.groups()
+
+
+@transaction.atomic
+def merge_leads(primary, duplicates):
+    """
+    Fold ``duplicates`` (a queryset) into ``primary``: their follow-ups are
+    moved over in one ``UPDATE`` and the duplicates deleted.
+    """
+    duplicates = duplicates.exclude(pk=primary.pk)
+    FollowUp.objects.filter(lead__in=duplicates.values('id')).update(lead=primary)
+    Lead.objects.filter(duplicate_of__in=duplicates.values('id')).exclude(pk=primary.pk).update(duplicate_of=primary)
+    if primary.duplicate_of_id is not None and duplicates.filter(pk=primary.duplicate_of_id).exists():
+        primary.duplicate_of = None
+        Lead.objects.filter(pk=primary.pk).update(duplicate_of=None)
+    count = delete_leads(duplicates, primary.organisation_id)
+    refresh_search_index([primary.pk])
+    return count
@@ -0,0 +1,125 @@
+"""
+Recording and consuming the ``LeadEvent`` history.
+
+Events are only ever inserted: one ``bulk_create`` per save, follow-up or
+import batch, and one ``INSERT ... SELECT`` per set-based bulk action, so
+the bulk paths still never load their selection into Python. Reports keep
+a ``LeadEventCursor`` and read only the events after it.
+
+Ids are handed out when events are inserted but become visible only when
+their transaction commits, so a consumer can see an id before a smaller
+one. A consumer therefore stops at the first gap in the ids, and only reads
+past it once the event after the gap is ``EVENT_GAP_TIMEOUT`` old: by then
+the missing ids belong to transactions that rolled back.
+"""
+import datetime
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import LeadEvent, LeadEventCursor
+from .registry import get_category_registry
+
+EVENT_GAP_TIMEOUT = datetime.timedelta(minutes=5)
+
+
+def lead_events(lead, before=None, occurred_at=None):
+    """
+    The events of a lead saved over ``before``, the values it was loaded with,
+    or of a new lead when ``before`` is None.
+    """
+    occurred_at = occurred_at or timezone.now()
+
+    def event(kind, previous_id=None):
+        return LeadEvent(
+            organisation_id=lead.organisation_id, lead_id=lead.pk, kind=kind, agent_id=lead.agent_id,
+            category_id=lead.category_id, previous_id=previous_id, occurred_at=occurred_at,
+        )
+
+    if before is None:
+        events = [event(LeadEvent.CREATED)]
+    else:
+        events = []
+        if before['agent_id'] != lead.agent_id:
+            events.append(event(LeadEvent.ASSIGNED, before['agent_id']))
+        if before['category_id'] != lead.category_id:
+            events.append(event(LeadEvent.CATEGORY_CHANGED, before['category_id']))
+    entered_category = lead.category_id is not None and (before is None or before['category_id'] != lead.category_id)
+    if entered_category and get_category_registry(lead.organisation_id).is_converted(lead.category_id):
+        events.append(event(LeadEvent.CONVERTED, before and before['category_id']))
+    return events
+
+
+def followup_event(followup):
+    lead = followup.lead
+    return LeadEvent(
+        organisation_id=lead.organisation_id, lead_id=lead.pk, kind=LeadEvent.FOLLOWUP_ADDED,
+        agent_id=lead.agent_id, category_id=lead.category_id, occurred_at=followup.date_added,
+    )
+
+
+def record_events(events):
+    if events:
+        LeadEvent.objects.bulk_create(events)
+
+
+def record_queryset_events(queryset, kind, occurred_at=None, **replace):
+    """
+    Insert one ``kind`` event per lead in ``queryset`` with a single query.
+
+    ``replace`` gives the new ``agent_id`` or ``category_id`` the leads are
+    about to be updated to; the value it replaces becomes ``previous_id``.
+    Call it before the ``UPDATE``, while the old values are still stored.
+    """
+    connection = connections[queryset.db]
+    occurred_at = connection.ops.adapt_datetimefield_value(occurred_at or timezone.now())
+    rows = queryset.order_by().values('organisation_id', 'id', 'agent_id', 'category_id')
+    sql, params = rows.query.sql_with_params()
+    columns, values, previous = [], [], 'NULL'
+    for name in ('agent_id', 'category_id'):
+        if name in replace:
+            columns.append('%s')
+            values.append(replace[name])
+            previous = f's.{name}'
+        else:
+            columns.append(f's.{name}')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {LeadEvent._meta.db_table} '
+            f'(organisation_id, lead_id, kind, agent_id, category_id, previous_id, occurred_at) '
+            f'SELECT s.organisation_id, s.id, %s, {columns[0]}, {columns[1]}, {previous}, %s FROM ({sql}) s',
+            [kind, *values, occurred_at, *params],
+        )
+        return cursor.rowcount
+
+
+def _committed_prefix(events, position, cutoff):
+    """The events up to the first gap in the ids that is younger than ``cutoff``."""
+    expected = position + 1
+    for index, event in enumerate(events):
+        # The event after a gap was inserted after the missing ids were handed out.
+        if event.id != expected and event.occurred_at >= cutoff:
+            return events[:index]
+        expected = event.id + 1
+    return events
+
+
+def consume_events(name, handler, batch_size=1000):
+    """
+    Hand the events after consumer ``name``'s high-water mark to ``handler``
+    in id order, one batch per transaction, advancing the mark with each batch.
+    Events behind a gap that may still be filled by an open transaction are
+    left for a later call. Returns how many events were consumed.
+    """
+    consumed = 0
+    while True:
+        with transaction.atomic():
+            cursor, _ = LeadEventCursor.objects.select_for_update().get_or_create(name=name)
+            events = list(LeadEvent.objects.after(cursor.position)[:batch_size])
+            events = _committed_prefix(events, cursor.position, timezone.now() - EVENT_GAP_TIMEOUT)
+            if not events:
+                return consumed
+            handler(events)
+            cursor.position = events[-1].id
+            cursor.save(update_fields=['position', 'updated_at'])
+        consumed += len(events)
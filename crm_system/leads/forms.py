@@ -1,7 +1,11 @@
+import datetime
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, UsernameField
+from django.utils import timezone
 
 from .models import Lead, Agent, Category, FollowUp
+from ..agents.tenancy import get_tenant
 from ..agents.models import User
 
 
@@ -18,6 +22,108 @@ class LeadModelForm(forms.ModelForm):
         pass
 
 
+class LeadImportForm(LeadModelForm):
+    class Meta(LeadModelForm.Meta):
+        fields = ('first_name', 'last_name', 'age', 'description', 'phone_number', 'email')
+
+
+class LeadImportUploadForm(forms.Form):
+    file = forms.FileField()
+
+
+class LeadFilterForm(forms.Form):
+    category = forms.ModelChoiceField(queryset=Category.objects.none(), required=False)
+    agent = forms.ModelChoiceField(queryset=Agent.objects.none(), required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        organisation = kwargs.pop('organisation')
+        super(LeadFilterForm, self).__init__(*args, **kwargs)
+        self.fields['category'].queryset = Category.objects.filter(organisation=organisation)
+        self.fields['agent'].queryset = Agent.objects.filter(organisation=organisation).select_related('user')
+
+    def filter_queryset(self, queryset, lead_prefix=''):
+        """
+        Narrow ``queryset`` by the submitted filters. ``lead_prefix`` points at
+        the lead from a related model; the date range always applies to the
+        queryset's own ``date_added``.
+        """
+        if not self.is_valid():
+            return queryset
+        data = self.cleaned_data
+        if data['category']:
+            queryset = queryset.filter(**{f'{lead_prefix}category': data['category']})
+        if data['agent']:
+            queryset = queryset.filter(**{f'{lead_prefix}agent': data['agent']})
+        if data['date_from']:
+            queryset = queryset.filter(date_added__gte=self._start_of_day(data['date_from']))
+        if data['date_to']:
+            queryset = queryset.filter(
+                date_added__lt=self._start_of_day(data['date_to'] + datetime.timedelta(days=1))
+            )
+        return queryset
+
+    @staticmethod
+    def _start_of_day(date):
+        return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+class LeadIdsField(forms.Field):
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        try:
+            return [int(pk) for pk in value or []]
+        except (TypeError, ValueError):
+            raise forms.ValidationError('Leads must be selected by their numeric ids.', code='invalid')
+
+
+class LeadBulkActionForm(forms.Form):
+    ACTION_CHOICES = (
+        ('assign', 'Assign to agent'),
+        ('categorise', 'Change category'),
+        ('delete', 'Delete'),
+    )
+
+    action = forms.ChoiceField(choices=ACTION_CHOICES)
+    ids = LeadIdsField(required=False)
+    select_all = forms.BooleanField(required=False, label='All leads matching the filter')
+    unassigned = forms.BooleanField(required=False)
+    to_agent = forms.ModelChoiceField(queryset=Agent.objects.none(), required=False, label='Agent')
+    to_category = forms.ModelChoiceField(queryset=Category.objects.none(), required=False, label='Category')
+
+    def __init__(self, *args, **kwargs):
+        organisation = kwargs.pop('organisation')
+        super(LeadBulkActionForm, self).__init__(*args, **kwargs)
+        self.fields['to_agent'].queryset = Agent.objects.filter(organisation=organisation).select_related('user')
+        self.fields['to_category'].queryset = Category.objects.filter(organisation=organisation)
+        self.filter_form = LeadFilterForm(self.data or None, organisation=organisation)
+
+    def clean(self):
+        cleaned_data = super(LeadBulkActionForm, self).clean()
+        if cleaned_data.get('select_all'):
+            if not self.filter_form.is_valid():
+                raise forms.ValidationError('The lead filter is not valid.')
+        elif not cleaned_data.get('ids'):
+            raise forms.ValidationError('Select at least one lead.')
+        action = cleaned_data.get('action')
+        if action == 'assign' and not cleaned_data.get('to_agent'):
+            self.add_error('to_agent', 'Choose the agent to assign the leads to.')
+        if action == 'categorise' and not cleaned_data.get('to_category'):
+            self.add_error('to_category', 'Choose the category to move the leads to.')
+        return cleaned_data
+
+    def filter_queryset(self, queryset):
+        """Narrow ``queryset`` to the selected leads: the given ids, or everything matching the filter."""
+        data = self.cleaned_data
+        if data['unassigned']:
+            queryset = queryset.filter(agent__isnull=True)
+        if data['select_all']:
+            return self.filter_form.filter_queryset(queryset)
+        return queryset.filter(pk__in=data['ids'])
+
+
 class LeadForm(forms.Form):
     first_name = forms.CharField()
     last_name = forms.CharField()
@@ -36,7 +142,7 @@ class AssignAgentForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         request = kwargs.pop('request')
-        agents = Agent.objects.filter(organisation=request.user.profile)
+        agents = Agent.objects.filter(organisation_id=get_tenant(request.user).organisation_id)
         super(AssignAgentForm, self).__init__(*args, **kwargs)
         self.fields['agent'].queryset = agents
 
@@ -50,10 +156,20 @@ class LeadCategoryUpdateForm(forms.ModelForm):
 class CategoryModelForm(forms.ModelForm):
     class Meta:
         model = Category
-        fields = ('name', )
+        fields = ('name', 'is_converted')
+        labels = {'is_converted': 'Leads in this category are converted'}
 
 
 class FollowUpModelForm(forms.ModelForm):
     class Meta:
         model = FollowUp
         fields = ('notes', 'file')
+
+
+async def aload_choices(form):
+    """Fetch the choices of the form's model choice fields with the async ORM, so rendering it runs no query."""
+    for field in form.fields.values():
+        if isinstance(field, forms.ModelChoiceField):
+            choices = [('', field.empty_label)] if field.empty_label is not None else []
+            choices += [(field.prepare_value(obj), field.label_from_instance(obj)) async for obj in field.queryset]
+            field.choices = choices
@@ -0,0 +1,136 @@
+import csv
+import io
+from collections import Counter
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from crm_system.agents.models import Agent
+from crm_system.agents.tenancy import bump_organisation_version
+from .contacts import set_contact_fields
+from .counters import adjust_dashboard_counters
+from .dedup import flag_batch_duplicates, flag_duplicates, set_blocking_keys
+from .events import lead_events, record_events
+from .forms import LeadImportForm
+from .models import Lead
+from .routing import adjust_agent_loads, get_router
+from .search import refresh_search_index
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.rejected = 0
+        self.errors = []
+
+    def add_error(self, line_number, errors):
+        self.rejected += 1
+        self.errors.append((line_number, errors))
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class LeadImporter:
+    """
+    Validate CSV rows with the lead form rules and insert them in batches.
+
+    Each batch is written in its own transaction, with ``bulk_create`` or,
+    on PostgreSQL, with ``COPY`` into ids reserved from the table sequence.
+    Rows that fail validation are reported by line number and skipped, and
+    rows without an agent are routed with the organisation's strategy.
+    ``on_batch(line_number, result)`` is called inside each batch's
+    transaction with the line the batch ends on, so a caller can record
+    progress that commits together with the leads.
+    """
+
+    def __init__(self, organisation, batch_size=1000, use_copy=None, on_batch=None):
+        self.organisation = organisation
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.use_copy = connection.vendor == 'postgresql' if use_copy is None else use_copy
+        self.agents = {
+            email.lower(): pk for pk, email in
+            Agent.objects.filter(organisation=organisation).values_list('id', 'user__email')
+            if email
+        }
+        self.router = get_router(organisation.id, organisation.routing_strategy)
+
+    def run(self, lines, result=None, start_line=0):
+        """Import ``lines``, skipping the rows up to ``start_line`` an earlier run already handled."""
+        result = result or ImportResult()
+        reader = csv.DictReader(lines)
+        batch = []
+        for row in reader:
+            if reader.line_num <= start_line:
+                continue
+            lead = self.build_lead(row, reader.line_num, result)
+            if lead is not None:
+                batch.append(lead)
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch, result, reader.line_num)
+                batch = []
+        if batch:
+            self.write_batch(batch, result, reader.line_num)
+        return result
+
+    def build_lead(self, row, line_number, result):
+        form = LeadImportForm(data=row)
+        if not form.is_valid():
+            result.add_error(line_number, form.errors.get_json_data())
+            return None
+        lead = form.save(commit=False)
+        lead.organisation = self.organisation
+        agent_email = (row.get('agent') or '').strip().lower()
+        if agent_email:
+            if agent_email not in self.agents:
+                result.add_error(line_number, {'agent': [{'message': 'Unknown agent email.', 'code': 'invalid'}]})
+                return None
+            lead.agent_id = self.agents[agent_email]
+        set_contact_fields(lead)
+        set_blocking_keys(lead)
+        return lead
+
+    def write_batch(self, leads, result, line_number):
+        if self.router is not None:
+            self.router.route(leads)
+        flag_duplicates(leads)
+        with transaction.atomic():
+            if self.use_copy:
+                self.copy_leads(leads)
+            else:
+                Lead.objects.bulk_create(leads, batch_size=self.batch_size)
+            # flag_duplicates only sees leads already stored, so rows repeated within the batch are flagged here.
+            Lead.objects.bulk_update(flag_batch_duplicates(leads), ['duplicate_of'], batch_size=self.batch_size)
+            now = timezone.now()
+            record_events([event for lead in leads for event in lead_events(lead, occurred_at=now)])
+            result.created += len(leads)
+            if self.on_batch is not None:
+                self.on_batch(line_number, result)
+        refresh_search_index(lead.pk for lead in leads)
+        adjust_dashboard_counters(self.organisation.id, total_lead_count=len(leads), total_in_past30=len(leads))
+        adjust_agent_loads(self.organisation.id, Counter(lead.agent_id for lead in leads if lead.agent_id))
+        bump_organisation_version(self.organisation.id)
+
+    def copy_leads(self, leads):
+        table = Lead._meta.db_table
+        fields = Lead._meta.concrete_fields
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                [table, Lead._meta.pk.column, len(leads)],
+            )
+            for lead, (pk,) in zip(leads, cursor.fetchall()):
+                lead.pk = pk
+                lead.date_added = now
+            buffer = io.StringIO()
+            for lead in leads:
+                values = (field.get_db_prep_save(getattr(lead, field.attname), connection) for field in fields)
+                buffer.write('\t'.join(_copy_value(value) for value in values) + '\n')
+            buffer.seek(0)
+            columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+            cursor.cursor.copy_expert(f'COPY {connection.ops.quote_name(table)} ({columns}) FROM STDIN', buffer)
@@ -0,0 +1,57 @@
+import datetime
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from crm_system.agents.models import Agent, Profile
+from crm_system.leads.models import Category, FollowUp, Lead
+
+
+class Command(BaseCommand):
+    help = 'Print query plans and timings for the hot lead queries of one organisation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', required=True, help='Username of the organizer.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def get_queries(self, organisation):
+        since = timezone.now() - datetime.timedelta(days=30)
+        agent = Agent.objects.filter(organisation=organisation).first()
+        category = Category.objects.filter(organisation=organisation).first()
+        lead = Lead.objects.filter(organisation=organisation).first()
+        leads = Lead.objects.filter(organisation=organisation)
+        queries = {
+            'assigned leads page': leads.filter(agent__isnull=False).order_by('-date_added', '-id')[:26],
+            'unassigned leads page': leads.filter(agent__isnull=True).order_by('-date_added', '-id')[:26],
+            'leads added in 30 days': leads.filter(date_added__gte=since).values_list('pk', flat=True),
+            'uncategorised leads': leads.filter(category__isnull=True).values_list('pk', flat=True),
+        }
+        if agent is not None:
+            queries['agent leads page'] = leads.filter(agent=agent).order_by('-date_added', '-id')[:26]
+        if category is not None:
+            queries['converted in 30 days'] = leads.filter(
+                category=category, converted_date__gte=since
+            ).values_list('pk', flat=True)
+        if lead is not None:
+            queries['lead follow-ups'] = FollowUp.objects.filter(lead=lead).order_by('date_added')
+        return queries
+
+    def handle(self, *args, **options):
+        try:
+            organisation = Profile.objects.get(user__username=options['organisation'])
+        except Profile.DoesNotExist:
+            raise CommandError(f'No organisation for user {options["organisation"]!r}')
+
+        for name, queryset in self.get_queries(organisation).items():
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain())
+            self.stdout.write(f'median {statistics.median(timings):.2f} ms over {len(timings)} run(s) '
+                              f'on {connection.vendor}\n')
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from crm_system.agents.models import Profile
+from crm_system.leads.dedup import MAX_NAME_BLOCK, find_duplicate_clusters, set_blocking_keys
+from crm_system.leads.models import Lead
+
+
+class Command(BaseCommand):
+    help = 'Find clusters of duplicate leads per organisation and optionally flag them for merging.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, action='append',
+                            help='Organisation (profile) id to scan; all organisations by default.')
+        parser.add_argument('--flag', action='store_true',
+                            help='Point duplicate_of of every lead in a cluster at its oldest lead.')
+        parser.add_argument('--backfill-keys', action='store_true',
+                            help='Recompute the blocking keys of every lead before scanning.')
+        parser.add_argument('--max-name-block', type=int, default=MAX_NAME_BLOCK)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        organisation_ids = options['organisation'] or list(Profile.objects.values_list('id', flat=True))
+        for organisation_id in organisation_ids:
+            if options['backfill_keys']:
+                self.backfill_keys(organisation_id, options['batch_size'])
+            clusters = find_duplicate_clusters(organisation_id, options['max_name_block'])
+            duplicates = sum(len(cluster) - 1 for cluster in clusters)
+            self.stdout.write(f'Organisation {organisation_id}: {len(clusters)} cluster(s), {duplicates} duplicate(s).')
+            if options['flag']:
+                flagged = [
+                    Lead(pk=pk, duplicate_of_id=cluster[0]) for cluster in clusters for pk in cluster[1:]
+                ]
+                Lead.objects.bulk_update(flagged, ['duplicate_of'], batch_size=options['batch_size'])
+
+    def backfill_keys(self, organisation_id, batch_size):
+        last_id = 0
+        while True:
+            leads = list(
+                Lead.objects.filter(organisation_id=organisation_id, id__gt=last_id).order_by('id')
+                .only('id', 'first_name', 'last_name', 'email', 'phone_number')[:batch_size]
+            )
+            if not leads:
+                break
+            for lead in leads:
+                set_blocking_keys(lead)
+            Lead.objects.bulk_update(leads, ['email_key', 'phone_key', 'name_key'])
+            last_id = leads[-1].pk
@@ -0,0 +1,70 @@
+import datetime
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from crm_system.leads.blobs import blob_storage, blob_tmp_dir, discard_upload
+from crm_system.leads.models import AttachmentUpload, Blob, FollowUp
+from crm_system.leads.streaming import chunked
+
+GC_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Delete attachment blobs no follow-up references any more, and abandoned resumable uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=24,
+                            help='Keep unreferenced blobs and temporary files at least this long.')
+        parser.add_argument('--upload-days', type=int, default=7,
+                            help='Abandon resumable uploads that received nothing for this many days.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        cutoff = now - datetime.timedelta(hours=options['grace_hours'])
+        deleted, repaired = 0, 0
+        candidates = Blob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff).values_list('pk', 'name')
+        for batch in chunked(list(candidates.iterator()), GC_BATCH_SIZE):
+            references = dict(
+                FollowUp.objects.filter(file__in=[name for _, name in batch])
+                .values_list('file').annotate(count=Count('id')).order_by()
+            )
+            for pk, name in batch:
+                if references.get(name):
+                    # The count drifted (e.g. rows changed outside the ORM): trust the follow-ups.
+                    Blob.objects.filter(pk=pk).update(ref_count=references[name], updated_at=now)
+                    repaired += 1
+                    continue
+                with transaction.atomic():
+                    # Re-checked under the row lock BlobStorage takes before keeping an existing file: a
+                    # follow-up saved since the count has either refreshed updated_at or waits for the delete.
+                    blob = Blob.objects.select_for_update().filter(
+                        pk=pk, ref_count__lte=0, updated_at__lt=cutoff
+                    ).first()
+                    if blob is None or FollowUp.objects.filter(file=name).exists():
+                        continue
+                    blob.delete()
+                    blob_storage.delete(name)
+                    deleted += 1
+
+        abandoned = AttachmentUpload.objects.filter(updated_at__lt=now - datetime.timedelta(days=options['upload_days']))
+        uploads = 0
+        for upload in abandoned:
+            discard_upload(upload)
+            uploads += 1
+
+        live = {f'{pk}.part' for pk in AttachmentUpload.objects.values_list('pk', flat=True)}
+        temporary = 0
+        with os.scandir(blob_tmp_dir()) as entries:
+            for entry in entries:
+                if entry.name not in live and entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+                    temporary += 1
+
+        self.stdout.write(
+            f'Deleted {deleted} blob(s) and {temporary} temporary file(s), abandoned {uploads} upload(s), '
+            f'repaired {repaired} reference count(s).'
+        )
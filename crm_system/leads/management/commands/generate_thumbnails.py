@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from PIL import UnidentifiedImageError
+
+from crm_system.leads.models import Lead
+from crm_system.leads.thumbnails import delete_thumbnails, render_thumbnails
+
+
+def _render(job):
+    lead_id, name = job
+    try:
+        return lead_id, render_thumbnails(lead_id, name), None
+    except (OSError, UnidentifiedImageError) as error:
+        return lead_id, None, str(error)
+
+
+class Command(BaseCommand):
+    help = 'Create the thumbnails of existing profile pictures using a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--force', action='store_true', help='Re-render leads that already have thumbnails.')
+
+    def handle(self, *args, **options):
+        leads = Lead.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        if not options['force']:
+            leads = leads.filter(thumbnail_version='')
+        previous = dict(leads.values_list('pk', 'thumbnail_version'))
+        jobs = list(leads.values_list('pk', 'profile_picture'))
+
+        # Workers only touch storage; don't let them inherit open database connections.
+        connections.close_all()
+        done, failed = [], 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for lead_id, version, error in pool.map(_render, jobs, chunksize=8):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'Lead {lead_id}: {error}')
+                else:
+                    done.append(Lead(pk=lead_id, thumbnail_version=version))
+
+        Lead.objects.bulk_update(done, ['thumbnail_version'], batch_size=1000)
+        for lead in done:
+            if previous[lead.pk] and previous[lead.pk] != lead.thumbnail_version:
+                delete_thumbnails(lead.pk, previous[lead.pk])
+        self.stdout.write(f'Created thumbnails for {len(done)} lead(s), {failed} failed.')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm_system.agents.models import Profile
+from crm_system.leads.importer import LeadImporter
+
+
+class Command(BaseCommand):
+    help = 'Import leads for an organisation from a CSV file with a header row.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--organisation', required=True, help='Username of the organizer.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--copy', dest='use_copy', action='store_true', default=None,
+                            help='Write with PostgreSQL COPY (default on PostgreSQL).')
+        parser.add_argument('--no-copy', dest='use_copy', action='store_false')
+
+    def handle(self, *args, **options):
+        try:
+            organisation = Profile.objects.get(user__username=options['organisation'])
+        except Profile.DoesNotExist:
+            raise CommandError(f'No organisation for user {options["organisation"]!r}')
+
+        importer = LeadImporter(organisation, batch_size=options['batch_size'], use_copy=options['use_copy'])
+        with open(options['path'], newline='', encoding='utf-8-sig') as lines:
+            result = importer.run(lines)
+
+        for line_number, errors in result.errors:
+            self.stderr.write(f'Line {line_number}: {errors}')
+        self.stdout.write(f'{result.created} lead(s) imported, {len(result.errors)} row(s) rejected.')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from crm_system.leads.models import Lead
+from crm_system.leads.search import refresh_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index of every lead, e.g. after adding search to an existing database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        last_id, total = 0, 0
+        while True:
+            ids = list(
+                Lead.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            refresh_search_index(ids)
+            last_id = ids[-1]
+            total += len(ids)
+        self.stdout.write(f'Indexed {total} lead(s).')
@@ -0,0 +1,148 @@
+"""
+Access checks and efficient delivery for uploaded lead media.
+
+Files are only served after the owning lead or follow-up is found in the
+requesting user's organisation. The bytes themselves are handed off to the
+front-end server when ``MEDIA_ACCEL`` is set:
+
+* ``'x-accel'``: nginx, using an ``internal`` location mapped to
+  ``MEDIA_ACCEL_PREFIX`` that aliases ``MEDIA_ROOT``.
+* ``'x-sendfile'``: Apache mod_xsendfile or lighttpd, given the absolute path.
+
+Without it the file is streamed by Django with Range support.
+"""
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from .blobs import BLOB_DIR
+from .models import FollowUp, Lead
+from .thumbnails import THUMBNAIL_DIR
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def _thumbnail_owner(user, name):
+    lead_id, _, filename = name[len(THUMBNAIL_DIR) + 1:].partition('/')
+    version = filename.partition('-')[0]
+    if not lead_id.isdigit() or not version:
+        return False
+    return Lead.objects.for_user(user).filter(pk=lead_id, thumbnail_version=version).exists()
+
+
+def _picture_owner(user, name):
+    # Repeats the condition of the partial lead_org_picture_idx so the planner can use it.
+    return Lead.objects.for_user(user).filter(profile_picture=name, profile_picture__gt='').exists()
+
+
+# Upload prefix -> lookup returning whether the user may read a stored file name. The first match wins.
+MEDIA_OWNERS = {
+    f'{THUMBNAIL_DIR}/': _thumbnail_owner,
+    'profile_pictures/': _picture_owner,
+    'lead_followups/': lambda user, name: FollowUp.objects.for_user(user).filter(file=name).exists(),
+    # Blobs are shared by content, so any of the user's follow-ups holding the same bytes grants access.
+    f'{BLOB_DIR}/': lambda user, name: FollowUp.objects.for_user(user).filter(file=name).exists(),
+}
+
+
+def user_can_access(user, name):
+    for prefix, lookup in MEDIA_OWNERS.items():
+        if name.startswith(prefix):
+            return lookup(user, name)
+    return False
+
+
+def file_etag(size, modified):
+    return f'"{int(modified.timestamp()):x}-{size:x}"'
+
+
+def parse_range(header, size):
+    """Return the inclusive ``(start, end)`` of a single byte range, None to ignore it, or False if unsatisfiable."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        if end and int(end) < int(start):
+            # An invalid range, which RFC 9110 says to ignore rather than refuse.
+            return None
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_range(file, start, length):
+    with file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(RANGE_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def serve_media(request, name):
+    size = default_storage.size(name)
+    modified = default_storage.get_modified_time(name)
+    etag = file_etag(size, modified)
+    last_modified = int(modified.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, name, size, etag, last_modified)
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(last_modified))
+    patch_cache_control(response, private=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+
+def _file_response(request, name, size, etag, last_modified):
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    accel = getattr(settings, 'MEDIA_ACCEL', None)
+    if accel == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(name)
+        return response
+    if accel == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = default_storage.path(name)
+        return response
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and _if_range_matches(request, etag, last_modified):
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        response = FileResponse(default_storage.open(name), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(default_storage.open(name), start, end - start + 1), status=206, content_type=content_type
+        )
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
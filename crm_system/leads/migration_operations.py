@@ -0,0 +1,25 @@
+"""
+Migration operations for the large lead tables.
+
+``AddIndexConcurrently`` builds the index with ``CREATE INDEX CONCURRENTLY``
+on PostgreSQL, so the table keeps taking writes while it builds. Other
+databases get a plain ``CREATE INDEX``. Migrations using it must set
+``atomic = False``.
+"""
+from django.contrib.postgres import operations
+from django.db.migrations import AddIndex
+
+
+class AddIndexConcurrently(operations.AddIndexConcurrently):
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super(AddIndexConcurrently, self).database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super(AddIndexConcurrently, self).database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
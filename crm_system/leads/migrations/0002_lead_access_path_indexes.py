@@ -0,0 +1,41 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+from crm_system.leads.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('leads', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='followup',
+            index=models.Index(fields=['lead', 'date_added'], name='followup_lead_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'agent', 'date_added'], name='lead_org_agent_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'date_added'], name='lead_org_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'category', 'converted_date'], name='lead_org_cat_converted_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(condition=models.Q(('agent__isnull', True)), fields=['organisation', 'date_added'], name='lead_org_unassigned_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(condition=models.Q(('category__isnull', True)), fields=['organisation'], name='lead_org_uncategorised_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:53
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def flag_converted_categories(apps, schema_editor):
+    Category = apps.get_model('leads', 'Category')
+    first_ids = (
+        Category.objects.filter(name='Converted')
+        .values('organisation')
+        .annotate(first_id=Min('id'))
+        .values_list('first_id', flat=True)
+    )
+    Category.objects.filter(id__in=list(first_ids)).update(is_converted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0002_lead_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='is_converted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(flag_converted_categories, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_converted', True)), fields=('organisation',), name='category_one_converted_per_org'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:02
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+POSTGRESQL_INDEXES = (
+    ('lead_search_vector_idx', 'search_vector'),
+    ('lead_first_name_trgm_idx', 'first_name gin_trgm_ops'),
+    ('lead_last_name_trgm_idx', 'last_name gin_trgm_ops'),
+    ('lead_email_trgm_idx', 'email gin_trgm_ops'),
+)
+
+
+def create_search_structures(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for name, expression in POSTGRESQL_INDEXES:
+            schema_editor.execute(f'CREATE INDEX CONCURRENTLY {name} ON leads_lead USING gin ({expression})')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE leads_lead_fts USING fts5("
+            "first_name, last_name, email, phone_number, description, notes, "
+            "organisation_id UNINDEXED, agent_id UNINDEXED, prefix='2 3')"
+        )
+
+
+def drop_search_structures(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for name, expression in POSTGRESQL_INDEXES:
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS leads_lead_fts')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('leads', '0003_category_is_converted'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='lead',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_structures, drop_search_structures),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:59
+
+from django.db import migrations, models
+
+from crm_system.leads.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('leads', '0004_lead_search'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['category', 'date_added'], name='lead_category_date_idx'),
+        ),
+    ]
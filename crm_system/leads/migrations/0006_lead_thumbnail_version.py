@@ -0,0 +1,18 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0005_lead_category_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='thumbnail_version',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+    ]
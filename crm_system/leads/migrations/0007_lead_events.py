@@ -0,0 +1,42 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agents', '0002_profile_routing_strategy'),
+        ('leads', '0006_lead_thumbnail_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadEventCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LeadEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('created', 'Created'), ('assigned', 'Assigned'), ('category_changed', 'Category changed'), ('converted', 'Converted'), ('followup_added', 'Follow-up added')], max_length=20)),
+                ('previous_id', models.BigIntegerField(null=True)),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('agent', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='agents.agent')),
+                ('category', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='leads.category')),
+                ('lead', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='leads.lead')),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='agents.profile')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='leadevent',
+            index=models.Index(fields=['organisation', 'occurred_at'], name='leadevent_org_occurred_idx'),
+        ),
+    ]
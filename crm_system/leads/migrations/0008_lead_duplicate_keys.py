@@ -0,0 +1,71 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from crm_system.leads.dedup import set_blocking_keys
+from crm_system.leads.migration_operations import AddIndexConcurrently
+
+BATCH_SIZE = 2000
+
+
+def backfill_blocking_keys(apps, schema_editor):
+    Lead = apps.get_model('leads', 'Lead')
+    last_id = 0
+    while True:
+        leads = list(
+            Lead.objects.filter(id__gt=last_id).order_by('id')
+            .only('id', 'first_name', 'last_name', 'email', 'phone_number')[:BATCH_SIZE]
+        )
+        if not leads:
+            break
+        for lead in leads:
+            set_blocking_keys(lead)
+        Lead.objects.bulk_update(leads, ['email_key', 'phone_key', 'name_key'])
+        last_id = leads[-1].id
+
+
+class Migration(migrations.Migration):
+    # Backfill in committed batches rather than one transaction over every lead, and
+    # build the indexes with CREATE INDEX CONCURRENTLY, which cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('leads', '0007_lead_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='leads.lead'),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='email_key',
+            field=models.CharField(blank=True, editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='name_key',
+            field=models.CharField(blank=True, editable=False, max_length=8),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='phone_key',
+            field=models.CharField(blank=True, editable=False, max_length=20),
+        ),
+        migrations.RunPython(backfill_blocking_keys, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'email_key'], name='lead_org_email_key_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'phone_key'], name='lead_org_phone_key_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'name_key'], name='lead_org_name_key_idx'),
+        ),
+    ]
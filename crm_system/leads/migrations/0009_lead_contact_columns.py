@@ -0,0 +1,54 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:17
+
+from django.db import migrations, models
+
+from crm_system.leads.contacts import normalise_email, normalise_phone
+from crm_system.leads.migration_operations import AddIndexConcurrently
+
+BATCH_SIZE = 2000
+
+
+def backfill_contact_columns(apps, schema_editor):
+    Lead = apps.get_model('leads', 'Lead')
+    last_id = 0
+    while True:
+        leads = list(Lead.objects.filter(id__gt=last_id).order_by('id').only('id', 'email', 'phone_number')[:BATCH_SIZE])
+        if not leads:
+            break
+        for lead in leads:
+            lead.email_normalised = normalise_email(lead.email)
+            lead.phone_e164 = normalise_phone(lead.phone_number)
+        Lead.objects.bulk_update(leads, ['email_normalised', 'phone_e164'])
+        last_id = leads[-1].id
+
+
+class Migration(migrations.Migration):
+    # Backfill in committed batches rather than one transaction over every lead, and
+    # build the indexes with CREATE INDEX CONCURRENTLY, which cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('leads', '0008_lead_duplicate_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='email_normalised',
+            field=models.CharField(blank=True, editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='phone_e164',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.RunPython(backfill_contact_columns, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'email_normalised'], name='lead_org_email_norm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'phone_e164'], name='lead_org_phone_e164_idx'),
+        ),
+    ]
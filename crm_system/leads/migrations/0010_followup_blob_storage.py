@@ -0,0 +1,75 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:27
+
+import crm_system.leads.blobs
+import crm_system.leads.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+from crm_system.leads.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('leads', '0009_lead_contact_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('notes', models.TextField(blank=True)),
+                ('size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='followup',
+            name='file_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='followup',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=crm_system.leads.blobs.get_blob_storage, upload_to=crm_system.leads.models.handle_upload_follow_ups),
+        ),
+        AddIndexConcurrently(
+            model_name='followup',
+            index=models.Index(fields=['file'], name='followup_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blob',
+            index=models.Index(condition=models.Q(('ref_count__lte', 0)), fields=['updated_at'], name='blob_unreferenced_idx'),
+        ),
+        migrations.AddField(
+            model_name='attachmentupload',
+            name='lead',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leads.lead'),
+        ),
+        migrations.AddField(
+            model_name='attachmentupload',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
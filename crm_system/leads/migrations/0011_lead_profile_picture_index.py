@@ -0,0 +1,22 @@
+# Generated by Django 4.1.4 on 2026-10-18 04:08
+
+from django.db import migrations, models
+
+from crm_system.leads.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('leads', '0010_followup_blob_storage'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'profile_picture'], name='lead_org_picture_idx',
+                               condition=models.Q(profile_picture__gt='')),
+        ),
+    ]
@@ -1,19 +1,53 @@
+import uuid
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 from crm_system.agents.models import Profile, Agent
+from crm_system.agents.tenancy import get_tenant
+from .blobs import get_blob_storage
+
+
+class CategoryQuerySet(models.QuerySet):
+    def for_user(self, user):
+        return self.filter(organisation_id=get_tenant(user).organisation_id)
 
 
 class Category(models.Model):
     name = models.CharField(max_length=30)
     organisation = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    is_converted = models.BooleanField(default=False)
+
+    objects = CategoryQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['organisation'], condition=models.Q(is_converted=True),
+                                    name='category_one_converted_per_org'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class LeadQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """Leads of the user's organisation; agents only see the leads assigned to them."""
+        tenant = get_tenant(user)
+        queryset = self.filter(organisation_id=tenant.organisation_id)
+        if not tenant.is_organizer:
+            queryset = queryset.filter(agent_id=tenant.agent_id)
+        return queryset
+
+
 class LeadManager(models.Manager):
     def get_queryset(self):
-        return super().get_queryset()
+        return LeadQuerySet(self.model, using=self._db).defer('search_vector')
+
+    def for_user(self, user):
+        return self.get_queryset().for_user(user)
 
 
 class Lead(models.Model):
@@ -29,22 +63,171 @@ class Lead(models.Model):
     email = models.EmailField()
     profile_picture = models.ImageField(null=True, blank=True, upload_to="profile_pictures/")
     converted_date = models.DateTimeField(null=True, blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    thumbnail_version = models.CharField(max_length=12, blank=True, editable=False)
+    email_key = models.CharField(max_length=254, blank=True, editable=False)
+    phone_key = models.CharField(max_length=20, blank=True, editable=False)
+    name_key = models.CharField(max_length=8, blank=True, editable=False)
+    email_normalised = models.CharField(max_length=254, blank=True, editable=False)
+    phone_e164 = models.CharField(max_length=16, blank=True, editable=False)
+    duplicate_of = models.ForeignKey('self', null=True, blank=True, related_name='+', editable=False,
+                                     on_delete=models.SET_NULL)
 
     objects = LeadManager()
 
+    loaded_values = None
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['organisation', 'agent', 'date_added'], name='lead_org_agent_date_idx'),
+            models.Index(fields=['organisation', 'date_added'], name='lead_org_date_idx'),
+            models.Index(fields=['organisation', 'category', 'converted_date'], name='lead_org_cat_converted_idx'),
+            models.Index(fields=['organisation', 'date_added'], name='lead_org_unassigned_idx',
+                         condition=models.Q(agent__isnull=True)),
+            models.Index(fields=['organisation'], name='lead_org_uncategorised_idx',
+                         condition=models.Q(category__isnull=True)),
+            models.Index(fields=['category', 'date_added'], name='lead_category_date_idx'),
+            models.Index(fields=['organisation', 'email_key'], name='lead_org_email_key_idx'),
+            models.Index(fields=['organisation', 'phone_key'], name='lead_org_phone_key_idx'),
+            models.Index(fields=['organisation', 'name_key'], name='lead_org_name_key_idx'),
+            models.Index(fields=['organisation', 'email_normalised'], name='lead_org_email_norm_idx'),
+            models.Index(fields=['organisation', 'phone_e164'], name='lead_org_phone_e164_idx'),
+            models.Index(fields=['organisation', 'profile_picture'], name='lead_org_picture_idx',
+                         condition=models.Q(profile_picture__gt='')),
+        ]
+
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_values = dict(zip(field_names, values))
+        return instance
+
 
 def handle_upload_follow_ups(instance, filename):
     return f'lead_followups/lead_{instance.lead.pk}/{filename}'
 
 
+class FollowUpQuerySet(models.QuerySet):
+    def for_user(self, user):
+        tenant = get_tenant(user)
+        queryset = self.filter(lead__organisation_id=tenant.organisation_id)
+        if not tenant.is_organizer:
+            queryset = queryset.filter(lead__agent_id=tenant.agent_id)
+        return queryset
+
+
 class FollowUp(models.Model):
     lead = models.ForeignKey(Lead, related_name='followups', on_delete=models.CASCADE)
     date_added = models.DateTimeField(auto_now_add=True)
     notes = models.TextField(blank=True, null=True)
-    file = models.FileField(null=True, blank=True, upload_to=handle_upload_follow_ups)
+    file = models.FileField(null=True, blank=True, upload_to=handle_upload_follow_ups, storage=get_blob_storage)
+    file_name = models.CharField(max_length=255, blank=True, editable=False)
+
+    objects = FollowUpQuerySet.as_manager()
+
+    loaded_values = None
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lead', 'date_added'], name='followup_lead_date_idx'),
+            models.Index(fields=['file'], name='followup_file_idx'),
+        ]
 
     def __str__(self):
         return f"{self.lead.first_name} {self.lead.last_name}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_values = dict(zip(field_names, values))
+        return instance
+
+
+class Blob(models.Model):
+    """A stored attachment, shared by every follow-up with the same content."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='blob_unreferenced_idx', condition=models.Q(ref_count__lte=0)),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count} reference(s))'
+
+
+class AttachmentUpload(models.Model):
+    """A resumable follow-up attachment upload, received in chunks until ``offset`` reaches ``size``."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    lead = models.ForeignKey(Lead, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    notes = models.TextField(blank=True)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.file_name} ({self.offset}/{self.size})'
+
+
+class LeadEventQuerySet(models.QuerySet):
+    def after(self, position):
+        """Events recorded after the high-water mark ``position``, oldest first."""
+        return self.filter(id__gt=position).order_by('id')
+
+
+class LeadEvent(models.Model):
+    """
+    Append-only history of a lead: one row per creation, assignment, category
+    change, conversion or follow-up, never updated or deleted with the lead.
+    """
+    CREATED = 'created'
+    ASSIGNED = 'assigned'
+    CATEGORY_CHANGED = 'category_changed'
+    CONVERTED = 'converted'
+    FOLLOWUP_ADDED = 'followup_added'
+    KIND_CHOICES = (
+        (CREATED, 'Created'),
+        (ASSIGNED, 'Assigned'),
+        (CATEGORY_CHANGED, 'Category changed'),
+        (CONVERTED, 'Converted'),
+        (FOLLOWUP_ADDED, 'Follow-up added'),
+    )
+
+    organisation = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    lead = models.ForeignKey(Lead, related_name='events', on_delete=models.DO_NOTHING, db_constraint=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    agent = models.ForeignKey(Agent, null=True, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    category = models.ForeignKey(Category, null=True, related_name='+', on_delete=models.DO_NOTHING,
+                                 db_constraint=False)
+    previous_id = models.BigIntegerField(null=True)
+    occurred_at = models.DateTimeField(default=timezone.now)
+
+    objects = LeadEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['organisation', 'occurred_at'], name='leadevent_org_occurred_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} lead {self.lead_id}'
+
+
+class LeadEventCursor(models.Model):
+    """How far a named consumer of ``LeadEvent`` has read."""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} @ {self.position}'
@@ -0,0 +1,95 @@
+import base64
+import binascii
+import datetime
+
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def get_page_size(request, param='page_size', default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        page_size = int(request.GET.get(param, default))
+    except (TypeError, ValueError):
+        page_size = default
+    return max(1, min(page_size, maximum))
+
+
+def encode_cursor(obj):
+    raw = f'{obj.date_added.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """Return the ``(date_added, pk)`` pair stored in a cursor, or None if it is malformed."""
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        date_added, pk = raw.split('|')
+        return datetime.datetime.fromisoformat(date_added), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    """
+    One page of a queryset ordered newest first on ``(date_added, id)``.
+
+    The page is fetched lazily, with a single ``LIMIT page_size + 1`` query,
+    the first time it is iterated or asked whether there is a next page.
+    """
+
+    def __init__(self, queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+        self.queryset = queryset.order_by('-date_added', '-id')
+        self.cursor = cursor
+        self.page_size = page_size
+
+    def _page_queryset(self):
+        queryset = self.queryset
+        position = decode_cursor(self.cursor)
+        if position is not None:
+            date_added, pk = position
+            queryset = queryset.filter(
+                Q(date_added__lt=date_added) | Q(date_added=date_added, id__lt=pk)
+            )
+        return queryset[:self.page_size + 1]
+
+    @cached_property
+    def _rows(self):
+        return list(self._page_queryset())
+
+    async def aload(self):
+        """Fetch the page with the async ORM, so rendering it later runs no query."""
+        if '_rows' not in self.__dict__:
+            self.__dict__['_rows'] = [obj async for obj in self._page_queryset()]
+        return self
+
+    @property
+    def object_list(self):
+        return self._rows[:self.page_size]
+
+    @property
+    def has_next(self):
+        return len(self._rows) > self.page_size
+
+    @property
+    def has_previous(self):
+        return decode_cursor(self.cursor) is not None
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        return encode_cursor(self.object_list[-1])
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self._rows)
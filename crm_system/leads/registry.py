@@ -0,0 +1,39 @@
+from django.core.cache import cache
+
+
+class CategoryRegistry:
+    """The categories of one organisation and which of them marks a lead as converted."""
+
+    def __init__(self, names, converted_id=None):
+        self.names = names
+        self.converted_id = converted_id
+
+    def name(self, category_id):
+        return self.names.get(category_id)
+
+    def is_converted(self, category_id):
+        return category_id is not None and category_id == self.converted_id
+
+
+def _key(organisation_id):
+    return f'category-registry:{organisation_id}'
+
+
+def get_category_registry(organisation_id):
+    registry = cache.get(_key(organisation_id))
+    if registry is None:
+        from .models import Category
+
+        names, converted_id = {}, None
+        rows = Category.objects.filter(organisation_id=organisation_id).values_list('id', 'name', 'is_converted')
+        for pk, name, is_converted in rows:
+            names[pk] = name
+            if is_converted:
+                converted_id = pk
+        registry = CategoryRegistry(names, converted_id)
+        cache.set(_key(organisation_id), registry, None)
+    return registry
+
+
+def invalidate_category_registry(organisation_id):
+    cache.delete(_key(organisation_id))
@@ -0,0 +1,166 @@
+"""
+Automatic assignment of new leads to agents.
+
+Each organisation picks a strategy in ``Profile.routing_strategy``. The
+load-aware routers read per-agent counts of open leads (assigned and not
+in the converted category) from the cache. The lead signals, the importer
+and the bulk actions keep those counts up to date incrementally, so routing
+a lead never counts ``Lead`` rows.
+"""
+from collections import Counter
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from crm_system.agents.models import Agent, Profile
+from .registry import get_category_registry
+
+LOAD_TIMEOUT = 60 * 60
+AFFINITY_TIMEOUT = 60 * 10
+AFFINITY_AGENTS = 3
+
+
+def _load_key(organisation_id, agent_id):
+    return f'routing:{organisation_id}:load:{agent_id}'
+
+
+def _open_leads(organisation_id):
+    from .models import Lead
+
+    queryset = Lead.objects.filter(organisation_id=organisation_id, agent__isnull=False)
+    converted_id = get_category_registry(organisation_id).converted_id
+    if converted_id is not None:
+        queryset = queryset.filter(Q(category__isnull=True) | ~Q(category_id=converted_id))
+    return queryset
+
+
+def compute_agent_loads(organisation_id, agent_ids):
+    loads = dict.fromkeys(agent_ids, 0)
+    rows = _open_leads(organisation_id).values('agent_id').annotate(count=Count('id')).order_by()
+    loads.update((row['agent_id'], row['count']) for row in rows if row['agent_id'] in loads)
+    return loads
+
+
+def get_agent_loads(organisation_id, agent_ids):
+    """Return ``{agent_id: open leads}``, recounting with one grouped query when any count is missing."""
+    keys = {agent_id: _load_key(organisation_id, agent_id) for agent_id in agent_ids}
+    cached = cache.get_many(keys.values())
+    if len(cached) == len(keys):
+        return {agent_id: cached[key] for agent_id, key in keys.items()}
+    loads = compute_agent_loads(organisation_id, agent_ids)
+    cache.set_many({keys[agent_id]: load for agent_id, load in loads.items()}, LOAD_TIMEOUT)
+    return loads
+
+
+def adjust_agent_loads(organisation_id, deltas):
+    for agent_id, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(_load_key(organisation_id, agent_id), delta)
+        except ValueError:
+            # Not cached yet (or expired): the next read recounts every agent.
+            pass
+
+
+def invalidate_agent_loads(organisation_id):
+    agent_ids = Agent.objects.filter(organisation_id=organisation_id).values_list('id', flat=True)
+    cache.delete_many([_load_key(organisation_id, agent_id) for agent_id in agent_ids])
+
+
+def open_lead_agent(values, converted_category_id):
+    """Return the agent whose load a lead with the given field values counts towards, if any."""
+    if not values or values.get('agent_id') is None:
+        return None
+    if converted_category_id is not None and values.get('category_id') == converted_category_id:
+        return None
+    return values['agent_id']
+
+
+def get_category_affinity(organisation_id):
+    """Return ``{category_id: [agent_id, ...]}`` listing the agents holding most of each category's leads."""
+    from .models import Lead
+
+    key = f'routing:{organisation_id}:affinity'
+    affinity = cache.get(key)
+    if affinity is None:
+        rows = (
+            Lead.objects.filter(organisation_id=organisation_id, agent__isnull=False, category__isnull=False)
+            .values('category_id', 'agent_id').annotate(count=Count('id')).order_by('category_id', '-count')
+        )
+        affinity = {}
+        for row in rows:
+            agents = affinity.setdefault(row['category_id'], [])
+            if len(agents) < AFFINITY_AGENTS:
+                agents.append(row['agent_id'])
+        cache.set(key, affinity, AFFINITY_TIMEOUT)
+    return affinity
+
+
+class Router:
+    """Choose agents for the new leads of one organisation."""
+
+    def __init__(self, organisation_id):
+        self.organisation_id = organisation_id
+        self.agent_ids = list(
+            Agent.objects.filter(organisation_id=organisation_id).order_by('id').values_list('id', flat=True)
+        )
+
+    def route(self, leads):
+        """Set ``agent_id`` on every unassigned lead and return how many leads each agent received."""
+        unassigned = [lead for lead in leads if lead.agent_id is None]
+        if not unassigned or not self.agent_ids:
+            return Counter()
+        self.assign(unassigned)
+        return Counter(lead.agent_id for lead in unassigned)
+
+    def assign(self, leads):
+        raise NotImplementedError
+
+
+class RoundRobinRouter(Router):
+    def assign(self, leads):
+        key = f'routing:{self.organisation_id}:round-robin'
+        cache.add(key, 0, None)
+        # Reserve a block of positions with one increment, however many leads are routed.
+        end = cache.incr(key, len(leads))
+        for position, lead in enumerate(leads, start=end - len(leads)):
+            lead.agent_id = self.agent_ids[position % len(self.agent_ids)]
+
+
+class LeastOpenLeadsRouter(Router):
+    def assign(self, leads):
+        loads = get_agent_loads(self.organisation_id, self.agent_ids)
+        for lead in leads:
+            lead.agent_id = min(self.candidates(lead), key=lambda agent_id: (loads[agent_id], agent_id))
+            loads[lead.agent_id] += 1
+
+    def candidates(self, lead):
+        return self.agent_ids
+
+
+class CategoryAffinityRouter(LeastOpenLeadsRouter):
+    """Prefer the least loaded of the agents already working the lead's category."""
+
+    def assign(self, leads):
+        self.affinity = get_category_affinity(self.organisation_id)
+        super(CategoryAffinityRouter, self).assign(leads)
+
+    def candidates(self, lead):
+        agents = [agent_id for agent_id in self.affinity.get(lead.category_id, []) if agent_id in self.agent_ids]
+        return agents or self.agent_ids
+
+
+ROUTERS = {
+    Profile.ROUTING_ROUND_ROBIN: RoundRobinRouter,
+    Profile.ROUTING_LEAST_OPEN: LeastOpenLeadsRouter,
+    Profile.ROUTING_CATEGORY_AFFINITY: CategoryAffinityRouter,
+}
+
+
+def get_router(organisation_id, strategy=None):
+    """Return the organisation's router, or None when its leads are assigned manually."""
+    if strategy is None:
+        strategy = Profile.objects.filter(id=organisation_id).values_list('routing_strategy', flat=True).first()
+    router_class = ROUTERS.get(strategy)
+    return router_class(organisation_id) if router_class else None
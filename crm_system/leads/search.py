@@ -0,0 +1,139 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.contrib.postgres.aggregates import StringAgg
+from django.db import connection
+from django.db.models import F, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from crm_system.agents.tenancy import get_tenant
+from .models import Lead, FollowUp
+
+FTS_TABLE = 'leads_lead_fts'
+SEARCH_CONFIG = 'simple'
+
+
+def _notes_subquery():
+    return Subquery(
+        FollowUp.objects.filter(lead=OuterRef('pk'))
+        .values('lead')
+        .annotate(notes=StringAgg('notes', ' ', default=Value('')))
+        .values('notes')
+    )
+
+
+def search_vector_expression():
+    return (
+        SearchVector('first_name', 'last_name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('email', 'phone_number', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+        + SearchVector(Coalesce(_notes_subquery(), Value(''), output_field=TextField()), weight='D', config=SEARCH_CONFIG)
+    )
+
+
+def refresh_search_index(lead_ids):
+    """Recompute the search document of the given leads after they or their follow-ups changed."""
+    lead_ids = list(lead_ids)
+    if not lead_ids:
+        return
+    if connection.vendor == 'postgresql':
+        Lead.objects.filter(id__in=lead_ids).update(search_vector=search_vector_expression())
+    elif connection.vendor == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(lead_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', lead_ids)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} '
+                f'(rowid, first_name, last_name, email, phone_number, description, notes, organisation_id, agent_id) '
+                f'SELECT l.id, l.first_name, l.last_name, l.email, l.phone_number, l.description, '
+                f'(SELECT group_concat(f.notes, \' \') FROM leads_followup f WHERE f.lead_id = l.id), '
+                f'l.organisation_id, l.agent_id '
+                f'FROM leads_lead l WHERE l.id IN ({placeholders})',
+                lead_ids,
+            )
+
+
+def remove_from_search_index(lead_id):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [lead_id])
+
+
+def _subquery_sql(queryset):
+    return queryset.values('id').query.sql_with_params()
+
+
+def reassign_in_search_index(queryset, agent_id):
+    """Point the search rows of every lead in ``queryset`` at a new agent, before the leads are updated."""
+    if connection.vendor == 'sqlite':
+        sql, params = _subquery_sql(queryset)
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {FTS_TABLE} SET agent_id = %s WHERE rowid IN ({sql})', [agent_id, *params])
+
+
+def remove_leads_from_search_index(queryset):
+    """Drop the search rows of every lead in ``queryset``, before the leads are deleted."""
+    if connection.vendor == 'sqlite':
+        sql, params = _subquery_sql(queryset)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({sql})', params)
+
+
+def _fts5_query(text):
+    terms = re.findall(r'\w+', text)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _search_sqlite(user, text, offset, limit):
+    match = _fts5_query(text)
+    if not match:
+        return []
+    tenant = get_tenant(user)
+    sql = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND organisation_id = %s'
+    params = [match, tenant.organisation_id]
+    if not tenant.is_organizer:
+        sql += ' AND agent_id = %s'
+        params.append(tenant.agent_id)
+    sql += f' ORDER BY bm25({FTS_TABLE}, 10, 10, 5, 5, 2, 1) LIMIT %s OFFSET %s'
+    params += [limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+    leads = Lead.objects.for_user(user).in_bulk(ids)
+    return [leads[pk] for pk in ids if pk in leads]
+
+
+def search_leads(user, text, offset, limit):
+    """
+    Return up to ``limit`` of the user's leads matching ``text``, best first.
+
+    PostgreSQL ranks the weighted ``search_vector`` and falls back on trigram
+    similarity of names and email for typos, using the indexed ``%`` operator
+    and so ``pg_trgm.similarity_threshold``. SQLite ranks an FTS5 table with
+    bm25 and prefix matching. Other backends get a plain ``icontains`` scan.
+    """
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(user, text, offset, limit)
+    queryset = Lead.objects.for_user(user)
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+        queryset = queryset.annotate(
+            rank=SearchRank(F('search_vector'), query),
+            similarity=Greatest(
+                TrigramSimilarity('first_name', text),
+                TrigramSimilarity('last_name', text),
+                TrigramSimilarity('email', text),
+            ),
+        ).filter(
+            Q(search_vector=query)
+            | Q(first_name__trigram_similar=text)
+            | Q(last_name__trigram_similar=text)
+            | Q(email__trigram_similar=text)
+        ).order_by('-rank', '-similarity', '-id')
+    else:
+        queryset = queryset.filter(
+            Q(first_name__icontains=text) | Q(last_name__icontains=text) | Q(email__icontains=text)
+            | Q(phone_number__icontains=text) | Q(description__icontains=text)
+            | Q(followups__notes__icontains=text)
+        ).distinct().order_by('-id')
+    return list(queryset[offset:offset + limit])
@@ -0,0 +1,149 @@
+import os
+
+from django.db.models import FileField
+from django.db.models.signals import post_save, post_delete, pre_save
+
+from crm_system.agents.tenancy import bump_organisation_version
+from crm_system.main.tasks import enqueue
+from .blobs import release_blob, retain_blob
+from .contacts import set_contact_fields
+from .counters import adjust_dashboard_counters, invalidate_dashboard_counters, lead_contributions
+from .dedup import set_blocking_keys
+from .events import followup_event, lead_events, record_events
+from .models import Lead, Category, FollowUp
+from .registry import get_category_registry, invalidate_category_registry
+from .routing import adjust_agent_loads, invalidate_agent_loads, open_lead_agent
+from .search import refresh_search_index, remove_from_search_index
+
+TRACKED_FIELDS = ('organisation_id', 'agent_id', 'category_id', 'date_added', 'converted_date')
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'phone_number', 'description', 'organisation_id', 'agent_id')
+
+
+def _tracked_values(instance):
+    return {name: getattr(instance, name) for name in TRACKED_FIELDS}
+
+
+def _stored_values(instance):
+    """
+    The values a just saved lead now has in the database, as ``Lead.from_db``
+    records them: file names rather than the ``FieldFile`` objects, which are
+    changed in place, and without loading deferred fields.
+    """
+    deferred = instance.get_deferred_fields()
+    values = {}
+    for field in Lead._meta.concrete_fields:
+        if field.attname not in deferred:
+            value = getattr(instance, field.attname)
+            values[field.attname] = value.name if isinstance(field, FileField) else value
+    return values
+
+
+def _changed(instance, fields):
+    before = instance.loaded_values
+    if before is None:
+        return True
+    return any(name not in before or before[name] != getattr(instance, name) for name in fields)
+
+
+def _update_dashboard_counters(before, after):
+    organisation_id = (after or before)['organisation_id']
+    converted_id = get_category_registry(organisation_id).converted_id
+    old = lead_contributions(before, converted_id)
+    new = lead_contributions(after, converted_id)
+    adjust_dashboard_counters(organisation_id, **{name: new[name] - old[name] for name in new})
+
+
+def _update_agent_loads(before, after):
+    organisation_id = (after or before)['organisation_id']
+    converted_id = get_category_registry(organisation_id).converted_id
+    old = open_lead_agent(before, converted_id)
+    new = open_lead_agent(after, converted_id)
+    if old != new:
+        deltas = {agent_id: delta for agent_id, delta in ((old, -1), (new, 1)) if agent_id is not None}
+        adjust_agent_loads(organisation_id, deltas)
+
+
+def _update_lead_aggregates(before, after):
+    _update_dashboard_counters(before, after)
+    _update_agent_loads(before, after)
+
+
+def lead_pre_save(sender, instance, **kwargs):
+    set_contact_fields(instance)
+    set_blocking_keys(instance)
+
+
+def lead_saved(sender, instance, created, **kwargs):
+    after = _tracked_values(instance)
+    before = instance.loaded_values
+    events = []
+    if created:
+        _update_lead_aggregates(None, after)
+        events = lead_events(instance)
+    elif before is None or not set(TRACKED_FIELDS) <= before.keys():
+        # Saved without a full snapshot of what was stored: recount lazily.
+        invalidate_dashboard_counters(after['organisation_id'])
+        invalidate_agent_loads(after['organisation_id'])
+    elif before['organisation_id'] != after['organisation_id']:
+        _update_lead_aggregates(before, None)
+        _update_lead_aggregates(None, after)
+    else:
+        _update_lead_aggregates(before, after)
+        events = lead_events(instance, before)
+    record_events(events)
+    bump_organisation_version(after['organisation_id'])
+    if created or _changed(instance, SEARCH_FIELDS):
+        refresh_search_index([instance.pk])
+    if _changed(instance, ('profile_picture',)) and (instance.profile_picture or instance.thumbnail_version):
+        enqueue('leads.thumbnails', lead_id=instance.pk)
+    instance.loaded_values = _stored_values(instance)
+
+
+def lead_deleted(sender, instance, **kwargs):
+    _update_lead_aggregates(_tracked_values(instance), None)
+    bump_organisation_version(instance.organisation_id)
+    remove_from_search_index(instance.pk)
+
+
+def followup_changed(sender, instance, **kwargs):
+    refresh_search_index([instance.lead_id])
+    bump_organisation_version(instance.lead.organisation_id)
+
+
+def followup_pre_save(sender, instance, **kwargs):
+    if instance.file and not instance.file._committed:
+        instance.file_name = os.path.basename(instance.file.name)
+
+
+def followup_saved(sender, instance, created, **kwargs):
+    if created:
+        record_events([followup_event(instance)])
+    before = (instance.loaded_values or {}).get('file') or ''
+    after = instance.file.name or ''
+    if before != after:
+        retain_blob(after)
+        release_blob(before)
+    instance.loaded_values = dict(instance.loaded_values or {}, file=after)
+
+
+def followup_deleted(sender, instance, **kwargs):
+    release_blob(instance.file.name)
+
+
+def category_changed(sender, instance, **kwargs):
+    invalidate_category_registry(instance.organisation_id)
+    invalidate_dashboard_counters(instance.organisation_id)
+    invalidate_agent_loads(instance.organisation_id)
+    bump_organisation_version(instance.organisation_id)
+
+
+pre_save.connect(lead_pre_save, sender=Lead)
+post_save.connect(lead_saved, sender=Lead)
+post_delete.connect(lead_deleted, sender=Lead)
+post_save.connect(category_changed, sender=Category)
+post_delete.connect(category_changed, sender=Category)
+post_save.connect(followup_changed, sender=FollowUp)
+post_delete.connect(followup_changed, sender=FollowUp)
+pre_save.connect(followup_pre_save, sender=FollowUp)
+post_save.connect(followup_saved, sender=FollowUp)
+post_delete.connect(followup_deleted, sender=FollowUp)
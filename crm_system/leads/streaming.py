@@ -0,0 +1,31 @@
+import csv
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+STREAM_CHUNK_SIZE = 2000
+
+
+def chunked(iterable, size=STREAM_CHUNK_SIZE):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(columns, rows):
+    """Yield CSV text for ``rows`` (tuples), one string per chunk of rows."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for chunk in chunked(rows):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def stream_jsonl(columns, rows):
+    encoder = DjangoJSONEncoder()
+    for chunk in chunked(rows):
+        yield ''.join(encoder.encode(dict(zip(columns, row))) + '\n' for row in chunk)
@@ -0,0 +1,69 @@
+import codecs
+import logging
+
+from django.core.files.storage import default_storage
+from PIL import UnidentifiedImageError
+
+from crm_system.agents.models import Profile
+from crm_system.main.tasks import queue_mail, save_checkpoint, task
+from .importer import ImportResult, LeadImporter
+from .models import Lead
+from .thumbnails import delete_thumbnails, render_thumbnails
+
+logger = logging.getLogger(__name__)
+
+MAILED_ERRORS = 100
+
+
+@task('leads.import', bind=True)
+def import_leads(queued, organisation_id, path, batch_size=1000, checkpoint=None):
+    """
+    Import an uploaded CSV file. Every committed batch checkpoints the line
+    it ended on, so a retry or a reclaimed run resumes after it instead of
+    importing the committed rows again.
+    """
+    organisation = Profile.objects.select_related('user').get(id=organisation_id)
+    checkpoint = checkpoint or {}
+    result = ImportResult()
+    result.created = checkpoint.get('created', 0)
+    result.rejected = checkpoint.get('rejected', 0)
+    result.errors = [tuple(error) for error in checkpoint.get('errors', [])]
+
+    def on_batch(line_number, result):
+        save_checkpoint(
+            queued, line=line_number, created=result.created, rejected=result.rejected,
+            errors=result.errors[:MAILED_ERRORS],
+        )
+
+    importer = LeadImporter(organisation, batch_size=batch_size, on_batch=on_batch)
+    with default_storage.open(path, 'rb') as upload:
+        importer.run(codecs.getreader('utf-8-sig')(upload), result, start_line=checkpoint.get('line', 0))
+    default_storage.delete(path)
+
+    lines = [f'{result.created} lead(s) imported, {result.rejected} row(s) rejected.']
+    lines += [f'Line {line_number}: {errors}' for line_number, errors in result.errors[:MAILED_ERRORS]]
+    if organisation.user.email:
+        queue_mail(
+            subject='Your lead import has finished',
+            message='\n'.join(lines),
+            from_email='test@test.com',
+            recipient_list=[organisation.user.email],
+        )
+
+
+@task('leads.thumbnails')
+def generate_thumbnails(lead_id):
+    lead = Lead.objects.filter(pk=lead_id).only('profile_picture', 'thumbnail_version').first()
+    if lead is None:
+        return
+    version = ''
+    if lead.profile_picture:
+        try:
+            version = render_thumbnails(lead.pk, lead.profile_picture.name)
+        except (OSError, UnidentifiedImageError):
+            logger.warning('Could not create thumbnails for %s', lead.profile_picture.name, exc_info=True)
+            return
+    # update() keeps this out of the lead signals, which would enqueue the task again.
+    Lead.objects.filter(pk=lead.pk).update(thumbnail_version=version)
+    if lead.thumbnail_version and lead.thumbnail_version != version:
+        delete_thumbnails(lead.pk, lead.thumbnail_version)
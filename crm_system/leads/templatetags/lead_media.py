@@ -0,0 +1,32 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from crm_system.leads.thumbnails import THUMBNAIL_SIZES, thumbnail_name
+
+register = template.Library()
+
+
+def _srcset(lead, extension):
+    return ', '.join(
+        f'{default_storage.url(thumbnail_name(lead.pk, lead.thumbnail_version, size, extension))} {size}w'
+        for size in THUMBNAIL_SIZES
+    )
+
+
+@register.simple_tag
+def lead_avatar(lead, size=40, css_class=''):
+    """Render the lead's profile picture at ``size`` CSS pixels, using thumbnails once they exist."""
+    if not lead.profile_picture:
+        return ''
+    if not lead.thumbnail_version:
+        return format_html('<img class="{}" src="{}" width="{}" height="{}" alt="">',
+                           css_class, lead.profile_picture.url, size, size)
+    fallback = default_storage.url(thumbnail_name(lead.pk, lead.thumbnail_version, size, 'jpg'))
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}px">'
+        '<img class="{}" src="{}" srcset="{}" sizes="{}px" width="{}" height="{}" alt="" loading="lazy">'
+        '</picture>',
+        _srcset(lead, 'webp'), size, css_class, fallback, _srcset(lead, 'jpg'), size, size, size,
+    )
@@ -1,3 +1,1232 @@
-from django.test import TestCase
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.migrations.loader import MigrationLoader
+from django.http import Http404
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from PIL import Image
+
+from crm_system.agents.models import Agent, Profile, User
+from crm_system.main.models import Task
+from crm_system.main.tasks import enqueue
+from . import blobs
+from .async_views import AsyncLeadDetailView, AsyncLeadJsonView, AsyncLeadListView
+from .blobs import blob_name, blob_storage, complete_upload, upload_part_path
+from .bulk import assign_leads, delete_leads
+from .contacts import normalise_email, normalise_phone
+from .counters import compute_dashboard_counters, get_dashboard_counters
+from .dedup import (
+    email_key, find_duplicate_clusters, flag_duplicates, merge_leads, name_key, phone_key, set_blocking_keys, soundex,
+)
+from .events import EVENT_GAP_TIMEOUT, consume_events, record_events, record_queryset_events
+from .importer import LeadImporter
+from .media import parse_range
+from .migration_operations import AddIndexConcurrently
+from .models import AttachmentUpload, Blob, Category, FollowUp, Lead, LeadEvent
+from .pagination import KeysetPage, decode_cursor, encode_cursor, get_page_size
+from .registry import get_category_registry
+from .routing import compute_agent_loads, get_agent_loads, get_router
+from .search import search_leads
+from .tasks import generate_thumbnails, import_leads
+from .thumbnails import THUMBNAIL_SIZES, thumbnail_name, thumbnail_names
+
+
+class LeadTestCase(TestCase):
+    """An organisation with two agents, and a second organisation its users must never see."""
+
+    def setUp(self):
+        cache.clear()
+        self.organizer = User.objects.create_user('org', 'org@example.com', 'pw')
+        self.organisation = self.organizer.profile
+        self.agent = self.create_agent('agent', self.organisation)
+        self.other_agent = self.create_agent('other-agent', self.organisation)
+        self.other_organizer = User.objects.create_user('rival', 'rival@example.com', 'pw')
+        self.other_organisation = self.other_organizer.profile
+        self.client.force_login(self.organizer)
+
+    def create_agent(self, username, organisation):
+        user = User.objects.create_user(
+            username, f'{username}@example.com', 'pw', is_organizer=False, is_agent=True,
+            first_name=username.title(), last_name='Agent',
+        )
+        return Agent.objects.create(user=user, organisation=organisation)
+
+    def create_lead(self, organisation=None, **fields):
+        values = {
+            'first_name': 'Ada',
+            'last_name': 'Lovelace',
+            'description': 'Interested',
+            'phone_number': '020 7946 0000',
+            'email': 'ada@example.com',
+        }
+        values.update(fields)
+        return Lead.objects.create(organisation=organisation or self.organisation, **values)
+
+    def create_leads(self, count, organisation=None, **fields):
+        return [
+            self.create_lead(organisation, first_name=f'Lead{i}', email=f'lead{i}@example.com',
+                             phone_number=f'020 7946 {i:04d}', **fields)
+            for i in range(count)
+        ]
+
+    def create_category(self, name, organisation=None, is_converted=False):
+        return Category.objects.create(name=name, organisation=organisation or self.organisation,
+                                       is_converted=is_converted)
+
+
+class KeysetPaginationTests(LeadTestCase):
+    def walk(self, queryset, page_size):
+        seen, cursor = [], None
+        while True:
+            page = KeysetPage(queryset, cursor, page_size)
+            seen.append([lead.pk for lead in page])
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_lead_once_newest_first(self):
+        leads = self.create_leads(7)
+        pages = self.walk(Lead.objects.all(), 3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), [lead.pk for lead in reversed(leads)])
+
+    def test_leads_added_at_the_same_time_are_ordered_by_id(self):
+        leads = self.create_leads(5)
+        Lead.objects.update(date_added=timezone.now())
+        pages = self.walk(Lead.objects.all(), 2)
+        self.assertEqual(sum(pages, []), [lead.pk for lead in reversed(leads)])
+
+    def test_exact_multiple_of_page_size_has_no_empty_last_page(self):
+        self.create_leads(4)
+        pages = self.walk(Lead.objects.all(), 2)
+        self.assertEqual([len(page) for page in pages], [2, 2])
+
+    def test_first_page_has_no_previous(self):
+        self.create_leads(3)
+        page = KeysetPage(Lead.objects.all(), None, 2)
+        self.assertFalse(page.has_previous)
+        self.assertTrue(KeysetPage(Lead.objects.all(), page.next_cursor, 2).has_previous)
+
+    def test_page_is_fetched_with_one_query(self):
+        self.create_leads(3)
+        page = KeysetPage(Lead.objects.all(), None, 2)
+        with self.assertNumQueries(1):
+            list(page)
+            page.has_next
+            page.next_cursor
+
+    def test_cursor_round_trip(self):
+        lead = self.create_lead()
+        self.assertEqual(decode_cursor(encode_cursor(lead)), (lead.date_added, lead.pk))
+
+    def test_malformed_cursor_starts_from_the_first_page(self):
+        leads = self.create_leads(3)
+        for cursor in ('', 'not-a-cursor', '!!!', 'MjAyNHxhYmM'):
+            self.assertIsNone(decode_cursor(cursor))
+            page = KeysetPage(Lead.objects.all(), cursor, 10)
+            self.assertEqual([lead.pk for lead in page], [lead.pk for lead in reversed(leads)])
+
+    def test_page_size_is_clamped(self):
+        factory = RequestFactory()
+        self.assertEqual(get_page_size(factory.get('/', {'page_size': '0'})), 1)
+        self.assertEqual(get_page_size(factory.get('/', {'page_size': '1000'})), 100)
+        self.assertEqual(get_page_size(factory.get('/', {'page_size': 'ten'})), 25)
+
+    def test_lead_list_follows_the_next_cursor(self):
+        leads = self.create_leads(5, agent=self.agent)
+        Lead.objects.filter(pk__in=[lead.pk for lead in leads[:2]]).update(
+            date_added=timezone.now() - datetime.timedelta(days=1)
+        )
+        response = self.client.get(reverse('leads:lead-list'), {'page_size': 3})
+        first = response.context['leads']
+        self.assertEqual([lead.pk for lead in first], [leads[4].pk, leads[3].pk, leads[2].pk])
+        response = self.client.get(reverse('leads:lead-list'), {'page_size': 3, 'cursor': first.next_cursor})
+        second = response.context['leads']
+        self.assertEqual([lead.pk for lead in second], [leads[1].pk, leads[0].pk])
+        self.assertFalse(second.has_next)
+
+
+class DashboardCounterTests(LeadTestCase):
+    def assertNoDrift(self, organisation=None):
+        organisation_id = (organisation or self.organisation).pk
+        self.assertEqual(get_dashboard_counters(organisation_id), compute_dashboard_counters(organisation_id))
+
+    def test_counters_follow_lead_changes(self):
+        converted = self.create_category('Converted', is_converted=True)
+        self.create_category('Contacted')
+        self.assertEqual(get_dashboard_counters(self.organisation.pk)['total_lead_count'], 0)
+        leads = self.create_leads(3)
+        self.assertNoDrift()
+        lead = Lead.objects.get(pk=leads[0].pk)
+        lead.category = converted
+        lead.converted_date = timezone.now()
+        lead.save()
+        self.assertEqual(get_dashboard_counters(self.organisation.pk)['converted_in_past30'], 1)
+        self.assertNoDrift()
+        lead.date_added = timezone.now() - datetime.timedelta(days=60)
+        lead.converted_date = timezone.now() - datetime.timedelta(days=45)
+        lead.save()
+        self.assertNoDrift()
+        Lead.objects.get(pk=leads[1].pk).delete()
+        counters = get_dashboard_counters(self.organisation.pk)
+        self.assertEqual(counters, {'total_lead_count': 2, 'total_in_past30': 1, 'converted_in_past30': 0})
+        self.assertNoDrift()
+
+    def test_moving_a_lead_between_organisations_updates_both(self):
+        lead = self.create_lead()
+        get_dashboard_counters(self.other_organisation.pk)
+        lead = Lead.objects.get(pk=lead.pk)
+        lead.organisation = self.other_organisation
+        lead.save()
+        self.assertEqual(get_dashboard_counters(self.organisation.pk)['total_lead_count'], 0)
+        self.assertEqual(get_dashboard_counters(self.other_organisation.pk)['total_lead_count'], 1)
+
+    def test_changing_the_converted_category_recounts(self):
+        category = self.create_category('Won')
+        self.create_lead(category=category, converted_date=timezone.now())
+        self.assertEqual(get_dashboard_counters(self.organisation.pk)['converted_in_past30'], 0)
+        category.is_converted = True
+        category.save()
+        self.assertEqual(get_dashboard_counters(self.organisation.pk)['converted_in_past30'], 1)
+
+    def test_dashboard_is_served_from_the_cache(self):
+        self.create_leads(2)
+        self.client.get(reverse('dashboard'))
+        with mock.patch('crm_system.leads.counters.compute_dashboard_counters') as compute:
+            response = self.client.get(reverse('dashboard'))
+        compute.assert_not_called()
+        self.assertEqual(response.context['total_lead_count'], 2)
+
+
+class LeadJsonTests(LeadTestCase):
+    url = reverse_lazy('leads:lead-list-json')
+
+    def get_json(self, **params):
+        response = self.client.get(self.url, params)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_pages_by_id_with_a_cursor(self):
+        leads = self.create_leads(5)
+        self.create_lead(self.other_organisation)
+        first = self.get_json(limit=3)
+        self.assertEqual([row['id'] for row in first['qs']], [lead.pk for lead in leads[:3]])
+        self.assertEqual(first['next_cursor'], leads[2].pk)
+        second = self.get_json(limit=3, cursor=first['next_cursor'])
+        self.assertEqual([row['id'] for row in second['qs']], [lead.pk for lead in leads[3:]])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_selected_fields(self):
+        lead = self.create_lead(age=30)
+        data = self.get_json(fields='email,age')
+        self.assertEqual(data['qs'], [{'id': lead.pk, 'email': 'ada@example.com', 'age': 30}])
+
+    def test_rejects_unknown_fields_and_bad_cursors(self):
+        self.assertEqual(self.client.get(self.url, {'fields': 'first_name,password'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'abc'}).status_code, 400)
+
+    def test_ndjson(self):
+        leads = self.create_leads(2)
+        response = self.client.get(self.url, {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [lead.pk for lead in leads])
+
+    def test_agents_only_get_their_leads(self):
+        own = self.create_lead(agent=self.agent)
+        self.create_lead(agent=self.other_agent)
+        self.create_lead()
+        self.client.force_login(self.agent.user)
+        self.assertEqual([row['id'] for row in self.get_json()['qs']], [own.pk])
+
+
+class TemporaryMediaMixin:
+    """Store uploads in a temporary MEDIA_ROOT removed after each test."""
+
+    def setUp(self):
+        super(TemporaryMediaMixin, self).setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+
+def import_csv(*rows):
+    header = 'first_name,last_name,age,description,phone_number,email,agent'
+    return io.StringIO('\n'.join((header,) + rows) + '\n')
+
+
+class LeadImporterTests(LeadTestCase):
+    def test_valid_rows_are_created_and_invalid_rows_reported(self):
+        lines = import_csv(
+            'Ada,Lovelace,36,Maths,020 7946 0001,ada@example.com,AGENT@example.com',
+            'Alan,,41,Computing,020 7946 0002,alan@example.com,',
+            'Grace,Hopper,85,Compilers,020 7946 0003,grace@example.com,nobody@example.com',
+            'Edsger,Dijkstra,72,Paths,020 7946 0004,edsger@example.com,',
+        )
+        result = LeadImporter(self.organisation).run(lines)
+        self.assertEqual((result.created, result.rejected), (2, 2))
+        self.assertEqual([line for line, _ in result.errors], [3, 4])
+        self.assertIn('last_name', result.errors[0][1])
+        self.assertIn('agent', result.errors[1][1])
+        leads = Lead.objects.filter(organisation=self.organisation).order_by('id')
+        self.assertEqual(
+            [(lead.first_name, lead.agent_id) for lead in leads], [('Ada', self.agent.pk), ('Edsger', None)]
+        )
+        self.assertEqual(leads[0].phone_e164, '+12079460001')
+        self.assertEqual(get_dashboard_counters(self.organisation.pk)['total_lead_count'], 2)
+
+    def test_batches_report_the_line_they_end_on(self):
+        rows = [f'Lead{i},Smith,30,Note,020 7946 {i:04d},lead{i}@example.com,' for i in range(5)]
+        progress = []
+        importer = LeadImporter(self.organisation, batch_size=2,
+                                on_batch=lambda line, result: progress.append((line, result.created)))
+        importer.run(import_csv(*rows))
+        self.assertEqual(progress, [(3, 2), (5, 4), (6, 5)])
+
+    def test_start_line_skips_rows_already_imported(self):
+        rows = [f'Lead{i},Smith,30,Note,020 7946 {i:04d},lead{i}@example.com,' for i in range(4)]
+        result = LeadImporter(self.organisation).run(import_csv(*rows), start_line=3)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(sorted(Lead.objects.values_list('first_name', flat=True)), ['Lead2', 'Lead3'])
+
+
+class LeadImportTaskTests(TemporaryMediaMixin, LeadTestCase):
+    def enqueue_import(self, count, batch_size):
+        rows = [f'Lead{i},Smith,30,Note,020 7946 {i:04d},lead{i}@example.com,' for i in range(count)]
+        path = default_storage.save('lead_imports/test.csv', ContentFile(import_csv(*rows).getvalue().encode()))
+        return enqueue('leads.import', organisation_id=self.organisation.pk, path=path, batch_size=batch_size)
+
+    def test_retry_resumes_after_the_last_committed_batch(self):
+        queued = self.enqueue_import(7, batch_size=3)
+        calls = []
+
+        def record_events_then_fail(events):
+            calls.append(len(events))
+            if len(calls) == 2:
+                raise OperationalError('connection lost')
+            return record_events(events)
+
+        with mock.patch('crm_system.leads.importer.record_events', side_effect=record_events_then_fail):
+            with self.assertRaises(OperationalError):
+                import_leads(queued, **queued.payload)
+        queued.refresh_from_db()
+        self.assertEqual(queued.payload['checkpoint'], {'line': 4, 'created': 3, 'rejected': 0, 'errors': []})
+        self.assertEqual(Lead.objects.count(), 3)
+
+        import_leads(queued, **queued.payload)
+        names = list(Lead.objects.order_by('id').values_list('first_name', flat=True))
+        self.assertEqual(names, [f'Lead{i}' for i in range(7)])
+        self.assertFalse(default_storage.exists(queued.payload['path']))
+        report = Task.objects.get(name='mail.send').payload
+        self.assertTrue(report['message'].startswith('7 lead(s) imported, 0 row(s) rejected.'))
+
+    def test_upload_view_queues_the_import(self):
+        response = self.client.get(reverse('leads:lead-list'))
+        self.assertContains(response, reverse('leads:lead-import'))
+        upload = SimpleUploadedFile('leads.csv', import_csv().getvalue().encode(), content_type='text/csv')
+        response = self.client.post(reverse('leads:lead-import'), {'file': upload})
+        self.assertRedirects(response, reverse('leads:lead-list'), fetch_redirect_response=False)
+        queued = Task.objects.get(name='leads.import')
+        self.assertEqual(queued.payload['organisation_id'], self.organisation.pk)
+        self.assertTrue(default_storage.exists(queued.payload['path']))
+
+
+class ExportTests(LeadTestCase):
+    def export(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_export_is_scoped_to_the_organisation(self):
+        lead = self.create_lead(agent=self.agent)
+        self.create_lead(self.other_organisation, first_name='Rival')
+        response, content = self.export('leads:lead-export')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="leads.csv"')
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0][:3], ['id', 'first_name', 'last_name'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][:3], [str(lead.pk), 'Ada', 'Lovelace'])
+        self.assertEqual(rows[1][-2:], ['Agent', 'Agent'])
+
+    def test_jsonl_export_applies_the_filter(self):
+        category = self.create_category('Contacted')
+        lead = self.create_lead(category=category)
+        self.create_lead(first_name='Other')
+        response, content = self.export('leads:lead-export', format='jsonl', category=category.pk)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="leads.jsonl"')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row['id'], row['category']) for row in rows], [(lead.pk, 'Contacted')])
+
+    def test_invalid_filter_is_rejected(self):
+        other_category = self.create_category('Theirs', self.other_organisation)
+        response = self.client.get(reverse('leads:lead-export'), {'category': other_category.pk})
+        self.assertEqual(response.status_code, 400)
+
+    def test_followup_export(self):
+        lead = self.create_lead()
+        followup = FollowUp.objects.create(lead=lead, notes='Called back')
+        FollowUp.objects.create(lead=self.create_lead(self.other_organisation), notes='Hidden')
+        _, content = self.export('leads:followup-export', format='jsonl')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row['id'], row['notes']) for row in rows], [(followup.pk, 'Called back')])
+
+    def test_agents_cannot_export(self):
+        self.client.force_login(self.agent.user)
+        response = self.client.get(reverse('leads:lead-export'))
+        self.assertRedirects(response, reverse('leads:lead-list'), fetch_redirect_response=False)
+
+
+class LeadIndexTests(TestCase):
+    def test_model_indexes_exist(self):
+        for model in (Lead, FollowUp):
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+            for index in model._meta.indexes:
+                self.assertIn(index.name, constraints)
+
+    def test_concurrent_index_migrations_are_not_atomic(self):
+        loader = MigrationLoader(connection, ignore_no_migrations=True)
+        for (app_label, name), migration in loader.disk_migrations.items():
+            if any(isinstance(operation, AddIndexConcurrently) for operation in migration.operations):
+                self.assertFalse(migration.atomic, f'{app_label}.{name} builds indexes concurrently')
+        self.assertFalse(loader.disk_migrations['leads', '0004_lead_search'].atomic)
+
+
+class CategoryRegistryTests(LeadTestCase):
+    def test_registry_is_cached_until_a_category_changes(self):
+        contacted = self.create_category('Contacted')
+        converted = self.create_category('Converted', is_converted=True)
+        registry = get_category_registry(self.organisation.pk)
+        self.assertEqual(registry.converted_id, converted.pk)
+        self.assertEqual(registry.name(contacted.pk), 'Contacted')
+        with self.assertNumQueries(0):
+            get_category_registry(self.organisation.pk)
+        contacted.name = 'Called'
+        contacted.save()
+        self.assertEqual(get_category_registry(self.organisation.pk).name(contacted.pk), 'Called')
+
+    def test_organisations_have_separate_registries(self):
+        converted = self.create_category('Converted', is_converted=True)
+        self.assertIsNone(get_category_registry(self.other_organisation.pk).converted_id)
+        self.assertTrue(get_category_registry(self.organisation.pk).is_converted(converted.pk))
+        self.assertFalse(get_category_registry(self.organisation.pk).is_converted(None))
+
+    def test_a_new_converted_category_takes_the_flag(self):
+        old = self.create_category('Won', is_converted=True)
+        self.client.post(reverse('leads:category-create'), {'name': 'Closed', 'is_converted': 'on'})
+        new = Category.objects.get(name='Closed')
+        old.refresh_from_db()
+        self.assertFalse(old.is_converted)
+        self.assertEqual(get_category_registry(self.organisation.pk).converted_id, new.pk)
+
+    def test_moving_into_the_converted_category_stamps_the_lead_once(self):
+        contacted = self.create_category('Contacted')
+        converted = self.create_category('Converted', is_converted=True)
+        lead = self.create_lead(category=contacted)
+        url = reverse('leads:lead-category-update', args=[lead.pk])
+        self.client.post(url, {'category': converted.pk})
+        lead.refresh_from_db()
+        self.assertIsNotNone(lead.converted_date)
+        stamped = lead.converted_date
+        self.client.post(url, {'category': converted.pk})
+        lead.refresh_from_db()
+        self.assertEqual(lead.converted_date, stamped)
+
+
+class LeadSearchTests(LeadTestCase):
+    def search(self, user, text):
+        return [lead.pk for lead in search_leads(user, text, 0, 10)]
+
+    def test_matches_names_contacts_and_notes_by_prefix(self):
+        ada = self.create_lead()
+        grace = self.create_lead(first_name='Grace', last_name='Hopper', email='grace@navy.example.com',
+                                 phone_number='555 0199')
+        FollowUp.objects.create(lead=grace, notes='Asked about compilers')
+        self.assertEqual(self.search(self.organizer, 'lovel'), [ada.pk])
+        self.assertEqual(self.search(self.organizer, 'navy'), [grace.pk])
+        self.assertEqual(self.search(self.organizer, 'compiler'), [grace.pk])
+        self.assertEqual(self.search(self.organizer, '***'), [])
+
+    def test_results_are_scoped_to_the_tenant(self):
+        own = self.create_lead(agent=self.agent)
+        self.create_lead(agent=self.other_agent)
+        self.create_lead(self.other_organisation)
+        self.assertEqual(self.search(self.agent.user, 'ada'), [own.pk])
+        self.assertEqual(len(self.search(self.organizer, 'ada')), 2)
+
+    def test_index_follows_edits_deletes_and_bulk_actions(self):
+        lead = self.create_lead()
+        lead.last_name = 'Byron'
+        lead.save()
+        self.assertEqual(self.search(self.organizer, 'lovelace'), [])
+        self.assertEqual(self.search(self.organizer, 'byron'), [lead.pk])
+        assign_leads(Lead.objects.filter(pk=lead.pk), self.organisation.pk, self.agent)
+        self.assertEqual(self.search(self.agent.user, 'byron'), [lead.pk])
+        lead.delete()
+        self.assertEqual(self.search(self.organizer, 'byron'), [])
+
+    def test_search_view(self):
+        lead = self.create_lead()
+        response = self.client.get(reverse('leads:lead-search'), {'q': 'Ada'})
+        self.assertEqual([result.pk for result in response.context['results']], [lead.pk])
+        self.assertFalse(response.context['has_next'])
+
+
+class CategoryViewTests(LeadTestCase):
+    def test_list_counts_leads_per_category(self):
+        contacted = self.create_category('Contacted')
+        converted = self.create_category('Converted', is_converted=True)
+        self.create_leads(2, category=contacted)
+        self.create_lead(category=converted, converted_date=timezone.now())
+        self.create_lead()
+        self.create_lead(self.other_organisation, category=None)
+        response = self.client.get(reverse('leads:category-list'))
+        counts = {category.name: (category.lead_count, category.converted_count)
+                  for category in response.context['category_list']}
+        self.assertEqual(counts, {'Contacted': (2, 0), 'Converted': (1, 1)})
+        self.assertEqual(response.context['unassigned_lead_count'], 1)
+
+    def test_list_queries_do_not_grow_with_categories(self):
+        self.create_category('First')
+        # The first request stores the tenant in the session.
+        self.client.get(reverse('leads:category-list'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('leads:category-list'))
+        for name in ('Second', 'Third', 'Fourth'):
+            self.create_lead(category=self.create_category(name))
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('leads:category-list'))
+        self.assertEqual(len(many), len(few))
+
+    def test_detail_pages_the_visible_leads(self):
+        category = self.create_category('Contacted')
+        own = self.create_leads(3, category=category, agent=self.agent)
+        self.create_lead(category=category, agent=self.other_agent)
+        url = reverse('leads:category-detail', args=[category.pk])
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(len(response.context['leads']), 2)
+        self.assertTrue(response.context['leads'].has_next)
+        self.client.force_login(self.agent.user)
+        response = self.client.get(url)
+        self.assertEqual([lead.pk for lead in response.context['leads']], [lead.pk for lead in reversed(own)])
+
+    def test_other_organisations_categories_are_not_found(self):
+        category = self.create_category('Theirs', self.other_organisation)
+        response = self.client.get(reverse('leads:category-detail', args=[category.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ProtectedMediaTests(TemporaryMediaMixin, LeadTestCase):
+    def setUp(self):
+        super(ProtectedMediaTests, self).setUp()
+        self.name = default_storage.save('profile_pictures/card.txt', ContentFile(b'0123456789'))
+        self.lead = self.create_lead(agent=self.agent, profile_picture=self.name)
+        self.url = reverse('media', kwargs={'path': self.name})
+
+    def test_visible_to_the_organisation_and_the_assigned_agent(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('private', response['Cache-Control'])
+        self.client.force_login(self.agent.user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_hidden_from_everyone_else(self):
+        for user in (self.other_agent.user, self.other_organizer):
+            self.client.force_login(user)
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.client.force_login(self.organizer)
+        default_storage.save('other/secret.txt', ContentFile(b'secret'))
+        self.assertEqual(self.client.get(reverse('media', kwargs={'path': 'other/secret.txt'})).status_code, 404)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=6-2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_range_is_ignored_when_if_range_does_not_match(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_request(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    @override_settings(MEDIA_ACCEL='x-accel')
+    def test_offloads_to_the_front_end_server(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/profile_pictures/card.txt')
+        self.assertEqual(response.content, b'')
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-', 10), (0, 9))
+        self.assertEqual(parse_range('bytes=5-100', 10), (5, 9))
+        self.assertIsNone(parse_range('bytes=-', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+        self.assertIsNone(parse_range('bytes=6-2', 10))
+        self.assertFalse(parse_range('bytes=10-12', 10))
+        self.assertFalse(parse_range('bytes=-0', 10))
+
+
+def image_file(color, size=(300, 200)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue())
+
+
+class ThumbnailTests(TemporaryMediaMixin, LeadTestCase):
+    def set_picture(self, lead, content):
+        lead.profile_picture.save('avatar.png', content)
+        return Lead.objects.get(pk=lead.pk)
+
+    def test_saving_a_picture_queues_thumbnails(self):
+        lead = self.set_picture(self.create_lead(), image_file('red'))
+        queued = Task.objects.get(name='leads.thumbnails')
+        self.assertEqual(queued.payload, {'lead_id': lead.pk})
+        Task.objects.all().delete()
+        lead.first_name = 'Augusta'
+        lead.save()
+        self.assertFalse(Task.objects.exists())
+
+    def test_thumbnails_are_rendered_and_replaced(self):
+        lead = self.set_picture(self.create_lead(), image_file('red'))
+        generate_thumbnails(lead.pk)
+        lead.refresh_from_db()
+        first = lead.thumbnail_version
+        names = thumbnail_names(lead.pk, first)
+        self.assertEqual(len(names), len(THUMBNAIL_SIZES) * 2)
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+        with default_storage.open(thumbnail_name(lead.pk, first, 40, 'jpg')) as thumbnail:
+            self.assertEqual(Image.open(thumbnail).size, (40, 40))
+
+        lead = self.set_picture(lead, image_file('blue'))
+        generate_thumbnails(lead.pk)
+        lead.refresh_from_db()
+        self.assertNotEqual(lead.thumbnail_version, first)
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_unreadable_pictures_are_skipped(self):
+        lead = self.set_picture(self.create_lead(), ContentFile(b'not an image'))
+        with self.assertLogs('crm_system.leads.tasks', 'WARNING'):
+            generate_thumbnails(lead.pk)
+        lead.refresh_from_db()
+        self.assertEqual(lead.thumbnail_version, '')
+
+    def test_thumbnails_are_served_to_users_who_see_the_lead(self):
+        lead = self.set_picture(self.create_lead(agent=self.agent), image_file('green'))
+        generate_thumbnails(lead.pk)
+        lead.refresh_from_db()
+        url = reverse('media', kwargs={'path': thumbnail_name(lead.pk, lead.thumbnail_version, 80, 'webp')})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_login(self.other_agent.user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class BulkActionTests(LeadTestCase):
+    def post(self, data, **kwargs):
+        # The bulk actions refresh the caches once their transaction commits.
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('leads:lead-bulk-action'), data, **kwargs)
+
+    def test_assign_only_touches_the_organisations_leads(self):
+        own = self.create_leads(2)
+        rival = self.create_lead(self.other_organisation)
+        self.post({'action': 'assign', 'ids': [own[0].pk, own[1].pk, rival.pk], 'to_agent': self.agent.pk})
+        self.assertEqual(Lead.objects.filter(agent=self.agent).count(), 2)
+        rival.refresh_from_db()
+        self.assertIsNone(rival.agent_id)
+        self.assertEqual(LeadEvent.objects.filter(kind=LeadEvent.ASSIGNED).count(), 2)
+        self.assertEqual(get_agent_loads(self.organisation.pk, [self.agent.pk]), {self.agent.pk: 2})
+
+    def test_cannot_target_another_organisations_agent_or_category(self):
+        lead = self.create_lead()
+        rival_agent = self.create_agent('rival-agent', self.other_organisation)
+        rival_category = self.create_category('Theirs', self.other_organisation)
+        self.post({'action': 'assign', 'ids': [lead.pk], 'to_agent': rival_agent.pk})
+        self.post({'action': 'categorise', 'ids': [lead.pk], 'to_category': rival_category.pk})
+        lead.refresh_from_db()
+        self.assertEqual((lead.agent_id, lead.category_id), (None, None))
+
+    def test_select_all_applies_the_filter(self):
+        contacted = self.create_category('Contacted')
+        converted = self.create_category('Converted', is_converted=True)
+        matching = self.create_leads(2, category=contacted)
+        other = self.create_lead()
+        already = self.create_lead(category=converted, converted_date=timezone.now() - datetime.timedelta(days=3))
+        self.create_lead(self.other_organisation)
+        get_dashboard_counters(self.organisation.pk)
+        self.post({'action': 'categorise', 'select_all': 'on', 'category': contacted.pk,
+                   'to_category': converted.pk})
+        self.assertCountEqual(Lead.objects.filter(category=converted), matching + [already])
+        self.assertTrue(all(lead.converted_date for lead in Lead.objects.filter(pk__in=[m.pk for m in matching])))
+        self.assertEqual(Lead.objects.get(pk=already.pk).converted_date, already.converted_date)
+        self.assertIsNone(Lead.objects.get(pk=other.pk).category_id)
+        counters = get_dashboard_counters(self.organisation.pk)
+        self.assertEqual(counters, compute_dashboard_counters(self.organisation.pk))
+        self.assertEqual(counters['converted_in_past30'], 3)
+
+    def test_delete(self):
+        doomed, kept = self.create_lead(), self.create_lead(first_name='Kept')
+        Lead.objects.filter(pk=kept.pk).update(duplicate_of=doomed)
+        FollowUp.objects.create(lead=doomed, notes='Gone')
+        rival = self.create_lead(self.other_organisation)
+        self.post({'action': 'delete', 'ids': [doomed.pk, rival.pk]})
+        self.assertEqual(list(Lead.objects.order_by('id')), [kept, rival])
+        self.assertIsNone(Lead.objects.get(pk=kept.pk).duplicate_of_id)
+        self.assertFalse(FollowUp.objects.exists())
+        self.assertEqual(get_dashboard_counters(self.organisation.pk)['total_lead_count'], 1)
+
+    def test_a_selection_is_required(self):
+        lead = self.create_lead()
+        response = self.post({'action': 'delete'}, follow=True)
+        self.assertContains(response, 'Select at least one lead.')
+        self.assertTrue(Lead.objects.filter(pk=lead.pk).exists())
+
+    def test_agents_cannot_run_bulk_actions(self):
+        lead = self.create_lead(agent=self.agent)
+        self.client.force_login(self.agent.user)
+        self.post({'action': 'delete', 'ids': [lead.pk]})
+        self.assertTrue(Lead.objects.filter(pk=lead.pk).exists())
+
+
+class RoutingTests(LeadTestCase):
+    def set_strategy(self, strategy):
+        self.organisation.routing_strategy = strategy
+        self.organisation.save()
+
+    def new_leads(self, count, **fields):
+        return [Lead(organisation=self.organisation, **fields) for _ in range(count)]
+
+    def test_manual_routing_has_no_router(self):
+        self.assertIsNone(get_router(self.organisation.pk))
+
+    def test_round_robin_continues_across_batches(self):
+        self.set_strategy(Profile.ROUTING_ROUND_ROBIN)
+        first, second = self.new_leads(3), self.new_leads(2)
+        get_router(self.organisation.pk).route(first)
+        get_router(self.organisation.pk).route(second)
+        agents = [self.agent.pk, self.other_agent.pk]
+        self.assertEqual([lead.agent_id for lead in first + second], agents * 2 + agents[:1])
+
+    def test_assigned_leads_are_left_alone(self):
+        self.set_strategy(Profile.ROUTING_ROUND_ROBIN)
+        leads = self.new_leads(2, agent_id=self.other_agent.pk)
+        self.assertEqual(get_router(self.organisation.pk).route(leads), {})
+        self.assertEqual([lead.agent_id for lead in leads], [self.other_agent.pk] * 2)
+
+    def test_least_open_leads_ignores_converted_leads(self):
+        self.set_strategy(Profile.ROUTING_LEAST_OPEN)
+        converted = self.create_category('Converted', is_converted=True)
+        self.create_leads(2, agent=self.agent)
+        self.create_leads(3, agent=self.other_agent, category=converted)
+        leads = self.new_leads(3)
+        received = get_router(self.organisation.pk).route(leads)
+        self.assertEqual(received, {self.other_agent.pk: 2, self.agent.pk: 1})
+        self.assertEqual(leads[0].agent_id, self.other_agent.pk)
+
+    def test_category_affinity_prefers_agents_working_the_category(self):
+        self.set_strategy(Profile.ROUTING_CATEGORY_AFFINITY)
+        enterprise = self.create_category('Enterprise')
+        self.create_leads(3, agent=self.agent, category=enterprise)
+        leads = self.new_leads(2, category=enterprise) + self.new_leads(1)
+        get_router(self.organisation.pk).route(leads)
+        self.assertEqual([lead.agent_id for lead in leads], [self.agent.pk, self.agent.pk, self.other_agent.pk])
+
+    def test_cached_loads_follow_lead_changes(self):
+        agents = [self.agent.pk, self.other_agent.pk]
+        converted = self.create_category('Converted', is_converted=True)
+        lead, _ = self.create_leads(2, agent=self.agent)
+        get_agent_loads(self.organisation.pk, agents)
+        lead = Lead.objects.get(pk=lead.pk)
+        lead.agent = self.other_agent
+        lead.save()
+        self.create_lead(agent=self.other_agent, category=converted)
+        Lead.objects.get(pk=lead.pk).delete()
+        with self.assertNumQueries(0):
+            loads = get_agent_loads(self.organisation.pk, agents)
+        self.assertEqual(loads, compute_agent_loads(self.organisation.pk, agents))
+        self.assertEqual(loads, {self.agent.pk: 1, self.other_agent.pk: 0})
+
+    def test_created_leads_are_routed(self):
+        self.set_strategy(Profile.ROUTING_LEAST_OPEN)
+        self.create_leads(1, agent=self.agent)
+        self.client.post(reverse('leads:lead-create'), {
+            'first_name': 'Grace', 'last_name': 'Hopper', 'age': 85, 'description': 'Compilers',
+            'phone_number': '555 0199', 'email': 'grace@example.com',
+        })
+        self.assertEqual(Lead.objects.get(first_name='Grace').agent_id, self.other_agent.pk)
+
+
+class FragmentCacheTests(LeadTestCase):
+    def test_cached_rows_skip_the_lead_queries(self):
+        self.create_leads(3, agent=self.agent)
+        self.create_lead()
+        self.client.get(reverse('leads:lead-list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('leads:lead-list'))
+        self.assertContains(response, 'Lead2')
+        self.assertFalse([query for query in queries if 'FROM "leads_lead"' in query['sql']])
+
+    def test_changes_show_up_immediately(self):
+        lead = self.create_lead(agent=self.agent)
+        self.assertContains(self.client.get(reverse('leads:lead-list')), 'Ada')
+        lead.first_name = 'Augusta'
+        lead.save()
+        response = self.client.get(reverse('leads:lead-list'))
+        self.assertContains(response, 'Augusta')
+        self.assertNotContains(response, 'Ada')
+
+    def test_agents_get_their_own_fragments(self):
+        self.create_lead(agent=self.agent, first_name='Mine')
+        self.create_lead(agent=self.other_agent, first_name='Theirs')
+        self.assertContains(self.client.get(reverse('leads:lead-list')), 'Theirs')
+        self.client.force_login(self.agent.user)
+        response = self.client.get(reverse('leads:lead-list'))
+        self.assertContains(response, 'Mine')
+        self.assertNotContains(response, 'Theirs')
+
+    def test_organisations_with_the_same_version_do_not_share_fragments(self):
+        self.create_lead(agent=self.agent, first_name='SecretA')
+        self.create_lead(first_name='UnassignedA')
+        self.create_agent('rival-agent', self.other_organisation)
+        self.create_lead(self.other_organisation, first_name='SecretB')
+        cache.set_many({f'organisation-version:{self.organisation.pk}': 1,
+                        f'organisation-version:{self.other_organisation.pk}': 1}, None)
+        self.client.get(reverse('leads:lead-list'))
+        self.client.get(reverse('agents:agent-list'))
+        self.client.force_login(self.other_organizer)
+        response = self.client.get(reverse('leads:lead-list'))
+        self.assertContains(response, 'SecretB')
+        self.assertNotContains(response, 'SecretA')
+        self.assertNotContains(response, 'UnassignedA')
+        response = self.client.get(reverse('agents:agent-list'))
+        self.assertContains(response, 'rival-agent@example.com')
+        self.assertNotContains(response, 'other-agent@example.com')
+
+    def test_agent_list_follows_user_changes(self):
+        self.assertContains(self.client.get(reverse('agents:agent-list')), 'agent@example.com')
+        user = self.agent.user
+        user.email = 'renamed@example.com'
+        user.save()
+        self.assertContains(self.client.get(reverse('agents:agent-list')), 'renamed@example.com')
+
+
+class AsyncViewTests(LeadTestCase):
+    def get(self, view, user, path='/', **kwargs):
+        request = AsyncRequestFactory().get(path)
+        request.user = user
+        return async_to_sync(view.as_view())(request, **kwargs)
+
+    def test_lead_list_renders_without_queries(self):
+        category = self.create_category('Contacted')
+        self.create_leads(3, agent=self.agent, category=category)
+        self.create_lead(first_name='Unassigned')
+        response = self.get(AsyncLeadListView, self.organizer)
+        with self.assertNumQueries(0):
+            response.render()
+        self.assertContains(response, 'Lead2')
+        self.assertContains(response, 'Unassigned')
+        self.assertContains(response, f'<option value="{category.pk}">Contacted</option>', html=True)
+
+    def test_agents_only_see_their_leads(self):
+        self.create_lead(agent=self.agent, first_name='Mine')
+        self.create_lead(agent=self.other_agent, first_name='Theirs')
+        response = self.get(AsyncLeadListView, self.agent.user).render()
+        self.assertContains(response, 'Mine')
+        self.assertNotContains(response, 'Theirs')
+
+    def test_detail_is_scoped_to_the_user(self):
+        lead = self.create_lead(agent=self.other_agent)
+        FollowUp.objects.create(lead=lead, notes='Called back')
+        response = self.get(AsyncLeadDetailView, self.organizer, pk=lead.pk)
+        self.assertEqual([followup.notes for followup in response.context_data['followups']], ['Called back'])
+        with self.assertRaises(Http404):
+            self.get(AsyncLeadDetailView, self.agent.user, pk=lead.pk)
+
+    def test_json_matches_the_sync_view(self):
+        self.create_leads(3)
+        response = self.get(AsyncLeadJsonView, self.organizer, '/?limit=2')
+        sync_response = self.client.get(reverse('leads:lead-list-json'), {'limit': 2})
+        self.assertEqual(json.loads(response.content), json.loads(b''.join(sync_response.streaming_content)))
+
+
+class LeadEventTests(LeadTestCase):
+    def kinds(self, lead_id):
+        return list(LeadEvent.objects.filter(lead_id=lead_id).order_by('id').values_list('kind', 'previous_id'))
+
+    def test_lead_history(self):
+        contacted = self.create_category('Contacted')
+        converted = self.create_category('Converted', is_converted=True)
+        lead = self.create_lead(category=contacted)
+        lead = Lead.objects.get(pk=lead.pk)
+        lead.agent = self.agent
+        lead.save()
+        lead.category = converted
+        lead.save()
+        FollowUp.objects.create(lead=lead, notes='Signed')
+        lead.first_name = 'Augusta'
+        lead.save()
+        lead_id = lead.pk
+        lead.delete()
+        self.assertEqual(self.kinds(lead_id), [
+            (LeadEvent.CREATED, None),
+            (LeadEvent.ASSIGNED, None),
+            (LeadEvent.CATEGORY_CHANGED, contacted.pk),
+            (LeadEvent.CONVERTED, contacted.pk),
+            (LeadEvent.FOLLOWUP_ADDED, None),
+        ])
+        event = LeadEvent.objects.get(kind=LeadEvent.CONVERTED)
+        self.assertEqual((event.organisation_id, event.agent_id, event.category_id),
+                         (self.organisation.pk, self.agent.pk, converted.pk))
+
+    def test_bulk_events_record_the_replaced_values(self):
+        leads = self.create_leads(2, agent=self.agent)
+        with self.assertNumQueries(1):
+            count = record_queryset_events(Lead.objects.filter(pk__in=[lead.pk for lead in leads]),
+                                           LeadEvent.ASSIGNED, agent_id=self.other_agent.pk)
+        self.assertEqual(count, 2)
+        events = LeadEvent.objects.filter(kind=LeadEvent.ASSIGNED).order_by('lead_id')
+        self.assertEqual([(event.lead_id, event.agent_id, event.previous_id) for event in events],
+                         [(lead.pk, self.other_agent.pk, self.agent.pk) for lead in leads])
+
+    def test_consumers_read_each_event_once(self):
+        self.create_leads(5)
+        batches = []
+        self.assertEqual(consume_events('test', batches.append, batch_size=2), 5)
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(consume_events('test', batches.append), 0)
+        self.create_lead()
+        self.assertEqual(consume_events('test', batches.append), 1)
+        self.assertEqual(consume_events('other', lambda events: None), 6)
+
+    def test_events_committed_out_of_order_are_not_skipped(self):
+        lead = self.create_lead()
+        consume_events('test', lambda events: None)
+        position = LeadEvent.objects.latest('id').id
+
+        def event(pk, **fields):
+            LeadEvent.objects.create(id=pk, organisation=self.organisation, lead=lead, kind=LeadEvent.CREATED,
+                                     **fields)
+
+        seen = []
+
+        def consume():
+            consume_events('test', lambda events: seen.extend(event.id for event in events))
+            return seen
+
+        event(position + 2)
+        self.assertEqual(consume(), [])
+        event(position + 1)
+        self.assertEqual(consume(), [position + 1, position + 2])
+        # Ids a rolled back transaction never used are skipped once the gap is old enough.
+        event(position + 4, occurred_at=timezone.now() - EVENT_GAP_TIMEOUT)
+        self.assertEqual(consume(), [position + 1, position + 2, position + 4])
+
+    def test_a_failed_batch_is_read_again(self):
+        self.create_leads(3)
+
+        def fail(events):
+            raise RuntimeError('handler failed')
+
+        with self.assertRaises(RuntimeError):
+            consume_events('test', fail)
+        self.assertEqual(consume_events('test', lambda events: None), 3)
+
+
+class DuplicateLeadTests(LeadTestCase):
+    def test_blocking_keys(self):
+        self.assertEqual(email_key(' Ada.Lovelace+crm@GoogleMail.com '), 'adalovelace@gmail.com')
+        self.assertEqual(email_key('ada.lovelace+crm@example.com'), 'ada.lovelace@example.com')
+        self.assertEqual(email_key('not an email'), '')
+        self.assertEqual(phone_key('+44 20 7946 0000'), phone_key('020 7946 0000'))
+        self.assertEqual(phone_key('555 01'), '')
+        self.assertEqual([soundex(name) for name in ('Robert', 'Rupert', 'Tymczak', 'Pfister')],
+                         ['R163', 'R163', 'T522', 'P236'])
+        self.assertEqual(name_key('Ada', 'Lovelace'), 'L142A300')
+        self.assertEqual(name_key('', 'Lovelace'), '')
+
+    def test_new_leads_are_flagged_against_the_oldest_match(self):
+        original = self.create_lead()
+        self.create_lead(email='ada.l@example.com')
+        self.create_lead(self.other_organisation, email='grace@example.com', phone_number='555 0199 123')
+        by_email = Lead(organisation=self.organisation, email='ADA@example.com', phone_number='')
+        by_phone = Lead(organisation=self.organisation, email='other@example.com', phone_number='+44 20 7946 0000')
+        rival_match = Lead(organisation=self.organisation, email='grace@example.com', phone_number='')
+        leads = [by_email, by_phone, rival_match]
+        for lead in leads:
+            set_blocking_keys(lead)
+        with self.assertNumQueries(1):
+            flag_duplicates(leads)
+        self.assertEqual([lead.duplicate_of_id for lead in leads], [original.pk, original.pk, None])
+
+    def test_rows_repeated_in_an_import_are_flagged(self):
+        existing = self.create_lead(phone_number='020 7946 0009', email='grace@example.com')
+        LeadImporter(self.organisation).run(import_csv(
+            'Alan,Turing,41,Computing,020 7946 0001,alan@example.com,',
+            'Alan,Turing,41,Computing,020 7946 0002,ALAN@example.com,',
+            'Grace,Hopper,85,Compilers,+44 20 7946 0009,grace.h@example.com,',
+        ))
+        first, second, grace = Lead.objects.exclude(pk=existing.pk).order_by('id')
+        self.assertEqual([first.duplicate_of_id, second.duplicate_of_id, grace.duplicate_of_id],
+                         [None, first.pk, existing.pk])
+
+    def test_clusters(self):
+        ada = self.create_lead()
+        same_email = self.create_lead(first_name='Augusta', email='ADA@example.com', phone_number='555 0100 000')
+        same_phone = self.create_lead(first_name='Countess', email='c@example.com', phone_number='+44 20 7946 0000')
+        similar_name = self.create_lead(first_name='Adah', email='adah@example.com', phone_number='555 0101 000')
+        self.create_lead(first_name='Robert', last_name='Smith', email='r@example.com', phone_number='555 0102 000')
+        self.create_lead(first_name='Rupert', last_name='Smyth', email='s@example.com', phone_number='555 0103 000')
+        self.create_lead(self.other_organisation)
+        self.assertEqual(find_duplicate_clusters(self.organisation.pk),
+                         [[ada.pk, same_email.pk, same_phone.pk, similar_name.pk]])
+        self.assertEqual(find_duplicate_clusters(self.organisation.pk, max_name_block=1),
+                         [[ada.pk, same_email.pk, same_phone.pk]])
+
+    def test_merge_moves_followups_and_repoints_duplicates(self):
+        primary = self.create_lead()
+        duplicate = self.create_lead(email='ADA@example.com', duplicate_of=primary)
+        later = self.create_lead(email='ada+later@example.com', duplicate_of=duplicate)
+        FollowUp.objects.create(lead=primary, notes='First call')
+        FollowUp.objects.create(lead=duplicate, notes='Second call')
+        self.assertEqual(merge_leads(primary, Lead.objects.filter(pk__in=[primary.pk, duplicate.pk])), 1)
+        self.assertFalse(Lead.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(sorted(primary.followups.values_list('notes', flat=True)), ['First call', 'Second call'])
+        later.refresh_from_db()
+        self.assertEqual(later.duplicate_of_id, primary.pk)
+        self.assertEqual(get_dashboard_counters(self.organisation.pk)['total_lead_count'], 2)
+
+    def test_merge_view(self):
+        primary = self.create_lead()
+        duplicate = self.create_lead(duplicate_of=primary)
+        rival = self.create_lead(self.other_organisation, duplicate_of=self.create_lead(self.other_organisation))
+        self.assertEqual(self.client.post(reverse('leads:lead-merge', args=[primary.pk])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('leads:lead-merge', args=[rival.pk])).status_code, 404)
+        response = self.client.post(reverse('leads:lead-merge', args=[duplicate.pk]))
+        self.assertRedirects(response, reverse('leads:lead-detail', args=[primary.pk]))
+        self.assertEqual(list(Lead.objects.filter(organisation=self.organisation)), [primary])
+
+    def test_create_view_warns_about_duplicates(self):
+        original = self.create_lead()
+        response = self.client.post(reverse('leads:lead-create'), {
+            'first_name': 'Ada', 'last_name': 'Lovelace', 'age': 36, 'description': 'Maths',
+            'phone_number': '555 0199', 'email': 'Ada@Example.com',
+        }, follow=True)
+        self.assertContains(response, 'This lead looks like a duplicate of an existing lead')
+        self.assertEqual(Lead.objects.latest('id').duplicate_of_id, original.pk)
+
+
+class LeadLookupTests(LeadTestCase):
+    def lookup(self, **params):
+        return self.client.get(reverse('leads:lead-lookup'), params)
+
+    def test_normalisation(self):
+        self.assertEqual(normalise_email('  Ada@Example.COM '), 'ada@example.com')
+        self.assertEqual(normalise_phone('(202) 555-0143'), '+12025550143')
+        self.assertEqual(normalise_phone('020 7946 0000', country_code='44'), '+442079460000')
+        self.assertEqual(normalise_phone('+44 20 7946 0000'), '+442079460000')
+        self.assertEqual(normalise_phone('0044 20 7946 0000'), '+442079460000')
+        self.assertEqual(normalise_phone('555 01'), '')
+        self.assertEqual(normalise_phone('+1 202 555 0143 0000 0000'), '')
+
+    def test_found_by_any_form_of_the_number(self):
+        lead = self.create_lead(phone_number='+44 20 7946 0000', agent=self.agent)
+        for phone in ('+442079460000', '0044 20 7946 0000', '+44 (20) 7946-0000'):
+            data = self.lookup(phone=phone).json()
+            self.assertEqual(data['lead']['id'], lead.pk, phone)
+        self.assertEqual(data['lead']['agent_id'], self.agent.pk)
+        self.assertIsNone(data['lead']['latest_followup'])
+
+    def test_found_by_email_with_its_latest_followup(self):
+        self.create_lead()
+        lead = self.create_lead()
+        FollowUp.objects.create(lead=lead, notes='First call')
+        latest = FollowUp.objects.create(lead=lead, notes='Second call')
+        data = self.lookup(email=' ADA@example.com').json()
+        self.assertEqual(data['lead']['id'], lead.pk)
+        self.assertEqual((data['lead']['latest_followup']['id'], data['lead']['latest_followup']['notes']),
+                         (latest.pk, 'Second call'))
+
+    def test_invalid_and_missing(self):
+        for params, status, error in (
+            ({}, 400, 'Pass a phone or email to look up'),
+            ({'phone': '12'}, 400, 'Not a valid phone number'),
+            ({'email': '   '}, 400, 'Not a valid email address'),
+            ({'email': 'nobody@example.com'}, 404, 'No matching lead'),
+        ):
+            response = self.lookup(**params)
+            self.assertEqual((response.status_code, response.json()), (status, {'error': error}), params)
+
+    def test_scoped_to_the_callers_leads(self):
+        self.create_lead(self.other_organisation, email='rival@example.com')
+        self.create_lead(agent=self.other_agent, email='theirs@example.com')
+        self.assertEqual(self.lookup(email='rival@example.com').status_code, 404)
+        self.client.force_login(self.agent.user)
+        self.assertEqual(self.lookup(email='theirs@example.com').status_code, 404)
+
+
+class AttachmentBlobTests(TemporaryMediaMixin, LeadTestCase):
+    def attach(self, content, name='notes.txt', lead=None):
+        return FollowUp.objects.create(lead=lead or self.lead, file=ContentFile(content, name=name))
+
+    def ref_counts(self):
+        return dict(Blob.objects.values_list('name', 'ref_count'))
+
+    def setUp(self):
+        super(AttachmentBlobTests, self).setUp()
+        self.lead = self.create_lead()
+
+    def test_identical_attachments_share_a_blob(self):
+        first = self.attach(b'same bytes')
+        second = self.attach(b'same bytes', name='copy.TXT', lead=self.create_lead())
+        other = self.attach(b'other bytes')
+        name = blob_name(hashlib.sha256(b'same bytes').hexdigest(), 'notes.txt')
+        self.assertEqual((first.file.name, second.file.name), (name, name))
+        with first.file.open('rb') as file:
+            self.assertEqual(file.read(), b'same bytes')
+        self.assertEqual(self.ref_counts(), {name: 2, other.file.name: 1})
+        second.delete()
+        self.assertEqual(self.ref_counts()[name], 1)
+
+    def test_bulk_delete_releases_the_references(self):
+        name = self.attach(b'same bytes').file.name
+        self.attach(b'same bytes')
+        self.attach(b'same bytes', lead=self.create_lead())
+        delete_leads(Lead.objects.filter(pk=self.lead.pk), self.organisation.pk)
+        self.assertEqual(self.ref_counts(), {name: 1})
+
+    def test_unreferenced_blobs_are_collected_after_the_grace_period(self):
+        kept = self.attach(b'kept').file.name
+        released = self.attach(b'released')
+        recent = self.attach(b'recent')
+        released.delete()
+        recent.delete()
+        drifted = self.attach(b'drifted').file.name
+        Blob.objects.filter(name=drifted).update(ref_count=0)
+        Blob.objects.exclude(name=recent.file.name).update(updated_at=timezone.now() - datetime.timedelta(days=2))
+        out = io.StringIO()
+        call_command('gc_blobs', stdout=out)
+        self.assertIn('Deleted 1 blob(s)', out.getvalue())
+        self.assertIn('repaired 1 reference count(s)', out.getvalue())
+        self.assertEqual(self.ref_counts(), {kept: 1, recent.file.name: 0, drifted: 1})
+        self.assertFalse(blob_storage.exists(released.file.name))
+        self.assertTrue(blob_storage.exists(recent.file.name))
+
+
+class ResumableUploadTests(TemporaryMediaMixin, LeadTestCase):
+    def start(self, size, **data):
+        return self.client.post(reverse('leads:attachment-upload-create', args=[self.lead.pk]),
+                                {'file_name': 'call.txt', 'size': size, 'notes': 'Call notes', **data})
+
+    def patch(self, url, chunk, offset):
+        headers = {} if offset is None else {'HTTP_UPLOAD_OFFSET': str(offset)}
+        return self.client.patch(url, chunk, content_type='application/octet-stream', **headers)
+
+    def setUp(self):
+        super(ResumableUploadTests, self).setUp()
+        self.lead = self.create_lead()
+
+    def test_chunks_are_appended_at_the_offset(self):
+        content = b'first chunk, second chunk'
+        response = self.start(len(content))
+        self.assertEqual(response.status_code, 201)
+        url = response.json()['url']
+        self.assertEqual(self.patch(url, content[:13], 0).json()['offset'], 13)
+        self.assertEqual(self.client.get(url)['Upload-Offset'], '13')
+        response = self.patch(url, content[13:], 0)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 13))
+        self.assertEqual(self.patch(url, content[13:], None).status_code, 400)
+        self.assertEqual(self.patch(url, content[13:] + b'!', 13).status_code, 400)
+
+        response = self.patch(url, content[13:], 13)
+        self.assertEqual(response.status_code, 201)
+        followup = FollowUp.objects.get(pk=response.json()['followup'])
+        self.assertEqual((followup.lead_id, followup.notes), (self.lead.pk, 'Call notes'))
+        with followup.file.open('rb') as file:
+            self.assertEqual(file.read(), content)
+        self.assertFalse(AttachmentUpload.objects.exists())
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_the_file_is_hashed_outside_the_upload_lock(self):
+        depths = []
+        hash_file = blobs.hash_file
+
+        def record_depth(path):
+            depths.append(len(connection.savepoint_ids))
+            return hash_file(path)
+
+        url = self.start(5).json()['url']
+        with mock.patch('crm_system.leads.blobs.hash_file', side_effect=record_depth):
+            self.assertEqual(self.patch(url, b'12345', 0).status_code, 201)
+        self.assertEqual(depths, [len(connection.savepoint_ids)])
+
+    def test_a_failed_completion_is_retried_with_an_empty_chunk(self):
+        url = self.start(5).json()['url']
+        with mock.patch('crm_system.leads.views.complete_upload', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError), self.assertLogs('django.request', 'ERROR'):
+                self.patch(url, b'12345', 0)
+        self.assertEqual(self.client.get(url).json()['offset'], 5)
+        response = self.patch(url, b'', 5)
+        self.assertEqual(response.status_code, 201)
+        with FollowUp.objects.get(pk=response.json()['followup']).file.open('rb') as file:
+            self.assertEqual(file.read(), b'12345')
+
+    def test_an_upload_is_completed_once(self):
+        url = self.start(5).json()['url']
+        self.patch(url, b'1234', 0)
+        upload = AttachmentUpload.objects.get()
+        with open(upload_part_path(upload), 'ab') as file:
+            file.write(b'5')
+        AttachmentUpload.objects.filter(pk=upload.pk).delete()
+        self.assertIsNone(complete_upload(upload))
+        self.assertFalse(FollowUp.objects.exists())
+        self.assertEqual(list(Blob.objects.values_list('ref_count', flat=True)), [0])
+        self.assertIsNone(complete_upload(upload))
+
+    def test_invalid_and_foreign_uploads(self):
+        self.assertEqual(self.start(0).status_code, 400)
+        self.assertEqual(self.start(10, file_name='').status_code, 400)
+        rival = self.create_lead(self.other_organisation)
+        response = self.client.post(reverse('leads:attachment-upload-create', args=[rival.pk]),
+                                    {'file_name': 'call.txt', 'size': 10})
+        self.assertEqual(response.status_code, 404)
+        url = self.start(10).json()['url']
+        self.client.force_login(self.other_organizer)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_abandoned_upload_is_discarded(self):
+        url = self.start(10).json()['url']
+        self.patch(url, b'12345', 0)
+        upload = AttachmentUpload.objects.get()
+        self.assertTrue(os.path.exists(upload_part_path(upload)))
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(os.path.exists(upload_part_path(upload)))
+        self.assertFalse(AttachmentUpload.objects.exists())
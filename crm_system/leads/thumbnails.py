@@ -0,0 +1,55 @@
+"""
+Fixed-size avatar thumbnails for ``Lead.profile_picture``.
+
+Thumbnails are written next to the originals, under
+``profile_pictures/thumbnails/<lead id>/<version>-<size>.<ext>``. The
+version is a digest of the original image, so a new upload always gets
+new URLs and browsers can cache the old ones indefinitely.
+"""
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+THUMBNAIL_DIR = 'profile_pictures/thumbnails'
+THUMBNAIL_SIZES = (40, 80, 160)
+THUMBNAIL_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def thumbnail_name(lead_id, version, size, extension):
+    return f'{THUMBNAIL_DIR}/{lead_id}/{version}-{size}.{extension}'
+
+
+def thumbnail_names(lead_id, version):
+    return [
+        thumbnail_name(lead_id, version, size, extension)
+        for size in THUMBNAIL_SIZES for extension, _, _ in THUMBNAIL_FORMATS
+    ]
+
+
+def render_thumbnails(lead_id, name):
+    """Write every thumbnail for the image stored at ``name`` and return its version."""
+    with default_storage.open(name, 'rb') as original:
+        data = original.read()
+    version = hashlib.sha1(data).hexdigest()[:12]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert('RGB')
+    for size in THUMBNAIL_SIZES:
+        resized = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        for extension, image_format, options in THUMBNAIL_FORMATS:
+            target = thumbnail_name(lead_id, version, size, extension)
+            if default_storage.exists(target):
+                continue
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **options)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    return version
+
+
+def delete_thumbnails(lead_id, version):
+    for name in thumbnail_names(lead_id, version):
+        default_storage.delete(name)
@@ -1,27 +1,46 @@
+from django.conf import settings
 from django.urls import path, include
+
+from .async_views import AsyncLeadDetailView, AsyncLeadJsonView, AsyncLeadListView
 from .views import LeadListView, LeadDetailView, LeadCreateView, LeadUpdateView, LeadDeleteView, AssignAgentView, \
     CategoryListView, CategoryDetailView, LeadCategoryUpdateView, CategoryCreateView, CategoryUpdateView, \
-    CategoryDeleteView, LeadJsonView, FollowUpCreateView, FollowUpUpdateView, FollowUpDeleteView
+    CategoryDeleteView, LeadJsonView, FollowUpCreateView, FollowUpUpdateView, FollowUpDeleteView, LeadImportView, \
+    LeadExportView, FollowUpExportView, LeadSearchView, LeadBulkActionView, LeadMergeView, \
+    LeadLookupView, AttachmentUploadCreateView, AttachmentUploadView
+
+app_name = 'leads'
+
+if settings.ASYNC_VIEWS:
+    LeadListView, LeadDetailView, LeadJsonView = AsyncLeadListView, AsyncLeadDetailView, AsyncLeadJsonView
 
 urlpatterns = [
-    path('', LeadListView.as_view(), name='lead list'),
-    path('json/', LeadJsonView.as_view(), name='lead list json'),
+    path('', LeadListView.as_view(), name='lead-list'),
+    path('json/', LeadJsonView.as_view(), name='lead-list-json'),
+    path('search/', LeadSearchView.as_view(), name='lead-search'),
+    path('lookup/', LeadLookupView.as_view(), name='lead-lookup'),
     path('<int:pk>/', include([
-        path('', LeadDetailView.as_view(), name='lead detail'),
-        path('update/', LeadUpdateView.as_view(), name='lead update'),
-        path('delete/', LeadDeleteView.as_view(), name='lead delete'),
-        path('assign-agent/', AssignAgentView.as_view(), name='assign agent'),
-        path('category/', LeadCategoryUpdateView.as_view(), name='lead category update'),
-        path('followups/create/', FollowUpCreateView.as_view(), name='lead followup create'),
+        path('', LeadDetailView.as_view(), name='lead-detail'),
+        path('update/', LeadUpdateView.as_view(), name='lead-update'),
+        path('delete/', LeadDeleteView.as_view(), name='lead-delete'),
+        path('assign-agent/', AssignAgentView.as_view(), name='assign-agent'),
+        path('category/', LeadCategoryUpdateView.as_view(), name='lead-category-update'),
+        path('merge/', LeadMergeView.as_view(), name='lead-merge'),
+        path('followups/create/', FollowUpCreateView.as_view(), name='lead-followup-create'),
+        path('attachments/', AttachmentUploadCreateView.as_view(), name='attachment-upload-create'),
         ])),
-    path('followups/<int:pk>/', FollowUpUpdateView.as_view(), name='lead followup update'),
-    path('followups/<int:pk>/delete/', FollowUpDeleteView.as_view(), name='lead followup delete'),
-    path('create/', LeadCreateView.as_view(), name='lead create'),
+    path('followups/<int:pk>/', FollowUpUpdateView.as_view(), name='lead-followup-update'),
+    path('followups/<int:pk>/delete/', FollowUpDeleteView.as_view(), name='lead-followup-delete'),
+    path('attachments/<uuid:pk>/', AttachmentUploadView.as_view(), name='attachment-upload'),
+    path('create/', LeadCreateView.as_view(), name='lead-create'),
+    path('import/', LeadImportView.as_view(), name='lead-import'),
+    path('bulk/', LeadBulkActionView.as_view(), name='lead-bulk-action'),
+    path('export/', LeadExportView.as_view(), name='lead-export'),
+    path('followups/export/', FollowUpExportView.as_view(), name='followup-export'),
     path('categories/', include([
-        path('', CategoryListView.as_view(), name='category list'),
-        path('<int:pk>/', CategoryDetailView.as_view(), name='category detail'),
-        path('<int:pk>/update/', CategoryUpdateView.as_view(), name='category update'),
-        path('<int:pk>/delete/', CategoryDeleteView.as_view(), name='category delete'),
+        path('', CategoryListView.as_view(), name='category-list'),
+        path('<int:pk>/', CategoryDetailView.as_view(), name='category-detail'),
+        path('<int:pk>/update/', CategoryUpdateView.as_view(), name='category-update'),
+        path('<int:pk>/delete/', CategoryDeleteView.as_view(), name='category-delete'),
         ])),
-    path('create-category/', CategoryCreateView.as_view(), name='category create'),
+    path('create-category/', CategoryCreateView.as_view(), name='category-create'),
 ]
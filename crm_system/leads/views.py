@@ -1,15 +1,36 @@
 import logging
-import datetime
+import os
+import uuid
+from django.conf import settings
 from django.contrib import messages
-from django.core.mail import send_mail
-from django.http.response import JsonResponse
-from django.shortcuts import render, redirect, reverse
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import JSONObject
+from django.http import Http404, HttpResponse
+from django.http.response import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect, reverse
+from django.utils import timezone
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import generic
-from crm_system.agents.mixins import OrganizerLoginRequiredMixin
-from .models import Lead, Category, FollowUp
+from crm_system.agents.mixins import OrganizerLoginRequiredMixin, OrganisationQuerysetMixin
+from crm_system.agents.tenancy import get_organisation_version, get_tenant
+from crm_system.main.tasks import enqueue, queue_mail
+from .blobs import append_chunk, complete_upload, discard_upload
+from .bulk import assign_leads, categorise_leads, delete_leads
+from .contacts import normalise_email, normalise_phone
+from .counters import get_dashboard_counters
+from .dedup import flag_duplicates, merge_leads, set_blocking_keys
+from .media import serve_media, user_can_access
+from .models import AttachmentUpload, Lead, Category, FollowUp
+from .pagination import KeysetPage, get_page_size
+from .registry import get_category_registry, invalidate_category_registry
+from .routing import get_router
+from .search import search_leads
+from .streaming import chunked, stream_csv, stream_jsonl
 from .forms import LeadModelForm, CustomUserCreationForm, AssignAgentForm, LeadCategoryUpdateForm, \
-    CategoryModelForm, FollowUpModelForm
+    CategoryModelForm, FollowUpModelForm, LeadImportUploadForm, LeadFilterForm, LeadBulkActionForm
 
 
 logger = logging.getLogger(__name__)
@@ -38,24 +59,7 @@ class DashboardView(OrganizerLoginRequiredMixin, generic.TemplateView):
     def get_context_data(self, **kwargs):
         context = super(DashboardView, self).get_context_data(**kwargs)
         user = self.request.user
-        total_lead_count = Lead.objects.filter(organisation=user.profile).count()
-        thirty_days_ago = datetime.date.today() - datetime.timedelta(days=30)
-        total_in_past30 = Lead.objects.filter(
-            organisation=user.profile,
-            date_added__gte=thirty_days_ago
-        ).count()
-        converted_category = Category.objects.get(name='Converted')
-        converted_in_past30 = Lead.objects.filter(
-            organisation=user.profile,
-            category=converted_category,
-            converted_date__gte=thirty_days_ago
-        ).count()
-
-        context.update({
-            'total_lead_count': total_lead_count,
-            'total_in_past30': total_in_past30,
-            'converted_in_past30': converted_in_past30
-        })
+        context.update(get_dashboard_counters(get_tenant(user).organisation_id))
         return context
 
 
@@ -67,35 +71,98 @@ class LeadListView(LoginRequiredMixin, generic.ListView):
     template_name = 'leads/lead_list.html'
     context_object_name = 'leads'
 
+    def get_filter_form(self):
+        organisation_id = get_tenant(self.request.user).organisation_id
+        return LeadFilterForm(self.request.GET or None, organisation=organisation_id)
+
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = Lead.objects.filter(
-                organisation=user.profile,
-                agent__isnull=False
-            )
-        else:
-            queryset = Lead.objects.filter(
-                organisation=user.agent.organisation,
-                agent__isnull=False
-            )
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+        queryset = Lead.objects.for_user(self.request.user).filter(agent__isnull=False)
+        self.filter_form = self.get_filter_form()
+        queryset = self.filter_form.filter_queryset(queryset)
+        return queryset.select_related('category', 'agent__user')
 
     def get_context_data(self, **kwargs):
         context = super(LeadListView, self).get_context_data(**kwargs)
         user = self.request.user
+        page_size = get_page_size(self.request)
+        filter_query = self.request.GET.copy()
+        for param in ('cursor', 'unassigned_cursor', 'page_size'):
+            filter_query.pop(param, None)
+        tenant = get_tenant(user)
+        version = get_organisation_version(tenant.organisation_id)
+        context.update({
+            'leads': KeysetPage(self.object_list, self.request.GET.get('cursor'), page_size),
+            'cache_scope': f'{tenant.organisation_id}:{version}:{tenant.agent_id}',
+            'page_size': page_size,
+            'filter_form': self.filter_form,
+            'filter_query': filter_query.urlencode(),
+        })
         if user.is_organizer:
-            queryset = Lead.objects.filter(
-                organisation=user.profile,
-                agent__isnull=True
-            )
+            queryset = Lead.objects.for_user(user).filter(agent__isnull=True).select_related('category')
+            queryset = self.filter_form.filter_queryset(queryset)
             context.update({
-                'unassigned_leads': queryset
+                'unassigned_leads': KeysetPage(queryset, self.request.GET.get('unassigned_cursor'), page_size),
+                'bulk_form': LeadBulkActionForm(organisation=tenant.organisation_id),
             })
         return context
 
 
+class LeadSearchView(LoginRequiredMixin, generic.TemplateView):
+    template_name = 'leads/lead_search.html'
+    page_size = 25
+    max_page = 40
+
+    def get_context_data(self, **kwargs):
+        context = super(LeadSearchView, self).get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        try:
+            page = max(1, min(int(self.request.GET.get('page', 1)), self.max_page))
+        except ValueError:
+            page = 1
+        results = []
+        if query:
+            results = search_leads(self.request.user, query, (page - 1) * self.page_size, self.page_size + 1)
+        context.update({
+            'query': query,
+            'results': results[:self.page_size],
+            'page': page,
+            'has_next': len(results) > self.page_size and page < self.max_page,
+        })
+        return context
+
+
+class LeadLookupView(LoginRequiredMixin, generic.View):
+    """
+    Find the caller's lead by ``?phone=`` or ``?email=`` with its latest
+    follow-up, in one query on the normalised contact indexes.
+    """
+    fields = ('id', 'first_name', 'last_name', 'email', 'phone_number', 'agent_id', 'category_id', 'date_added')
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('phone'):
+            lookup, error = {'phone_e164': normalise_phone(request.GET['phone'])}, 'Not a valid phone number'
+        elif request.GET.get('email'):
+            lookup, error = {'email_normalised': normalise_email(request.GET['email'])}, 'Not a valid email address'
+        else:
+            return JsonResponse({'error': 'Pass a phone or email to look up'}, status=400)
+        if not all(lookup.values()):
+            return JsonResponse({'error': error}, status=400)
+        latest_followup = (
+            FollowUp.objects.filter(lead=OuterRef('pk'))
+            .order_by('-date_added')
+            .values(data=JSONObject(id='id', notes='notes', date_added='date_added'))[:1]
+        )
+        lead = (
+            Lead.objects.for_user(request.user).filter(**lookup)
+            .order_by('-id')
+            .values(*self.fields, latest_followup=Subquery(latest_followup))
+            .first()
+        )
+        if lead is None:
+            return JsonResponse({'error': 'No matching lead'}, status=404)
+        return JsonResponse({'lead': lead})
+
+
 def lead_list(request):
     leads = Lead.objects.all()
     context = {
@@ -104,18 +171,28 @@ def lead_list(request):
     return render(request, 'leads/lead_list.html', context)
 
 
-class LeadDetailView(LoginRequiredMixin, generic.DetailView):
+class LeadDetailView(LoginRequiredMixin, OrganisationQuerysetMixin, generic.DetailView):
     template_name = 'leads/lead_detail.html'
     context_object_name = 'lead'
+    model = Lead
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = Lead.objects.filter(organisation=user.profile)
-        else:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation)
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+    def get_context_data(self, **kwargs):
+        context = super(LeadDetailView, self).get_context_data(**kwargs)
+        context['followups'] = self.object.followups.order_by('date_added')
+        return context
+
+
+class LeadMergeView(OrganizerLoginRequiredMixin, generic.View):
+    """Merge a lead flagged as a duplicate into the lead it duplicates."""
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        leads = Lead.objects.for_user(request.user)
+        lead = get_object_or_404(leads.exclude(duplicate_of=None), pk=kwargs['pk'])
+        primary = get_object_or_404(leads, pk=lead.duplicate_of_id)
+        merge_leads(primary, leads.filter(pk=lead.pk))
+        messages.success(request, f'{lead} has been merged into {primary}')
+        return redirect('leads:lead-detail', pk=primary.pk)
 
 
 def lead_detail(request, pk):
@@ -135,9 +212,16 @@ class LeadCreateView(OrganizerLoginRequiredMixin, generic.CreateView):
 
     def form_valid(self, form):
         lead = form.save(commit=False)
-        lead.organisation = self.request.user.profile
+        lead.organisation_id = get_tenant(self.request.user).organisation_id
+        router = get_router(lead.organisation_id)
+        if router is not None:
+            router.route([lead])
+        set_blocking_keys(lead)
+        flag_duplicates([lead])
         lead.save()
-        send_mail(
+        if lead.duplicate_of_id is not None:
+            messages.warning(self.request, 'This lead looks like a duplicate of an existing lead')
+        queue_mail(
             subject='A lead has been created',
             message='Go to the site to see the new lead',
             from_email='test@test.com',
@@ -147,6 +231,54 @@ class LeadCreateView(OrganizerLoginRequiredMixin, generic.CreateView):
         return super(LeadCreateView, self).form_valid(form)
 
 
+class LeadImportView(OrganizerLoginRequiredMixin, generic.FormView):
+    template_name = 'leads/lead_import.html'
+    form_class = LeadImportUploadForm
+
+    def get_success_url(self):
+        return reverse('leads:lead-list')
+
+    def form_valid(self, form):
+        path = default_storage.save(f'lead_imports/{uuid.uuid4().hex}.csv', form.cleaned_data['file'])
+        enqueue('leads.import', organisation_id=get_tenant(self.request.user).organisation_id, path=path)
+        messages.info(self.request, 'Your leads are being imported. You will receive an email when it is done.')
+        return super(LeadImportView, self).form_valid(form)
+
+
+class LeadBulkActionView(OrganizerLoginRequiredMixin, generic.FormView):
+    form_class = LeadBulkActionForm
+    http_method_names = ['post']
+
+    def get_form_kwargs(self):
+        kwargs = super(LeadBulkActionView, self).get_form_kwargs()
+        kwargs['organisation'] = get_tenant(self.request.user).organisation_id
+        return kwargs
+
+    def get_success_url(self):
+        return reverse('leads:lead-list')
+
+    def form_valid(self, form):
+        organisation_id = get_tenant(self.request.user).organisation_id
+        queryset = form.filter_queryset(Lead.objects.for_user(self.request.user))
+        action = form.cleaned_data['action']
+        if action == 'assign':
+            count = assign_leads(queryset, organisation_id, form.cleaned_data['to_agent'])
+            messages.success(self.request, f'{count} lead(s) assigned to {form.cleaned_data["to_agent"]}')
+        elif action == 'categorise':
+            count = categorise_leads(queryset, organisation_id, form.cleaned_data['to_category'])
+            messages.success(self.request, f'{count} lead(s) moved to {form.cleaned_data["to_category"]}')
+        else:
+            count = delete_leads(queryset, organisation_id)
+            messages.success(self.request, f'{count} lead(s) deleted')
+        return super(LeadBulkActionView, self).form_valid(form)
+
+    def form_invalid(self, form):
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(self.request, error)
+        return redirect('leads:lead-list')
+
+
 def lead_create(request):
     form = LeadModelForm()
     if request.method == 'POST':
@@ -160,13 +292,10 @@ def lead_create(request):
     return render(request, 'leads/lead_create.html', context)
 
 
-class LeadUpdateView(OrganizerLoginRequiredMixin, generic.UpdateView):
+class LeadUpdateView(OrganizerLoginRequiredMixin, OrganisationQuerysetMixin, generic.UpdateView):
     template_name = 'leads/lead_update.html'
     form_class = LeadModelForm
-
-    def get_queryset(self):
-        user = self.request.user
-        return Lead.objects.filter(organisation=user.profile)
+    model = Lead
 
     def get_success_url(self):
         return reverse('leads:lead-list')
@@ -192,16 +321,13 @@ def lead_update(request, pk):
     return render(request, 'leads/lead_update.html', context)
 
 
-class LeadDeleteView(OrganizerLoginRequiredMixin, generic.DeleteView):
+class LeadDeleteView(OrganizerLoginRequiredMixin, OrganisationQuerysetMixin, generic.DeleteView):
     template_name = 'leads/lead_delete.html'
+    model = Lead
 
     def get_success_url(self):
         return reverse('leads:lead-list')
 
-    def get_queryset(self):
-        user = self.request.user
-        return Lead.objects.filter(organisation=user.profile)
-
 
 def lead_delete(request, pk):
     lead = Lead.objects.get(id=pk)
@@ -225,62 +351,61 @@ class AssignAgentView(OrganizerLoginRequiredMixin, generic.FormView):
 
     def form_valid(self, form):
         agent = form.cleaned_data['agent']
-        lead = Lead.objects.get(id=self.kwargs['pk'])
+        lead = get_object_or_404(Lead.objects.for_user(self.request.user), id=self.kwargs['pk'])
         lead.agent = agent
         lead.save()
         return super(AssignAgentView, self).form_valid(form)
 
 
-class CategoryListView(LoginRequiredMixin, generic.ListView):
+def release_converted_flag(category):
+    """Clear the converted flag from the organisation's other categories before ``category`` takes it."""
+    if category.is_converted:
+        Category.objects.filter(
+            organisation_id=category.organisation_id,
+            is_converted=True
+        ).exclude(pk=category.pk).update(is_converted=False)
+        invalidate_category_registry(category.organisation_id)
+
+
+class CategoryListView(LoginRequiredMixin, OrganisationQuerysetMixin, generic.ListView):
     template_name = 'leads/category_list.html'
     context_object_name = "category_list"
+    model = Category
 
     def get_context_data(self, **kwargs):
         context = super(CategoryListView, self).get_context_data(**kwargs)
-        user = self.request.user
-
-        if user.is_organizer:
-            queryset = Lead.objects.filter(
-                organisation=user.profile
-            )
-        else:
-            queryset = Lead.objects.filter(
-                organisation=user.agent.organisation
-            )
-
+        organisation_id = get_tenant(self.request.user).organisation_id
+        counts = {
+            row['category_id']: row
+            for row in Lead.objects.filter(organisation_id=organisation_id).values('category_id').annotate(
+                lead_count=Count('id'),
+                converted_count=Count('id', filter=Q(converted_date__isnull=False)),
+            ).order_by()
+        }
+        for category in context['category_list']:
+            row = counts.get(category.pk, {})
+            category.lead_count = row.get('lead_count', 0)
+            category.converted_count = row.get('converted_count', 0)
         context.update({
-            'unassigned_lead_count': queryset.filter(category__isnull=True).count()
+            'unassigned_lead_count': counts.get(None, {}).get('lead_count', 0)
         })
         return context
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = Category.objects.filter(
-                organisation=user.profile
-            )
-        else:
-            queryset = Category.objects.filter(
-                organisation=user.agent.organisation
-            )
-        return queryset
 
-
-class CategoryDetailView(LoginRequiredMixin, generic.DetailView):
+class CategoryDetailView(LoginRequiredMixin, OrganisationQuerysetMixin, generic.DetailView):
     template_name = 'leads/category_detail.html'
     context_object_name = 'category'
+    model = Category
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = Category.objects.filter(
-                organisation=user.profile
-            )
-        else:
-            queryset = Category.objects.filter(
-                organisation=user.agent.organisation
-            )
-        return queryset
+    def get_context_data(self, **kwargs):
+        context = super(CategoryDetailView, self).get_context_data(**kwargs)
+        page_size = get_page_size(self.request)
+        queryset = Lead.objects.for_user(self.request.user).filter(category=self.object).select_related('agent__user')
+        context.update({
+            'leads': KeysetPage(queryset, self.request.GET.get('cursor'), page_size),
+            'page_size': page_size,
+        })
+        return context
 
 
 class CategoryCreateView(OrganizerLoginRequiredMixin, generic.CreateView):
@@ -292,73 +417,49 @@ class CategoryCreateView(OrganizerLoginRequiredMixin, generic.CreateView):
 
     def form_valid(self, form):
         category = form.save(commit=False)
-        category.organisation = self.request.user.profile
-        category.save()
+        category.organisation_id = get_tenant(self.request.user).organisation_id
+        with transaction.atomic():
+            release_converted_flag(category)
+            category.save()
         return super(CategoryCreateView, self).form_valid(form)
 
 
-class CategoryUpdateView(OrganizerLoginRequiredMixin, generic.UpdateView):
+class CategoryUpdateView(OrganizerLoginRequiredMixin, OrganisationQuerysetMixin, generic.UpdateView):
     template_name = 'leads/category_update.html'
     form_class = CategoryModelForm
+    model = Category
 
     def get_success_url(self):
         return reverse('leads:category-list')
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = Category.objects.filter(
-                organisation=user.profile
-            )
-        else:
-            queryset = Category.objects.filter(
-                organisation=user.agent.organisation
-            )
-        return queryset
+    def form_valid(self, form):
+        with transaction.atomic():
+            release_converted_flag(form.instance)
+            return super(CategoryUpdateView, self).form_valid(form)
 
 
-class CategoryDeleteView(OrganizerLoginRequiredMixin, generic.DeleteView):
+class CategoryDeleteView(OrganizerLoginRequiredMixin, OrganisationQuerysetMixin, generic.DeleteView):
     template_name = 'leads/category_delete.html'
+    model = Category
 
     def get_success_url(self):
         return reverse('leads:category-list')
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = Category.objects.filter(
-                organisation=user.profile
-            )
-        else:
-            queryset = Category.objects.filter(
-                organisation=user.agent.organisation
-            )
-        return queryset
-
 
-class LeadCategoryUpdateView(LoginRequiredMixin, generic.UpdateView):
+class LeadCategoryUpdateView(LoginRequiredMixin, OrganisationQuerysetMixin, generic.UpdateView):
     template_name = 'leads/lead_category_update.html'
     form_class = LeadCategoryUpdateForm
-
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = Lead.objects.filter(organisation=user.profile)
-        else:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation)
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+    model = Lead
 
     def get_success_url(self):
-        return reverse('leads:lead-detail', kwargs={'pk': self.get_object().id})
+        return reverse('leads:lead-detail', kwargs={'pk': self.object.id})
 
     def form_valid(self, form):
-        lead_before_update = self.get_object()
         instance = form.save(commit=False)
-        converted_category = Category.objects.get(name='Converted')
-        if form.cleaned_data['category'] == converted_category:
-            if lead_before_update.category != converted_category:
-                instance.converted_date = datetime.datetime.now()
+        registry = get_category_registry(instance.organisation_id)
+        if registry.is_converted(instance.category_id):
+            if not registry.is_converted(instance.loaded_values['category_id']):
+                instance.converted_date = timezone.now()
         instance.save()
         return super(LeadCategoryUpdateView, self).form_valid(form)
 
@@ -373,59 +474,237 @@ class FollowUpCreateView(LoginRequiredMixin, generic.CreateView):
     def get_context_data(self, **kwargs):
         context = super(FollowUpCreateView, self).get_context_data(**kwargs)
         context.update({
-            'lead': Lead.objects.get(pk=self.kwargs['pk'])
+            'lead': self.get_lead()
         })
         return context
 
+    def get_lead(self):
+        return get_object_or_404(Lead.objects.for_user(self.request.user), pk=self.kwargs['pk'])
+
     def form_valid(self, form):
-        lead = Lead.objects.get(pk=self.kwargs['pk'])
+        lead = self.get_lead()
         followup = form.save(commit=False)
         followup.lead = lead
         followup.save()
         return super(FollowUpCreateView, self).form_valid(form)
 
 
-class FollowUpUpdateView(LoginRequiredMixin, generic.UpdateView):
+class FollowUpUpdateView(LoginRequiredMixin, OrganisationQuerysetMixin, generic.UpdateView):
     template_name = 'leads/followup_update.html'
     form_class = FollowUpModelForm
-
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = FollowUp.objects.filter(lead__organisation=user.profile)
-        else:
-            queryset = FollowUp.objects.filter(lead__organisation=user.agent.organisation)
-            queryset = queryset.filter(lead__agent__user=user)
-        return queryset
+    model = FollowUp
 
     def get_success_url(self):
-        return reverse('leads:lead-detail', kwargs={'pk': self.get_object().lead.id})
+        return reverse('leads:lead-detail', kwargs={'pk': self.object.lead_id})
 
 
-class FollowUpDeleteView(OrganizerLoginRequiredMixin, generic.DeleteView):
+class FollowUpDeleteView(OrganizerLoginRequiredMixin, OrganisationQuerysetMixin, generic.DeleteView):
     template_name = 'leads/followup_delete.html'
+    model = FollowUp
 
     def get_success_url(self):
-        followup = FollowUp.objects.get(id=self.kwargs['pk'])
-        return reverse('leads:lead-detail', kwargs={'pk': followup.lead.pk})
+        return reverse('leads:lead-detail', kwargs={'pk': self.object.lead_id})
+
+
+def _upload_response(upload, status=200, **extra):
+    response = JsonResponse({
+        'id': str(upload.pk),
+        'url': reverse('leads:attachment-upload', kwargs={'pk': upload.pk}),
+        'offset': upload.offset,
+        'size': upload.size,
+        **extra,
+    }, status=status)
+    response['Upload-Offset'] = upload.offset
+    return response
+
+
+class AttachmentUploadCreateView(LoginRequiredMixin, generic.View):
+    """
+    Start a resumable attachment upload to a lead from ``file_name``, ``size``
+    and ``notes``. The file is then sent in chunks to the returned ``url``.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        lead = get_object_or_404(Lead.objects.for_user(request.user), pk=kwargs['pk'])
+        file_name = os.path.basename(request.POST.get('file_name', '').strip())[:255]
+        try:
+            size = int(request.POST.get('size', ''))
+        except ValueError:
+            size = 0
+        if not file_name or not 0 < size <= settings.ATTACHMENT_MAX_SIZE:
+            return JsonResponse(
+                {'error': f'file_name and a size of 1 to {settings.ATTACHMENT_MAX_SIZE} bytes are required'}, status=400
+            )
+        upload = AttachmentUpload.objects.create(
+            lead=lead, user=request.user, file_name=file_name, notes=request.POST.get('notes', ''), size=size
+        )
+        return _upload_response(upload, status=201)
+
+
+class AttachmentUploadView(LoginRequiredMixin, generic.View):
+    """
+    One resumable upload. ``GET`` reports how many bytes have arrived,
+    ``PATCH`` appends the request body at the ``Upload-Offset`` header, which
+    must equal that count, and ``DELETE`` abandons the upload. The chunk that
+    completes the file turns it into a follow-up of the lead; an empty
+    ``PATCH`` at the full size retries a completion that failed.
+    """
+    http_method_names = ['get', 'patch', 'delete']
+
+    def get_upload(self, lock=False):
+        queryset = AttachmentUpload.objects.filter(user=self.request.user)
+        if lock:
+            queryset = queryset.select_for_update()
+        return get_object_or_404(queryset, pk=self.kwargs['pk'])
+
+    def get(self, request, *args, **kwargs):
+        return _upload_response(self.get_upload())
+
+    def patch(self, request, *args, **kwargs):
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return JsonResponse({'error': 'The Upload-Offset header is required'}, status=400)
+        with transaction.atomic():
+            upload = self.get_upload(lock=True)
+            if offset != upload.offset:
+                return _upload_response(upload, status=409, error=f'The upload is at offset {upload.offset}')
+            try:
+                append_chunk(upload, request, offset)
+            except ValueError as error:
+                return _upload_response(upload, status=400, error=str(error))
+        if upload.offset < upload.size:
+            return _upload_response(upload)
+        # Hashing the whole file happens after the upload's row lock is released.
+        followup = complete_upload(upload)
+        if followup is None:
+            return JsonResponse({'error': 'The upload has already been completed'}, status=409)
+        return JsonResponse({
+            'followup': followup.pk,
+            'url': reverse('leads:lead-detail', kwargs={'pk': followup.lead_id}),
+        }, status=201)
+
+    def delete(self, request, *args, **kwargs):
+        discard_upload(self.get_upload())
+        return HttpResponse(status=204)
+
+
+class LeadJsonView(LoginRequiredMixin, generic.View):
+    """
+    Stream the caller's leads ordered by id, ``limit`` rows after ``cursor``.
+
+    ``?format=ndjson`` emits one object per line; the default JSON envelope
+    also carries ``next_cursor``. With NDJSON the last ``id`` received is the
+    cursor for the next request.
+    """
+    allowed_fields = ('first_name', 'last_name', 'age', 'email', 'phone_number', 'description',
+                      'date_added', 'converted_date', 'agent_id', 'category_id')
+    default_fields = ('first_name', 'last_name', 'age')
+    default_limit = 1000
+    max_limit = 10000
+    chunk_size = 2000
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organizer:
-            queryset = FollowUp.objects.filter(lead__organisation=user.profile)
+        return Lead.objects.for_user(self.request.user)
+
+    def get_params(self, request):
+        """Return ``(fields, cursor, limit)`` from the query string, or an error response."""
+        fields = request.GET.get('fields')
+        fields = tuple(f for f in fields.split(',') if f) if fields else self.default_fields
+        unknown = [f for f in fields if f not in self.allowed_fields]
+        if unknown:
+            return JsonResponse({'error': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+        try:
+            cursor = int(request.GET.get('cursor', 0))
+        except ValueError:
+            return JsonResponse({'error': 'cursor must be an integer'}, status=400)
+        return fields, cursor, get_page_size(request, 'limit', self.default_limit, self.max_limit)
+
+    def get_rows(self, fields, cursor, limit):
+        return self.get_queryset().filter(id__gt=cursor).order_by('id').values('id', *fields)[:limit]
+
+    def get(self, request, *args, **kwargs):
+        params = self.get_params(request)
+        if isinstance(params, JsonResponse):
+            return params
+        fields, cursor, limit = params
+        rows = self.get_rows(fields, cursor, limit).iterator(chunk_size=self.chunk_size)
+        if request.GET.get('format') == 'ndjson':
+            return StreamingHttpResponse(self.stream_ndjson(rows), content_type='application/x-ndjson')
+        return StreamingHttpResponse(self.stream_json(rows, limit), content_type='application/json')
+
+    def stream_ndjson(self, rows):
+        encoder = DjangoJSONEncoder()
+        for chunk in chunked(rows, self.chunk_size):
+            yield ''.join(encoder.encode(row) + '\n' for row in chunk)
+
+    def stream_json(self, rows, limit):
+        encoder = DjangoJSONEncoder()
+        count, last_id = 0, None
+        yield '{"qs": ['
+        for chunk in chunked(rows, self.chunk_size):
+            yield (',' if count else '') + ','.join(encoder.encode(row) for row in chunk)
+            count += len(chunk)
+            last_id = chunk[-1]['id']
+        next_cursor = last_id if count == limit else None
+        yield f'], "next_cursor": {encoder.encode(next_cursor)}}}'
+
+
+class ExportView(OrganizerLoginRequiredMixin, generic.View):
+    filename = None
+    columns = ()
+    headers = ()
+
+    def get_queryset(self, filter_form):
+        raise NotImplementedError
+
+    def get_rows(self, queryset):
+        return queryset.values_list(*self.columns).iterator(chunk_size=2000)
+
+    def get(self, request, *args, **kwargs):
+        filter_form = LeadFilterForm(request.GET, organisation=get_tenant(request.user).organisation_id)
+        if not filter_form.is_valid():
+            return JsonResponse({'errors': filter_form.errors.get_json_data()}, status=400)
+        rows = self.get_rows(self.get_queryset(filter_form).order_by('id'))
+        if request.GET.get('format') == 'jsonl':
+            response = StreamingHttpResponse(stream_jsonl(self.headers, rows), content_type='application/x-ndjson')
+            extension = 'jsonl'
         else:
-            queryset = FollowUp.objects.filter(lead__organisation=user.agent.organisation)
-            queryset = queryset.filter(lead__agent__user=user)
-        return queryset
+            response = StreamingHttpResponse(stream_csv(self.headers, rows), content_type='text/csv')
+            extension = 'csv'
+        response['Content-Disposition'] = f'attachment; filename="{self.filename}.{extension}"'
+        return response
+
+
+class LeadExportView(ExportView):
+    filename = 'leads'
+    columns = ('id', 'first_name', 'last_name', 'age', 'email', 'phone_number', 'description',
+               'date_added', 'converted_date', 'category__name', 'agent__user__first_name',
+               'agent__user__last_name')
+    headers = ('id', 'first_name', 'last_name', 'age', 'email', 'phone_number', 'description',
+               'date_added', 'converted_date', 'category', 'agent_first_name', 'agent_last_name')
 
+    def get_queryset(self, filter_form):
+        queryset = Lead.objects.for_user(self.request.user)
+        return filter_form.filter_queryset(queryset)
+
+
+class FollowUpExportView(ExportView):
+    filename = 'followups'
+    columns = ('id', 'lead_id', 'lead__first_name', 'lead__last_name', 'date_added', 'notes', 'file')
+    headers = ('id', 'lead_id', 'lead_first_name', 'lead_last_name', 'date_added', 'notes', 'file')
+
+    def get_queryset(self, filter_form):
+        queryset = FollowUp.objects.for_user(self.request.user)
+        return filter_form.filter_queryset(queryset, lead_prefix='lead__')
+
+
+class ProtectedMediaView(LoginRequiredMixin, generic.View):
+    """Serve an uploaded file once the owning lead or follow-up is visible to the user."""
 
-class LeadJsonView(generic.View):
     def get(self, request, *args, **kwargs):
-        qs = list(Lead.objects.all().values(
-            'first_name',
-            'last_name',
-            'age')
-        )
-        return JsonResponse({
-            'qs': qs,
-        })
+        name = kwargs['path']
+        if not user_can_access(request.user, name) or not default_storage.exists(name):
+            raise Http404
+        return serve_media(request, name)
@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from crm_system.main.models import Task
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_at', 'created_at']
+    list_filter = ['status', 'name']
+
+
+admin.site.register(Task, TaskAdmin)
@@ -0,0 +1,110 @@
+import bisect
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """A Prometheus style cumulative histogram with one series per view name."""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._series = defaultdict(lambda: [[0] * (len(buckets) + 1), 0, 0.0])
+        self._lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self._lock:
+            counts, _, _ = series = self._series[view]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((view, list(counts), count, total) for view, (counts, count, total) in self._series.items())
+        for view, counts, count, total in series:
+            label = view.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{view="{label}",le="+Inf"}} {count}')
+            lines.append(f'{self.name}_count{{view="{label}"}} {count}')
+            lines.append(f'{self.name}_sum{{view="{label}"}} {total:.6f}')
+        return '\n'.join(lines)
+
+
+REQUEST_DURATION = Histogram('crm_request_duration_seconds', 'Total time spent handling a request.', DURATION_BUCKETS)
+SQL_DURATION = Histogram('crm_request_sql_seconds', 'Time spent in SQL per request.', DURATION_BUCKETS)
+SQL_QUERIES = Histogram('crm_request_sql_queries', 'Number of SQL queries per request.', QUERY_COUNT_BUCKETS)
+TEMPLATE_DURATION = Histogram('crm_request_template_seconds', 'Time spent rendering templates per request.',
+                              DURATION_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, SQL_DURATION, SQL_QUERIES, TEMPLATE_DURATION)
+
+
+class RequestMetrics:
+    """SQL and template timings collected while one request is handled."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_sql = None
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Called by record_query() for the queries run on behalf of this request.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_count += 1
+            self.sql_time += duration
+            if duration > self.slowest_time:
+                self.slowest_time = duration
+                self.slowest_sql = sql
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def record(self, view, total):
+        REQUEST_DURATION.observe(view, total)
+        SQL_DURATION.observe(view, self.sql_time)
+        SQL_QUERIES.observe(view, self.query_count)
+        if self.template_time:
+            TEMPLATE_DURATION.observe(view, self.template_time)
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.query_count} queries"',
+            f'db-slowest;dur={self.slowest_time * 1000:.1f}',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+# The metrics of the request being handled. Context variables follow a request through sync_to_async()
+# and back, so concurrent ASGI requests sharing one thread-sensitive connection still count only their own queries.
+current_metrics = contextvars.ContextVar('current_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """The execute wrapper installed once on each connection; it times the query for the current request."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def render_metrics():
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
@@ -0,0 +1,165 @@
+import json
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import URLPattern, URLResolver, reverse
+
+from crm_system.agents import urls as agent_urls
+from crm_system.leads import urls as lead_urls
+from crm_system.leads.models import AttachmentUpload, Category, FollowUp, Lead
+from crm_system.main.seed import seed
+
+QUERY_STRINGS = {
+    'leads:lead-search': {'q': 'smith'},
+}
+
+
+def _route_names(patterns, needs_pk=False):
+    for pattern in patterns:
+        takes_pk = needs_pk or 'pk' in pattern.pattern.converters
+        if isinstance(pattern, URLResolver):
+            yield from _route_names(pattern.url_patterns, takes_pk)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield pattern.name, takes_pk
+
+
+def discover_routes():
+    routes = [('dashboard', False)]
+    for module in (lead_urls, agent_urls):
+        routes += [(f'{module.app_name}:{name}', needs_pk) for name, needs_pk in _route_names(module.urlpatterns)]
+    return routes
+
+
+def _percentile(timings, percent):
+    if len(timings) == 1:
+        return timings[0]
+    return statistics.quantiles(timings, n=100, method='inclusive')[percent - 1]
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database and report p50/p95 latency and SQL query counts for every '
+            'lead, agent and dashboard route, as an organizer and as an agent.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisations', type=int, default=2)
+        parser.add_argument('--agents', type=int, default=5)
+        parser.add_argument('--categories', type=int, default=5)
+        parser.add_argument('--leads', type=int, default=2000, help='Leads per organisation.')
+        parser.add_argument('--followups', type=int, default=1, help='Follow-ups per lead.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--baseline', help='JSON file to compare against; regressions exit non-zero.')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative p95 slowdown before a route counts as regressed.')
+        parser.add_argument('--keepdb', action='store_true')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            cache.clear()
+            results = self.run_benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.report(results)
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                regressions = self.compare(results, json.load(baseline_file), options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions found:\n' + '\n'.join(regressions))
+
+    def run_benchmark(self, options):
+        organisation = seed(
+            organisations=options['organisations'],
+            agents=options['agents'],
+            categories=options['categories'],
+            leads=options['leads'],
+            followups=options['followups'],
+            random_seed=options['seed'],
+        )[0]
+        organizer, agent_user = organisation.organizer, organisation.agents[0]
+        roles = {
+            'organizer': (organizer, Lead.objects.filter(organisation__user=organizer)),
+            'agent': (agent_user, Lead.objects.filter(agent__user=agent_user)),
+        }
+        results = {}
+        for role, (user, leads) in roles.items():
+            client = Client()
+            client.force_login(user)
+            lead = leads.first()
+            objects = {
+                'lead': lead,
+                'category': Category.objects.filter(organisation__user=organizer).first(),
+                'followup': FollowUp.objects.filter(lead__in=leads).first(),
+                'agent': organisation.agents[0].agent,
+                'upload': AttachmentUpload.objects.create(lead=lead, user=user, file_name='benchmark.txt', size=1),
+            }
+            for route, needs_pk in discover_routes():
+                kwargs = {'pk': self.object_for(route, objects).pk} if needs_pk else {}
+                results[f'{role} {route}'] = self.measure(
+                    client, reverse(route, kwargs=kwargs), QUERY_STRINGS.get(route, {}), options['repeat']
+                )
+        return results
+
+    @staticmethod
+    def object_for(route, objects):
+        namespace, name = route.split(':')
+        if namespace == 'agents':
+            return objects['agent']
+        if name.startswith('category'):
+            return objects['category']
+        if name in ('lead-followup-update', 'lead-followup-delete'):
+            return objects['followup']
+        if name == 'attachment-upload':
+            return objects['upload']
+        return objects['lead']
+
+    @staticmethod
+    def measure(client, url, data, repeat):
+        client.get(url, data)
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = client.get(url, data)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - start) * 1000)
+        return {
+            'url': url,
+            'status': response.status_code,
+            'queries': len(queries),
+            'p50_ms': round(_percentile(timings, 50), 3),
+            'p95_ms': round(_percentile(timings, 95), 3),
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"route":<45} {"status":>6} {"queries":>7} {"p50 ms":>9} {"p95 ms":>9}')
+        for key, result in sorted(results.items()):
+            self.stdout.write(f'{key:<45} {result["status"]:>6} {result["queries"]:>7} '
+                              f'{result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f}')
+
+    @staticmethod
+    def compare(results, baseline, tolerance):
+        regressions = []
+        for key, result in sorted(results.items()):
+            previous = baseline.get(key)
+            if previous is None:
+                continue
+            if result['queries'] > previous['queries']:
+                regressions.append(f'{key}: {previous["queries"]} -> {result["queries"]} queries')
+            if result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                regressions.append(f'{key}: p95 {previous["p95_ms"]:.2f} -> {result["p95_ms"]:.2f} ms')
+        return regressions
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+
+def login_cookie(username):
+    user = get_user_model().objects.get(username=username)
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+class Command(BaseCommand):
+    help = ('Load a running server with many concurrent keep-alive connections and report requests/second '
+            'and latency percentiles. Run it against the WSGI deployment and against crm_system.asgi with '
+            'ASYNC_VIEWS on, saving one run and comparing the other with --compare.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='e.g. http://127.0.0.1:8000/lead/')
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for.')
+        parser.add_argument('--user', help='Send the requests logged in as this username.')
+        parser.add_argument('--save', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='JSON file from an earlier run to compare against.')
+
+    def handle(self, *args, **options):
+        cookie = login_cookie(options['user']) if options['user'] else None
+        results = {}
+        for url in options['urls']:
+            results[url] = asyncio.run(self.run(url, cookie, options['concurrency'], options['duration']))
+            self.report(url, results[url])
+        if options['save']:
+            with open(options['save'], 'w') as results_file:
+                json.dump(results, results_file, indent=2)
+        if options['compare']:
+            with open(options['compare']) as results_file:
+                self.compare(results, json.load(results_file))
+
+    async def run(self, url, cookie, concurrency, duration):
+        parts = urlsplit(url)
+        if parts.scheme != 'http':
+            raise CommandError('Only plain http:// URLs are supported.')
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        request = f'GET {path or "/"} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+        if cookie:
+            request += f'Cookie: {cookie}\r\n'
+        request = (request + '\r\n').encode()
+
+        latencies, failures = [], 0
+        deadline = time.perf_counter() + duration
+
+        async def connection():
+            nonlocal failures
+            reader = writer = None
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+                    writer.write(request)
+                    status, keep_alive = await read_response(reader)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    failures += 1
+                    writer = None
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if status >= 400:
+                    failures += 1
+                if not keep_alive:
+                    writer.close()
+                    writer = None
+            if writer is not None:
+                writer.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else [0] * 99
+        return {
+            'requests': len(latencies),
+            'failures': failures,
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentiles[49] * 1000, 1),
+            'p95_ms': round(percentiles[94] * 1000, 1),
+            'p99_ms': round(percentiles[98] * 1000, 1),
+        }
+
+    def report(self, url, result):
+        self.stdout.write(
+            f'{url}: {result["requests"]} requests, {result["failures"]} failed, {result["rps"]} req/s, '
+            f'p50 {result["p50_ms"]} ms, p95 {result["p95_ms"]} ms, p99 {result["p99_ms"]} ms'
+        )
+
+    def compare(self, results, baseline):
+        for url, result in results.items():
+            previous = baseline.get(url)
+            if previous is None:
+                continue
+            self.stdout.write(
+                f'{url}: req/s {previous["rps"]} -> {result["rps"]}, '
+                f'p95 {previous["p95_ms"]} -> {result["p95_ms"]} ms, p99 {previous["p99_ms"]} -> {result["p99_ms"]} ms'
+            )
@@ -0,0 +1,35 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from crm_system.main.tasks import release_stale_tasks, run_batch
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks such as outgoing mail.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling.')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('tasks')
+        release_stale_tasks()
+        processed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                claimed = run_batch(executor, options['batch_size'])
+                processed += claimed
+                if claimed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                release_stale_tasks()
+        self.stdout.write(f'Processed {processed} task(s).')
@@ -0,0 +1,65 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+from crm_system.main.instrumentation import RequestMetrics, current_metrics, record_query
+
+logger = logging.getLogger('crm_system.requests')
+
+
+class RequestMetricsMiddleware(MiddlewareMixin):
+    """
+    Time SQL and template rendering for every request.
+
+    Adds a ``Server-Timing`` header, logs requests slower than
+    ``REQUEST_METRICS_SLOW_MS`` and feeds the histograms served on ``/metrics``.
+    The middleware removes itself when ``REQUEST_METRICS_ENABLED`` is off.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        super(RequestMetricsMiddleware, self).__init__(get_response)
+        self.slow_threshold = getattr(settings, 'REQUEST_METRICS_SLOW_MS', 500) / 1000
+
+    def process_request(self, request):
+        # One wrapper per connection, left in place, rather than execute_wrapper() per request: under
+        # ASGI every request shares the thread-sensitive connection, so per-request wrappers would stack.
+        request.metrics = RequestMetrics()
+        current_metrics.set(request.metrics)
+        for connection in connections.all():
+            if record_query not in connection.execute_wrappers:
+                connection.execute_wrappers.append(record_query)
+
+    def process_response(self, request, response):
+        metrics = getattr(request, 'metrics', None)
+        if metrics is None:
+            return response
+        current_metrics.set(None)
+
+        total = metrics.elapsed
+        view = request.resolver_match.view_name if request.resolver_match else '<unresolved>'
+        metrics.record(view, total)
+        response['Server-Timing'] = metrics.server_timing(total)
+        if total >= self.slow_threshold:
+            logger.warning(
+                'Slow request %s %s (%s): %.0f ms total, %d queries in %.0f ms, templates %.0f ms, '
+                'slowest query %.0f ms: %s',
+                request.method, request.path, view, total * 1000, metrics.query_count, metrics.sql_time * 1000,
+                metrics.template_time * 1000, metrics.slowest_time * 1000, metrics.slowest_sql,
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # Listed first in MIDDLEWARE, this hook runs last, immediately before the response is rendered.
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.metrics.template_time += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,24 @@
+# Generated by Django 4.1.4 on 2026-10-18 04:10
+
+from django.db import migrations, models
+
+
+def start_heartbeats(apps, schema_editor):
+    Task = apps.get_model('main', 'Task')
+    Task.objects.filter(status='running').update(heartbeat_at=models.F('locked_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_heartbeats, migrations.RunPython.noop),
+    ]
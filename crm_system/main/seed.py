@@ -0,0 +1,111 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from crm_system.agents.models import User, Profile, Agent
+from crm_system.leads.contacts import set_contact_fields
+from crm_system.leads.dedup import set_blocking_keys
+from crm_system.leads.models import Category, Lead, FollowUp
+from crm_system.leads.search import refresh_search_index
+
+FIRST_NAMES = ('Anna', 'Boris', 'Chloe', 'Dimitar', 'Elena', 'Filip', 'Georgi', 'Hana', 'Ivan', 'Julia',
+               'Kaloyan', 'Lora', 'Maria', 'Nikolay', 'Olga', 'Petar', 'Radka', 'Stefan', 'Teodora', 'Viktor')
+LAST_NAMES = ('Ivanov', 'Petrova', 'Smith', 'Dimitrov', 'Georgieva', 'Jones', 'Nikolov', 'Todorova',
+              'Brown', 'Stoyanov', 'Angelova', 'Miller', 'Kolev', 'Hristova', 'Wilson')
+CATEGORY_NAMES = ('Converted', 'Contacted', 'Qualified', 'Proposal', 'Lost', 'Nurturing')
+PASSWORD = 'benchmark'
+BATCH_SIZE = 5000
+
+
+class SeededOrganisation:
+    def __init__(self, organizer, agents):
+        self.organizer = organizer
+        self.agents = agents
+
+
+def _batches(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@transaction.atomic
+def seed(organisations=2, agents=5, categories=5, leads=1000, followups=1, random_seed=0, prefix='bench'):
+    """
+    Bulk-create a deterministic data set: for each organisation an organizer,
+    ``agents`` agents, ``categories`` categories (the first one converted),
+    ``leads`` leads spread over the past year and ``followups`` follow-ups per lead.
+    """
+    rnd = random.Random(random_seed)
+    password = make_password(PASSWORD)
+    now = timezone.now()
+    seeded = []
+
+    for index in range(organisations):
+        organizer = User.objects.create(username=f'{prefix}-org-{index}', password=password,
+                                        email=f'{prefix}-org-{index}@example.com')
+        organisation = Profile.objects.get(user=organizer)
+
+        agent_users = User.objects.bulk_create([
+            User(username=f'{prefix}-org-{index}-agent-{number}', password=password, is_organizer=False,
+                 is_agent=True, first_name=rnd.choice(FIRST_NAMES), last_name=rnd.choice(LAST_NAMES),
+                 email=f'{prefix}-org-{index}-agent-{number}@example.com')
+            for number in range(agents)
+        ])
+        Profile.objects.bulk_create([Profile(user=user) for user in agent_users])
+        Agent.objects.bulk_create([Agent(user=user, organisation=organisation) for user in agent_users])
+        agent_ids = list(Agent.objects.filter(organisation=organisation).order_by('id').values_list('id', flat=True))
+
+        Category.objects.bulk_create([
+            Category(name=CATEGORY_NAMES[number % len(CATEGORY_NAMES)], organisation=organisation,
+                     is_converted=number == 0)
+            for number in range(categories)
+        ])
+        category_ids = list(Category.objects.filter(organisation=organisation).order_by('id')
+                            .values_list('id', flat=True))
+        converted_id = category_ids[0] if category_ids else None
+
+        objects, dates = [], []
+        for number in range(leads):
+            first_name, last_name = rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)
+            date_added = now - datetime.timedelta(minutes=rnd.randrange(365 * 24 * 60))
+            dates.append(date_added)
+            category_id = rnd.choice(category_ids) if category_ids and rnd.random() < 0.6 else None
+            objects.append(Lead(
+                first_name=first_name,
+                last_name=last_name,
+                age=rnd.randint(18, 80),
+                organisation=organisation,
+                agent_id=rnd.choice(agent_ids) if agent_ids and rnd.random() < 0.7 else None,
+                category_id=category_id,
+                description=f'Interested in plan {rnd.randint(1, 9)}',
+                phone_number=f'+359 88{rnd.randrange(10 ** 7):07d}',
+                email=f'{first_name}.{last_name}.{index}.{number}@example.com'.lower(),
+                converted_date=date_added + datetime.timedelta(days=rnd.randint(0, 30))
+                if category_id is not None and category_id == converted_id else None,
+            ))
+        # bulk_create skips the pre_save signal that fills the lookup columns.
+        for lead in objects:
+            set_contact_fields(lead)
+            set_blocking_keys(lead)
+        for batch in _batches(objects):
+            Lead.objects.bulk_create(batch)
+        # auto_now_add stamps every row with now on insert; spread the leads over the year again.
+        for lead, date_added in zip(objects, dates):
+            lead.date_added = date_added
+        for batch in _batches(objects):
+            Lead.objects.bulk_update(batch, ['date_added'])
+
+        notes = []
+        for lead in objects:
+            for _ in range(followups):
+                notes.append(FollowUp(lead_id=lead.pk, notes=f'Called about plan {rnd.randint(1, 9)}'))
+        for batch in _batches(notes):
+            FollowUp.objects.bulk_create(batch)
+        for batch in _batches([lead.pk for lead in objects]):
+            refresh_search_index(batch)
+
+        seeded.append(SeededOrganisation(organizer, agent_users))
+    return seeded
@@ -0,0 +1,200 @@
+import datetime
+import logging
+import threading
+import uuid
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from crm_system.main.models import Task
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_DELAY = datetime.timedelta(seconds=30)
+RETRY_MAX_DELAY = datetime.timedelta(hours=1)
+HEARTBEAT_INTERVAL = datetime.timedelta(seconds=30)
+# A running task whose worker has not beaten for this long is taken to have lost its worker.
+STALE_AFTER = datetime.timedelta(minutes=5)
+
+registry = {}
+
+
+def task(name, batched=False, bind=False):
+    """
+    Register a task handler under ``name``.
+
+    Plain handlers are called once per task with its payload, and with the
+    ``Task`` itself first when ``bind`` is set, so they can record progress
+    with ``save_checkpoint``. Batched handlers are called once per claimed
+    batch with the list of tasks and return a ``{task.id: exception}``
+    mapping for the tasks that failed.
+    """
+    def decorator(func):
+        registry[name] = (func, batched, bind)
+        return func
+    return decorator
+
+
+def enqueue(name, run_at=None, max_attempts=5, **payload):
+    return Task.objects.create(
+        name=name,
+        payload=payload,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts,
+    )
+
+
+def save_checkpoint(queued, **checkpoint):
+    """
+    Store how far a running task got in its payload, where a retry or a run
+    reclaimed from a dead worker finds it as the ``checkpoint`` argument.
+    Call it in the transaction that commits the work it describes.
+    """
+    queued.payload['checkpoint'] = checkpoint
+    Task.objects.filter(pk=queued.pk).update(payload=queued.payload)
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    return enqueue('mail.send', subject=subject, message=message, from_email=from_email,
+                   recipient_list=list(recipient_list))
+
+
+@task('mail.send', batched=True)
+def send_mail_batch(tasks):
+    errors = {}
+    with get_connection() as mail_connection:
+        for queued in tasks:
+            payload = queued.payload
+            message = EmailMessage(
+                subject=payload['subject'],
+                body=payload['message'],
+                from_email=payload['from_email'],
+                to=payload['recipient_list'],
+                connection=mail_connection,
+            )
+            try:
+                message.send()
+            except Exception as exc:
+                errors[queued.id] = exc
+    return errors
+
+
+def release_stale_tasks(now=None):
+    """Put back running tasks whose worker stopped refreshing their heartbeat, however long they have run."""
+    now = now or timezone.now()
+    return Task.objects.filter(status=Task.RUNNING, heartbeat_at__lt=now - STALE_AFTER).update(
+        status=Task.PENDING, locked_by='', heartbeat_at=None
+    )
+
+
+class Heartbeat(threading.Thread):
+    """Refresh ``heartbeat_at`` of the running tasks claimed with ``token`` until stopped."""
+
+    def __init__(self, token, interval=HEARTBEAT_INTERVAL):
+        super(Heartbeat, self).__init__(name=f'task-heartbeat-{token[:8]}', daemon=True)
+        self.token = token
+        self.interval = interval.total_seconds()
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                Task.objects.filter(locked_by=self.token, status=Task.RUNNING).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def claim_tasks(batch_size, now=None):
+    """
+    Claim up to ``batch_size`` due tasks for this worker.
+
+    PostgreSQL skips rows other workers hold with ``FOR UPDATE SKIP LOCKED``.
+    Elsewhere the conditional ``UPDATE`` on the pending status is the lock:
+    the database serialises writers, so each task is stamped by one worker.
+    """
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    due = Task.objects.filter(status=Task.PENDING, run_at__lte=now).order_by('run_at', 'id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        Task.objects.filter(id__in=ids, status=Task.PENDING).update(
+            status=Task.RUNNING, locked_at=now, locked_by=token, heartbeat_at=now
+        )
+    return list(Task.objects.filter(locked_by=token, status=Task.RUNNING).order_by('run_at', 'id'))
+
+
+def _run_group(name, tasks):
+    try:
+        handler, batched, bind = registry[name]
+    except KeyError:
+        return {queued.id: LookupError(f'No handler registered for task {name!r}') for queued in tasks}
+    try:
+        if batched:
+            return handler(tasks)
+        errors = {}
+        for queued in tasks:
+            try:
+                if bind:
+                    handler(queued, **queued.payload)
+                else:
+                    handler(**queued.payload)
+            except Exception as exc:
+                errors[queued.id] = exc
+        return errors
+    except Exception as exc:
+        return {queued.id: exc for queued in tasks}
+    finally:
+        close_old_connections()
+
+
+def _finish(tasks, errors, now):
+    succeeded = [queued.id for queued in tasks if queued.id not in errors]
+    Task.objects.filter(id__in=succeeded).delete()
+    for queued in tasks:
+        exc = errors.get(queued.id)
+        if exc is None:
+            continue
+        logger.warning('Task %s failed: %s', queued, exc)
+        queued.attempts += 1
+        queued.last_error = repr(exc)
+        queued.locked_at = None
+        queued.locked_by = ''
+        queued.heartbeat_at = None
+        if queued.attempts >= queued.max_attempts:
+            queued.status = Task.FAILED
+        else:
+            queued.status = Task.PENDING
+            delay = min(RETRY_BASE_DELAY * 2 ** (queued.attempts - 1), RETRY_MAX_DELAY)
+            queued.run_at = now + delay
+        queued.save(update_fields=[
+            'attempts', 'last_error', 'locked_at', 'locked_by', 'heartbeat_at', 'status', 'run_at',
+        ])
+
+
+def run_batch(executor, batch_size):
+    """Claim, run and settle one batch of tasks. Return how many tasks were claimed."""
+    tasks = claim_tasks(batch_size)
+    if not tasks:
+        return 0
+    groups = {}
+    for queued in tasks:
+        groups.setdefault(queued.name, []).append(queued)
+    heartbeat = Heartbeat(tasks[0].locked_by)
+    heartbeat.start()
+    try:
+        futures = [executor.submit(_run_group, name, group) for name, group in groups.items()]
+        errors = {}
+        for future in futures:
+            errors.update(future.result())
+    finally:
+        heartbeat.stop()
+    _finish(tasks, errors, timezone.now())
+    return len(tasks)
+
@@ -1,3 +1,256 @@
-from django.test import TestCase
+import contextvars
+import datetime
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from crm_system.agents.models import User
+from crm_system.leads.models import Category, FollowUp, Lead
+from crm_system.main import tasks
+from crm_system.main.instrumentation import Histogram, RequestMetrics, current_metrics, record_query
+from crm_system.main.management.commands import benchmark
+from crm_system.main.models import Task
+from crm_system.main.seed import seed
+from crm_system.main.tasks import (
+    RETRY_BASE_DELAY, STALE_AFTER, claim_tasks, enqueue, queue_mail, release_stale_tasks, run_batch, save_checkpoint,
+)
+
+
+class InlineExecutor:
+    """Runs submitted calls straight away, so the tasks share the test's transaction."""
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.handlers = mock.patch.dict(tasks.registry)
+        self.handlers.start()
+        self.addCleanup(self.handlers.stop)
+
+    def register(self, name, func, **options):
+        tasks.task(name, **options)(func)
+
+    def test_claims_due_tasks_once(self):
+        due = [enqueue('test.noop') for _ in range(3)]
+        enqueue('test.noop', run_at=timezone.now() + datetime.timedelta(hours=1))
+        first = claim_tasks(2)
+        second = claim_tasks(10)
+        self.assertEqual([task.pk for task in first], [task.pk for task in due[:2]])
+        self.assertEqual([task.pk for task in second], [due[2].pk])
+        self.assertEqual(claim_tasks(10), [])
+        self.assertEqual(Task.objects.filter(status=Task.RUNNING).count(), 3)
+        self.assertTrue(all(task.heartbeat_at for task in first + second))
+
+    def test_successful_tasks_are_deleted(self):
+        queue_mail('Hello', 'Body', 'from@example.com', ['to@example.com'])
+        self.assertEqual(run_batch(InlineExecutor(), 10), 1)
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['to@example.com'])
+
+    def test_failed_task_is_retried_with_backoff_then_given_up(self):
+        self.register('test.fail', mock.Mock(side_effect=RuntimeError('boom')))
+        queued = enqueue('test.fail', max_attempts=2)
+        before = timezone.now()
+        with self.assertLogs('crm_system.main.tasks', 'WARNING'):
+            run_batch(InlineExecutor(), 10)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.locked_by), (Task.PENDING, 1, ''))
+        self.assertIsNone(queued.heartbeat_at)
+        self.assertIn('boom', queued.last_error)
+        self.assertGreaterEqual(queued.run_at, before + RETRY_BASE_DELAY)
+        self.assertEqual(run_batch(InlineExecutor(), 10), 0)
+
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        with self.assertLogs('crm_system.main.tasks', 'WARNING'):
+            run_batch(InlineExecutor(), 10)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.FAILED, 2))
+
+    def test_unknown_task_fails(self):
+        queued = enqueue('test.missing', max_attempts=1)
+        with self.assertLogs('crm_system.main.tasks', 'WARNING'):
+            run_batch(InlineExecutor(), 10)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.FAILED)
+        self.assertIn('No handler registered', queued.last_error)
+
+    def test_one_failure_does_not_fail_the_batch(self):
+        self.register('test.divide', lambda value: 1 / value)
+        ok, failing = enqueue('test.divide', value=1), enqueue('test.divide', value=0)
+        with self.assertLogs('crm_system.main.tasks', 'WARNING') as logs:
+            run_batch(InlineExecutor(), 10)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(list(Task.objects.values_list('pk', flat=True)), [failing.pk])
+        self.assertFalse(Task.objects.filter(pk=ok.pk).exists())
+
+    def test_bound_task_resumes_from_its_checkpoint(self):
+        calls = []
+
+        def handler(queued, checkpoint=None):
+            calls.append(checkpoint)
+            save_checkpoint(queued, step=(checkpoint or {}).get('step', 0) + 1)
+            if len(calls) == 1:
+                raise RuntimeError('interrupted')
+
+        self.register('test.resumable', handler, bind=True)
+        queued = enqueue('test.resumable')
+        with self.assertLogs('crm_system.main.tasks', 'WARNING'):
+            run_batch(InlineExecutor(), 10)
+        queued.refresh_from_db()
+        self.assertEqual(queued.payload['checkpoint'], {'step': 1})
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        run_batch(InlineExecutor(), 10)
+        self.assertEqual(calls, [None, {'step': 1}])
+        self.assertFalse(Task.objects.exists())
+
+
+class StaleTaskTests(TestCase):
+    def test_only_tasks_without_a_recent_heartbeat_are_released(self):
+        now = timezone.now()
+        long_running = enqueue('test.noop')
+        abandoned = enqueue('test.noop')
+        Task.objects.update(status=Task.RUNNING, locked_by='worker', locked_at=now - 2 * STALE_AFTER)
+        Task.objects.filter(pk=long_running.pk).update(heartbeat_at=now - datetime.timedelta(seconds=10))
+        Task.objects.filter(pk=abandoned.pk).update(heartbeat_at=now - STALE_AFTER - datetime.timedelta(seconds=1))
+
+        self.assertEqual(release_stale_tasks(now), 1)
+        long_running.refresh_from_db()
+        abandoned.refresh_from_db()
+        self.assertEqual((long_running.status, long_running.locked_by), (Task.RUNNING, 'worker'))
+        self.assertEqual((abandoned.status, abandoned.locked_by), (Task.PENDING, ''))
+        self.assertEqual([task.pk for task in claim_tasks(10)], [abandoned.pk])
+
+
+class SeedTests(TestCase):
+    def test_seed_is_deterministic(self):
+        first = seed(organisations=1, agents=2, categories=3, leads=20, random_seed=7, prefix='a')[0]
+        second = seed(organisations=1, agents=2, categories=3, leads=20, random_seed=7, prefix='b')[0]
+
+        def leads(organisation):
+            return list(
+                Lead.objects.filter(organisation__user=organisation.organizer).order_by('id')
+                .values_list('first_name', 'last_name', 'age', 'phone_number')
+            )
+
+        self.assertEqual(len(leads(first)), 20)
+        self.assertEqual(leads(first), leads(second))
+        self.assertEqual(FollowUp.objects.count(), 40)
+        self.assertEqual(Category.objects.filter(is_converted=True).count(), 2)
+
+    def test_seeded_leads_have_their_lookup_columns(self):
+        seed(organisations=1, agents=1, categories=1, leads=5, random_seed=7)
+        lead = Lead.objects.first()
+        self.assertEqual((lead.email_normalised, lead.email_key), (lead.email, lead.email))
+        self.assertEqual(lead.phone_e164, '+359' + lead.phone_number[5:])
+        self.assertEqual(lead.phone_key, lead.phone_number[-9:])
+        self.assertTrue(lead.name_key)
+        self.assertFalse(Lead.objects.filter(Q(phone_e164='') | Q(phone_key='') | Q(name_key='')).exists())
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_every_route_is_measured(self):
+        options = {'organisations': 1, 'agents': 2, 'categories': 2, 'leads': 10, 'followups': 1, 'seed': 0,
+                   'repeat': 1}
+        # POST-only routes answer the benchmark's GETs with 405.
+        with self.assertLogs('django.request', 'WARNING'):
+            results = benchmark.Command().run_benchmark(options)
+        routes = benchmark.discover_routes()
+        self.assertEqual(len(results), 2 * len(routes))
+        for key, result in results.items():
+            self.assertLess(result['status'], 500, key)
+
+    def test_regressions_are_reported(self):
+        baseline = {'organizer leads:lead-list': {'queries': 5, 'p95_ms': 10.0}}
+        self.assertEqual(benchmark.Command.compare(
+            {'organizer leads:lead-list': {'queries': 5, 'p95_ms': 12.0}}, baseline, 0.25
+        ), [])
+        regressions = benchmark.Command.compare(
+            {'organizer leads:lead-list': {'queries': 6, 'p95_ms': 13.0}}, baseline, 0.25
+        )
+        self.assertEqual(len(regressions), 2)
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_SLOW_MS=60000)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('org', 'org@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def test_server_timing_counts_the_request_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        self.assertRegex(response['Server-Timing'], r'tpl;dur=\d+\.\d, total;dur=')
+
+    def test_the_query_wrapper_is_installed_once(self):
+        for _ in range(3):
+            self.client.get(reverse('dashboard'))
+        self.assertEqual(connection.execute_wrappers.count(record_query), 1)
+
+    @override_settings(REQUEST_METRICS_SLOW_MS=0)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('crm_system.requests', 'WARNING') as logs:
+            self.client.get(reverse('dashboard'))
+        self.assertIn('Slow request GET /dashboard/ (dashboard)', logs.output[0])
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('dashboard'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'crm_request_sql_queries_count{view="dashboard"}')
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class RequestContextTests(TestCase):
+    def test_queries_are_counted_for_the_request_in_context(self):
+        first, second = RequestMetrics(), RequestMetrics()
+        first_context, second_context = contextvars.copy_context(), contextvars.copy_context()
+        first_context.run(current_metrics.set, first)
+        second_context.run(current_metrics.set, second)
+        with connection.execute_wrapper(record_query):
+            first_context.run(Task.objects.count)
+            second_context.run(Task.objects.count)
+            first_context.run(Task.objects.count)
+            Task.objects.count()
+        self.assertEqual((first.query_count, second.query_count), (2, 1))
+
+
+class HistogramTests(TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test.', (0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe('view', value)
+        lines = histogram.render().splitlines()
+        self.assertEqual(lines[2:], [
+            'test_seconds_bucket{view="view",le="0.1"} 1',
+            'test_seconds_bucket{view="view",le="1.0"} 3',
+            'test_seconds_bucket{view="view",le="+Inf"} 4',
+            'test_seconds_count{view="view"} 4',
+            'test_seconds_sum{view="view"} 6.050000',
+        ])
@@ -1,3 +1,16 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views import generic
 
-# Create your views here.
+from crm_system.main.instrumentation import render_metrics
+
+
+class MetricsView(generic.View):
+    """Prometheus scrape endpoint, open to INTERNAL_IPS and staff users."""
+
+    def get(self, request, *args, **kwargs):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            raise Http404
+        if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and not request.user.is_staff:
+            raise Http404
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
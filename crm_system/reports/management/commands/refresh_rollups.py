@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from crm_system.reports.rollups import rebuild_rollups, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold the lead events recorded since the last run into the daily report rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute every rollup from the leads, e.g. for history older than the events.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rows = rebuild_rollups()
+            self.stdout.write(f'Rebuilt {rows} rollup row(s).')
+        events = refresh_rollups(options['batch_size'])
+        self.stdout.write(f'Applied {events} event(s).')
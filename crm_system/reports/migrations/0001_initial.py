@@ -0,0 +1,33 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('leads', '0007_lead_events'),
+        ('agents', '0002_profile_routing_strategy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLeadRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('added', models.PositiveIntegerField(default=0)),
+                ('converted', models.PositiveIntegerField(default=0)),
+                ('agent', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='agents.agent')),
+                ('category', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='leads.category')),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='agents.profile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyleadrollup',
+            constraint=models.UniqueConstraint(fields=('organisation', 'day', 'agent', 'category'), name='rollup_day_key'),
+        ),
+    ]
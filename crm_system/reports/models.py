@@ -0,0 +1,23 @@
+from django.db import models
+
+from crm_system.agents.models import Profile, Agent
+from crm_system.leads.models import Category
+
+
+class DailyLeadRollup(models.Model):
+    """Leads added and converted on one day, per agent and category, in one organisation."""
+    organisation = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    day = models.DateField()
+    agent = models.ForeignKey(Agent, null=True, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    category = models.ForeignKey(Category, null=True, related_name='+', on_delete=models.DO_NOTHING,
+                                 db_constraint=False)
+    added = models.PositiveIntegerField(default=0)
+    converted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['organisation', 'day', 'agent', 'category'], name='rollup_day_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.day}: {self.added} added, {self.converted} converted'
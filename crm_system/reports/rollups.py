@@ -0,0 +1,114 @@
+"""
+Daily rollups of leads added and converted, kept up to date from ``LeadEvent``.
+
+``refresh_rollups`` folds the events recorded since its last run into the
+rows of the days they touched, so reports never group the ``Lead`` table.
+Each lead counts towards the agent and category it had when it was added
+or converted; deleting or reassigning it later does not rewrite history.
+``rebuild_rollups`` recomputes everything from ``Lead`` instead, for the
+history recorded before there were events.
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from crm_system.leads.events import consume_events
+from crm_system.leads.models import Lead, LeadEvent, LeadEventCursor
+from .models import DailyLeadRollup
+
+CONSUMER = 'reports.daily_rollups'
+EVENT_COLUMNS = {LeadEvent.CREATED: 'added', LeadEvent.CONVERTED: 'converted'}
+GROUPS = {'agent': 'agent_id', 'category': 'category_id'}
+
+
+def _key(row):
+    return row.organisation_id, row.day, row.agent_id, row.category_id
+
+
+def apply_events(events):
+    """Add the events to the rollups of the days they occurred on."""
+    deltas = defaultdict(Counter)
+    for event in events:
+        column = EVENT_COLUMNS.get(event.kind)
+        if column is not None:
+            day = timezone.localdate(event.occurred_at)
+            deltas[event.organisation_id, day, event.agent_id, event.category_id][column] += 1
+    if not deltas:
+        return
+    days = defaultdict(set)
+    for organisation_id, day, _, _ in deltas:
+        days[organisation_id].add(day)
+    query = Q()
+    for organisation_id, organisation_days in days.items():
+        query |= Q(organisation_id=organisation_id, day__in=organisation_days)
+    rows = {_key(row): row for row in DailyLeadRollup.objects.select_for_update().filter(query)}
+    new_rows = []
+    for key, delta in deltas.items():
+        row = rows.get(key)
+        if row is None:
+            organisation_id, day, agent_id, category_id = key
+            row = DailyLeadRollup(organisation_id=organisation_id, day=day, agent_id=agent_id, category_id=category_id)
+            new_rows.append(row)
+        row.added += delta['added']
+        row.converted += delta['converted']
+    DailyLeadRollup.objects.bulk_update([row for key, row in rows.items() if key in deltas], ['added', 'converted'])
+    DailyLeadRollup.objects.bulk_create(new_rows)
+
+
+def refresh_rollups(batch_size=1000):
+    """Apply the events recorded since the last refresh. Returns how many were read."""
+    return consume_events(CONSUMER, apply_events, batch_size)
+
+
+@transaction.atomic
+def rebuild_rollups():
+    """Recompute every rollup from the leads, and skip the events they already include."""
+    cursor, _ = LeadEventCursor.objects.select_for_update().get_or_create(name=CONSUMER)
+    position = LeadEvent.objects.aggregate(position=Max('id'))['position'] or 0
+    DailyLeadRollup.objects.all().delete()
+    rows = {}
+    for column, date_field in (('added', 'date_added'), ('converted', 'converted_date')):
+        counts = (
+            Lead.objects.filter(**{f'{date_field}__isnull': False})
+            .annotate(day=TruncDate(date_field))
+            .values('organisation_id', 'day', 'agent_id', 'category_id')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for values in counts:
+            key = values['organisation_id'], values['day'], values['agent_id'], values['category_id']
+            if key not in rows:
+                rows[key] = DailyLeadRollup(organisation_id=key[0], day=key[1], agent_id=key[2], category_id=key[3])
+            setattr(rows[key], column, values['count'])
+    DailyLeadRollup.objects.bulk_create(rows.values(), batch_size=1000)
+    cursor.position = position
+    cursor.save(update_fields=['position', 'updated_at'])
+    return len(rows)
+
+
+def lead_series(organisation_id, start, end, group_by=None, agent_id=None):
+    """
+    Daily ``added`` and ``converted`` counts from ``start`` to ``end`` inclusive,
+    as ``{group: [(day, added, converted), ...]}`` with a row for every day.
+    Without ``group_by`` the only group is None.
+    """
+    queryset = DailyLeadRollup.objects.filter(organisation_id=organisation_id, day__range=(start, end))
+    if agent_id is not None:
+        queryset = queryset.filter(agent_id=agent_id)
+    group_fields = (GROUPS[group_by],) if group_by else ()
+    rows = queryset.values('day', *group_fields).annotate(added=Sum('added'), converted=Sum('converted')).order_by()
+    totals = defaultdict(dict)
+    for row in rows:
+        group = row[group_fields[0]] if group_fields else None
+        totals[group][row['day']] = row['added'], row['converted']
+    if not group_fields:
+        totals.setdefault(None, {})
+    days = [start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return {
+        group: [(day, *by_day.get(day, (0, 0))) for day in days]
+        for group, by_day in totals.items()
+    }
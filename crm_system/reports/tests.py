@@ -0,0 +1,109 @@
+import datetime
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from crm_system.agents.models import Agent, User
+from crm_system.leads.models import Category, Lead
+from crm_system.reports.models import DailyLeadRollup
+from crm_system.reports.rollups import lead_series, rebuild_rollups, refresh_rollups
+
+
+class RollupTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = User.objects.create_user('org', 'org@example.com', 'pw')
+        self.organisation = self.organizer.profile
+        agent_user = User.objects.create_user('agent', 'agent@example.com', 'pw', is_organizer=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+        self.converted = Category.objects.create(name='Converted', organisation=self.organisation, is_converted=True)
+        self.today = timezone.localdate()
+
+    def create_lead(self, **fields):
+        return Lead.objects.create(
+            organisation=self.organisation, first_name='Ada', last_name='Lovelace', description='Interested',
+            phone_number='020 7946 0000', email='ada@example.com', **fields
+        )
+
+    def convert(self, lead):
+        lead = Lead.objects.get(pk=lead.pk)
+        lead.category = self.converted
+        lead.converted_date = timezone.now()
+        lead.save()
+
+
+class RollupTests(RollupTestCase):
+    def test_refresh_folds_new_events_into_the_days(self):
+        first = self.create_lead(agent=self.agent)
+        self.create_lead()
+        self.assertEqual(refresh_rollups(), 2)
+        self.convert(first)
+        refresh_rollups()
+        rows = DailyLeadRollup.objects.values_list('day', 'agent_id', 'category_id', 'added', 'converted')
+        self.assertCountEqual(rows, [
+            (self.today, self.agent.pk, None, 1, 0),
+            (self.today, None, None, 1, 0),
+            (self.today, self.agent.pk, self.converted.pk, 0, 1),
+        ])
+        self.assertEqual(refresh_rollups(), 0)
+
+    def test_rebuild_matches_the_refreshed_rollups(self):
+        self.convert(self.create_lead(agent=self.agent))
+        self.create_lead(category=self.converted, converted_date=timezone.now())
+        refresh_rollups()
+        refreshed = lead_series(self.organisation.pk, self.today, self.today)
+        rebuild_rollups()
+        self.assertEqual(refresh_rollups(), 0)
+        self.assertEqual(lead_series(self.organisation.pk, self.today, self.today), refreshed)
+        self.assertEqual(refreshed, {None: [(self.today, 2, 2)]})
+
+    def test_series_has_a_point_for_every_day(self):
+        self.create_lead(agent=self.agent)
+        refresh_rollups()
+        start = self.today - datetime.timedelta(days=2)
+        series = lead_series(self.organisation.pk, start, self.today)
+        self.assertEqual(series, {None: [
+            (start, 0, 0), (start + datetime.timedelta(days=1), 0, 0), (self.today, 1, 0),
+        ]})
+        self.assertEqual(lead_series(self.organisation.pk, start, self.today, 'agent'), {
+            self.agent.pk: series[None],
+        })
+
+
+class LeadSeriesViewTests(RollupTestCase):
+    def setUp(self):
+        super(LeadSeriesViewTests, self).setUp()
+        self.create_lead(agent=self.agent)
+        self.create_lead()
+        refresh_rollups()
+
+    def get(self, **params):
+        return self.client.get(reverse('reports:lead-series'), params)
+
+    def test_week(self):
+        self.client.force_login(self.organizer)
+        data = self.get(period='week').json()
+        points = data['series'][0]['points']
+        self.assertEqual(len(points), 7)
+        self.assertEqual(points[-1], {'day': self.today.isoformat(), 'added': 2, 'converted': 0})
+
+    def test_grouped_by_agent(self):
+        self.client.force_login(self.organizer)
+        data = self.get(period='week', group_by='agent').json()
+        labels = {series['label']: series['points'][-1]['added'] for series in data['series']}
+        self.assertEqual(labels, {'agent': 1, 'Unassigned': 1})
+
+    def test_agents_only_see_their_leads(self):
+        self.client.force_login(self.agent.user)
+        data = self.get(period='range', start=self.today.isoformat(), end=self.today.isoformat()).json()
+        self.assertEqual(data['series'][0]['points'], [{'day': self.today.isoformat(), 'added': 1, 'converted': 0}])
+
+    def test_invalid_parameters(self):
+        self.client.force_login(self.organizer)
+        for params in ({'period': 'year'}, {'period': 'range', 'start': 'yesterday', 'end': '2024-01-01'},
+                       {'period': 'range', 'start': '2024-01-02', 'end': '2024-01-01'},
+                       {'period': 'range', 'start': '2022-01-01', 'end': '2024-01-01'},
+                       {'group_by': 'colour'}):
+            self.assertEqual(self.get(**params).status_code, 400, params)
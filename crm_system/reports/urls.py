@@ -0,0 +1,9 @@
+from django.urls import path
+
+from crm_system.reports.views import LeadSeriesView
+
+app_name = 'reports'
+
+urlpatterns = [
+    path('leads/series/', LeadSeriesView.as_view(), name='lead-series'),
+]
@@ -0,0 +1,79 @@
+import datetime
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views import generic
+
+from crm_system.agents.models import Agent
+from crm_system.agents.tenancy import get_tenant
+from crm_system.leads.registry import get_category_registry
+from .rollups import GROUPS, lead_series
+
+PERIODS = {'week': 7, 'month': 30}
+MAX_RANGE_DAYS = 366
+
+
+class LeadSeriesView(LoginRequiredMixin, generic.View):
+    """
+    Leads added and converted per day, from the daily rollups.
+
+    ``?period=week`` or ``month`` ends today; ``?period=range`` takes ISO
+    ``start`` and ``end`` dates. ``group_by`` splits the series per ``agent``
+    or ``category``. Agents only see the leads attributed to them.
+    """
+
+    def get_range(self, request):
+        """Return ``(start, end)`` from the query string, or an error response."""
+        period = request.GET.get('period', 'month')
+        today = timezone.localdate()
+        if period in PERIODS:
+            return today - datetime.timedelta(days=PERIODS[period] - 1), today
+        if period != 'range':
+            return JsonResponse({'error': 'period must be week, month or range'}, status=400)
+        try:
+            start = datetime.date.fromisoformat(request.GET.get('start', ''))
+            end = datetime.date.fromisoformat(request.GET.get('end', ''))
+        except ValueError:
+            return JsonResponse({'error': 'start and end must be dates (YYYY-MM-DD)'}, status=400)
+        if not 0 <= (end - start).days < MAX_RANGE_DAYS:
+            return JsonResponse({'error': f'The range must span 1 to {MAX_RANGE_DAYS} days'}, status=400)
+        return start, end
+
+    def get_labels(self, organisation_id, group_by):
+        if group_by == 'agent':
+            labels = dict(Agent.objects.filter(organisation_id=organisation_id).values_list('id', 'user__username'))
+            labels[None] = 'Unassigned'
+        else:
+            labels = dict(get_category_registry(organisation_id).names)
+            labels[None] = 'Uncategorised'
+        return labels
+
+    def get(self, request, *args, **kwargs):
+        period = self.get_range(request)
+        if isinstance(period, JsonResponse):
+            return period
+        start, end = period
+        group_by = request.GET.get('group_by') or None
+        if group_by is not None and group_by not in GROUPS:
+            return JsonResponse({'error': 'group_by must be agent or category'}, status=400)
+        tenant = get_tenant(request.user)
+        agent_id = None if tenant.is_organizer else tenant.agent_id
+        series = lead_series(tenant.organisation_id, start, end, group_by, agent_id)
+        labels = self.get_labels(tenant.organisation_id, group_by) if group_by else {}
+        return JsonResponse({
+            'start': start,
+            'end': end,
+            'group_by': group_by,
+            'series': [
+                {
+                    'key': group,
+                    'label': labels.get(group, str(group)) if group_by else None,
+                    'points': [
+                        {'day': day, 'added': added, 'converted': converted}
+                        for day, added, converted in points
+                    ],
+                }
+                for group, points in series.items()
+            ],
+        })
@@ -12,6 +12,8 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+INTERNAL_IPS = ['127.0.0.1']
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -19,18 +21,22 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'crm_system.leads',
     'crm_system.agents',
     'crm_system.main',
+    'crm_system.reports',
 ]
 
 MIDDLEWARE = [
+    'crm_system.main.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'crm_system.agents.middleware.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,6 +62,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'crm_system.wsgi.application'
 
+# Serve the lead list, detail, JSON and dashboard pages with their async
+# variants; turn on when running under crm_system.asgi.
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -67,6 +77,12 @@ DATABASES = {
     }
 }
 
+# Per-process memory locally; point CACHE_URL at a shared backend in production
+# (e.g. rediscache://127.0.0.1:6379/1) so every worker sees the same counters and version keys.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -101,9 +117,23 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = 'media_root'
+# 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd) hands protected media off to the web server.
+MEDIA_ACCEL = env('MEDIA_ACCEL', default=None)
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 30
+
+# Small uploads stay in memory; larger ones are hashed while they are written next to the attachment blobs.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'crm_system.leads.blobs.HashingFileUploadHandler',
+]
+ATTACHMENT_MAX_SIZE = env.int('ATTACHMENT_MAX_SIZE', default=2 * 1024 ** 3)
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Country calling code assumed for lead phone numbers written without + or 00.
+PHONE_DEFAULT_COUNTRY_CODE = env('PHONE_DEFAULT_COUNTRY_CODE', default='1')
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = env('EMAIL_HOST')
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
@@ -124,4 +154,14 @@ LOGGING = {
         'handlers': ['console'],
         'level': 'WARNING',
     },
+    'loggers': {
+        'crm_system.requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
 }
+
+REQUEST_METRICS_ENABLED = env.bool('REQUEST_METRICS_ENABLED', default=False)
+REQUEST_METRICS_SLOW_MS = env.int('REQUEST_METRICS_SLOW_MS', default=500)
@@ -5,14 +5,17 @@ from django.contrib.auth.views import PasswordResetView, PasswordResetDoneView,
     PasswordResetCompleteView, LoginView, LogoutView
 from django.urls import path, include
 
-from crm_system.leads.views import DashboardView, SignupView
+from crm_system.leads.async_views import AsyncDashboardView
+from crm_system.leads.views import DashboardView, SignupView, ProtectedMediaView
+from crm_system.main.views import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('lead/', include('crm_system.leads.urls')),
     path('agent/', include('crm_system.agents.urls')),
     path('/', include('crm_system.main.urls')),
-    path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('reports/', include('crm_system.reports.urls')),
+    path('dashboard/', (AsyncDashboardView if settings.ASYNC_VIEWS else DashboardView).as_view(), name='dashboard'),
     path('signup/', SignupView.as_view(), name='signup'),
     path('reset-password/', PasswordResetView.as_view(), name='reset-password'),
     path('password-reset-done/', PasswordResetDoneView.as_view(), name='password_reset_done'),
@@ -20,7 +23,8 @@ urlpatterns = [
     path('password-reset-complete/', PasswordResetCompleteView.as_view(), name='password_reset_complete'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', ProtectedMediaView.as_view(), name='media'),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)